@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+
+from wiki.web import bulk_users, passwords
+from wiki.web.passwords import parse_hash
+from wiki.web.user import UserManager, make_user_manager
+
+### run with  python -m unittest .\Tests\account_test\bulk_users_test.py ###
+
+CHEAP = {'n': 2 ** 10, 'r': 8, 'p': 1}
+
+
+class BulkUsersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'users.json'), 'w') as f:
+            json.dump({'ann': {'id': 0, 'active': True, 'authentication_method': 'cleartext',
+                               'password': '1234', 'email': None, 'roles': []}}, f)
+        self.app = Flask(__name__)
+        self.app.config.update(USER_DIR=self.directory, PASSWORD_KDF_PARAMS=CHEAP)
+        passwords.init_app(self.app)
+        bulk_users.init_app(self.app)
+
+    def tearDown(self):
+        self.app.extensions['password_hasher'].shutdown()
+        shutil.rmtree(self.directory)
+
+    def lines(self, *records):
+        return [json.dumps(record) + '\n' for record in records]
+
+    def test_import_writes_once(self):
+        saves = []
+        user_manager = UserManager(self.directory)
+        save = user_manager._save
+        user_manager._save = lambda data: (saves.append(len(data)), save(data))
+        records = [{'name': 'user%d' % i, 'password': 'secret%d' % i} for i in range(20)]
+        with self.app.app_context():
+            result = bulk_users.import_users(user_manager, self.lines(*records), workers=4)
+            self.assertEqual(result, (20, 0, []))
+            self.assertEqual(saves, [21])
+            user = user_manager.get_user('user7')
+            self.assertEqual(parse_hash(user.get('hash')), ('scrypt', CHEAP))
+            self.assertTrue(user.check_password('secret7'))
+
+    def test_invalid_lines_import_nothing(self):
+        lines = self.lines({'name': 'bob', 'password': 'x'}, {'name': 'carl'},
+                           {'name': 'bob', 'password': 'y'}, {'name': 'dan', 'password': 'z',
+                                                              'roles': 'admin'})
+        lines.insert(1, 'not json\n')
+        with self.app.app_context():
+            result = bulk_users.import_users(UserManager(self.directory), lines)
+        self.assertEqual([number for number, _ in result.errors], [2, 3, 4, 5])
+        self.assertEqual(result.added, 0)
+        self.assertEqual(list(UserManager(self.directory).read()), ['ann'])
+
+    def test_existing_users_are_skipped_or_replaced(self):
+        user_manager = UserManager(self.directory)
+        lines = self.lines({'name': 'ann', 'password': 'new', 'email': 'ann@example.com'},
+                           {'name': 'bob', 'password': 'x'})
+        with self.app.app_context():
+            self.assertEqual(bulk_users.import_users(user_manager, lines), (1, 1, []))
+            self.assertIsNone(user_manager.get_user('ann').get('email'))
+            self.assertEqual(bulk_users.import_users(user_manager, lines, replace=True),
+                             (2, 0, []))
+            self.assertTrue(user_manager.get_user('ann').check_password('new'))
+
+    def test_export_and_import_into_sqlite(self):
+        runner = self.app.test_cli_runner()
+        export_file = os.path.join(self.directory, 'users.jsonl')
+        with self.app.app_context():
+            UserManager(self.directory).get_user('ann').check_password('1234')
+        result = runner.invoke(args=['users', 'export', export_file])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(export_file) as f:
+            exported = [json.loads(line) for line in f]
+        self.assertEqual([record['name'] for record in exported], ['ann'])
+
+        target = os.path.join(self.directory, 'sqlite')
+        os.mkdir(target)
+        self.app.config.update(USER_DIR=target, USER_BACKEND='sqlite')
+        result = runner.invoke(args=['users', 'import', export_file])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Imported 1 users', result.output)
+        user_manager = make_user_manager(target, 'sqlite')
+        try:
+            ann = user_manager.get_user('ann')
+            self.assertEqual(ann.get('hash'), exported[0]['hash'])
+            self.assertEqual(ann.get('id'), 0)
+            with self.app.app_context():
+                self.assertTrue(ann.check_password('1234'))
+        finally:
+            user_manager.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from flask import Flask
+
+from wiki.web.passwords import HasherBusy, PasswordHasher, hash_password, init_app, \
+    parse_hash, verify_password
+from wiki.web.user import UserManager, check_hashed_password, make_salted_hash
+
+### run with  python -m unittest .\Tests\account_test\password_hashing_test.py ###
+
+CHEAP = {'n': 2 ** 10, 'r': 8, 'p': 1}
+
+
+class PasswordHashingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.app.config['PASSWORD_KDF_PARAMS'] = CHEAP
+        init_app(self.app)
+
+    def tearDown(self):
+        self.app.extensions['password_hasher'].shutdown()
+        shutil.rmtree(self.directory)
+
+    def write_users(self, users):
+        with open(os.path.join(self.directory, 'users.json'), 'w') as f:
+            json.dump(users, f)
+
+    def test_hash_and_verify(self):
+        for algorithm, params in (('scrypt', CHEAP), ('pbkdf2_sha256', {'iterations': 1000})):
+            encoded = hash_password('secret', algorithm, params)
+            self.assertEqual(parse_hash(encoded), (algorithm, params))
+            self.assertTrue(verify_password('secret', encoded))
+            self.assertFalse(verify_password('Secret', encoded))
+        self.assertNotEqual(hash_password('secret', params=CHEAP), hash_password('secret', params=CHEAP))
+
+    def test_salted_sha512_still_verifies(self):
+        legacy = make_salted_hash('secret')
+        self.assertTrue(check_hashed_password('secret', legacy))
+        self.assertTrue(verify_password('secret', legacy))
+        self.assertFalse(verify_password('other', legacy))
+        self.assertTrue(PasswordHasher(params=CHEAP).needs_rehash(legacy))
+
+    def test_login_rehashes_outdated_passwords(self):
+        self.write_users({
+            'ann': {'active': True, 'roles': [], 'authentication_method': 'hash',
+                    'hash': hash_password('secret', params=dict(CHEAP, n=2 ** 11))},
+            'bob': {'active': True, 'roles': [], 'authentication_method': 'cleartext',
+                    'password': '1234'},
+        })
+        user_manager = UserManager(self.directory)
+        with self.app.app_context():
+            self.assertFalse(user_manager.get_user('ann').check_password('wrong'))
+            self.assertEqual(parse_hash(user_manager.get_user('ann').get('hash'))[1]['n'], 2 ** 11)
+            self.assertTrue(user_manager.get_user('ann').check_password('secret'))
+            self.assertTrue(user_manager.get_user('bob').check_password('1234'))
+            ann, bob = user_manager.get_user('ann'), user_manager.get_user('bob')
+            self.assertEqual(parse_hash(ann.get('hash')), ('scrypt', CHEAP))
+            self.assertEqual(bob.get('authentication_method'), 'hash')
+            self.assertIsNone(bob.get('password'))
+            self.assertTrue(bob.check_password('1234'))
+
+    def test_new_users_are_hashed(self):
+        self.write_users({})
+        with self.app.app_context():
+            user = UserManager(self.directory).add_user('ann', 'secret', email=None)
+            self.assertEqual(parse_hash(user.get('hash')), ('scrypt', CHEAP))
+            self.assertTrue(user.check_password('secret'))
+
+    def test_busy_hasher_turns_callers_away(self):
+        hasher = PasswordHasher(params=CHEAP, workers=1, max_pending=0)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+        thread = threading.Thread(target=hasher._run, args=(block,))
+        thread.start()
+        started.wait()
+        try:
+            self.assertRaises(HasherBusy, hasher.hash, 'secret')
+        finally:
+            release.set()
+            thread.join()
+        self.assertTrue(verify_password('secret', hasher.hash('secret')))
+        hasher.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
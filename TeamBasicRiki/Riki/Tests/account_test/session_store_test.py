@@ -0,0 +1,53 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+
+from wiki.web.sessions import SessionStore, init_app
+from wiki.web.user import UserManager
+
+### run with  python -m unittest .\Tests\account_test\session_store_test.py ###
+
+
+class SessionStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_in_memory(self):
+        sessions = SessionStore()
+        self.assertFalse(sessions.is_authenticated('ann'))
+        sessions.login('ann')
+        self.assertTrue(sessions.is_authenticated('ann'))
+        sessions.logout('ann')
+        self.assertIsNone(sessions.logged_in_since('ann'))
+
+    def test_persisted_sessions_are_shared(self):
+        path = os.path.join(self.directory, 'sessions.sqlite3')
+        SessionStore(path).login('ann')
+        self.assertTrue(SessionStore(path).is_authenticated('ann'))
+        SessionStore(path).logout('ann')
+        self.assertFalse(SessionStore(path).is_authenticated('ann'))
+
+    def test_login_does_not_write_the_user_file(self):
+        users_file = os.path.join(self.directory, 'users.json')
+        with open(users_file, 'w') as f:
+            json.dump({'ann': {'active': True, 'roles': []}}, f)
+        modified = os.stat(users_file).st_mtime_ns
+        app = Flask(__name__)
+        init_app(app)
+        with app.app_context():
+            user = UserManager(self.directory).get_user('ann')
+            self.assertFalse(user.is_authenticated())
+            app.extensions['session_store'].login('ann')
+            self.assertTrue(user.is_authenticated())
+        self.assertEqual(os.stat(users_file).st_mtime_ns, modified)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from flask import Flask
+
+from wiki.web import close_users, current_users
+from wiki.web.user import SQLiteUserManager, make_user_manager
+
+### run with  python -m unittest .\Tests\account_test\sqlite_user_manager_test.py ###
+
+
+class SQLiteUserManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'users.json'), 'w') as f:
+            json.dump({'ann': {'id': 0, 'active': True, 'authentication_method': 'cleartext',
+                               'password': '1234', 'email': 'ann@example.com', 'roles': []}}, f)
+        self.user_manager = make_user_manager(self.directory, 'sqlite')
+
+    def tearDown(self):
+        self.user_manager.close()
+        shutil.rmtree(self.directory)
+
+    def test_users_json_is_migrated_once(self):
+        self.assertIsInstance(self.user_manager, SQLiteUserManager)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'users.json')))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'users.json.migrated')))
+        user = self.user_manager.get_user('ann')
+        self.assertTrue(user.check_password('1234'))
+        self.assertEqual(self.user_manager.get_user_by_id(0).name, 'ann')
+        self.assertEqual(self.user_manager.get_user_by_email('ann@example.com').name, 'ann')
+
+    def test_journal_mode_is_wal(self):
+        self.assertEqual(self.user_manager.db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_add_update_delete(self):
+        with self.app.app_context():
+            user = self.user_manager.add_user('bob', 'secret', email='bob@example.com')
+            self.assertFalse(self.user_manager.add_user('bob', 'other', email=None))
+        user.set('email', 'robert@example.com')
+        other = SQLiteUserManager(self.directory)
+        try:
+            self.assertEqual(other.get_user('bob').get('email'), 'robert@example.com')
+            self.assertEqual(sorted(other.read()), ['ann', 'bob'])
+        finally:
+            other.close()
+        self.assertTrue(self.user_manager.delete_user('bob'))
+        self.assertFalse(self.user_manager.delete_user('bob'))
+        self.assertIsNone(self.user_manager.get_user('bob'))
+
+    def test_connection_is_closed_with_the_app_context(self):
+        self.app.config.update(USER_DIR=self.directory, USER_BACKEND='sqlite')
+        self.app.teardown_appcontext(close_users)
+        with self.app.app_context():
+            db = current_users.db
+            self.assertEqual(current_users.get_user('ann').name, 'ann')
+        self.assertRaises(sqlite3.ProgrammingError, db.execute, 'SELECT 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from wiki.web.user import UserManager
+
+### run with  python -m unittest .\Tests\account_test\user_cache_test.py ###
+
+
+class UserCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.write_users({'ann': {'active': True, 'authentication_method': 'cleartext',
+                                  'password': '1234', 'roles': []}})
+        self.user_manager = UserManager(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_users(self, users):
+        with open(os.path.join(self.directory, 'users.json'), 'w') as f:
+            json.dump(users, f)
+
+    def test_file_is_parsed_once(self):
+        with mock.patch('wiki.web.user.json.loads', wraps=json.loads) as loads:
+            for _ in range(5):
+                self.assertEqual(self.user_manager.get_user('ann').get('password'), '1234')
+            self.assertIsNone(UserManager(self.directory).get_user('bob'))
+        self.assertEqual(loads.call_count, 1)
+
+    def test_changed_file_is_parsed_again(self):
+        self.user_manager.get_user('ann')
+        self.write_users({'bob': {'active': True, 'roles': []}})
+        self.assertIsNone(self.user_manager.get_user('ann'))
+        self.assertIsNotNone(self.user_manager.get_user('bob'))
+
+    def test_own_writes_are_cached(self):
+        user = self.user_manager.get_user('ann')
+        user.data['roles'].append('admin')  # not saved
+        self.assertEqual(self.user_manager.get_user('ann').get('roles'), [])
+        with mock.patch('wiki.web.user.json.loads', wraps=json.loads) as loads:
+            user.set('email', 'ann@example.com')
+            self.assertEqual(self.user_manager.get_user('ann').get('email'), 'ann@example.com')
+            self.user_manager.delete_user('ann')
+            self.assertIsNone(self.user_manager.get_user('ann'))
+        self.assertEqual(loads.call_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from wiki.web.user import UserManager
+
+### run with  python -m unittest .\Tests\account_test\user_file_locking_test.py ###
+
+
+def set_logins(directory, worker, count):
+    user_manager = UserManager(directory)
+    for i in range(count):
+        user_manager.update('user-%d-%d' % (worker, i), {'authenticated': True})
+
+
+class UserFileLockingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'users.json'), 'w') as f:
+            json.dump({}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_file(self):
+        with open(os.path.join(self.directory, 'users.json')) as f:
+            return json.load(f)
+
+    def test_processes_do_not_lose_updates(self):
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=set_logins, args=(self.directory, worker, 20))
+                   for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(self.read_file()), 80)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['users.json', 'users.json.lock'])
+
+    def test_concurrent_changes_are_written_together(self):
+        save = UserManager._save
+
+        def slow_save(manager, data):
+            time.sleep(0.05)
+            save(manager, data)
+        with mock.patch.object(UserManager, '_save', autospec=True, side_effect=slow_save) as saves:
+            threads = [threading.Thread(target=set_logins, args=(self.directory, worker, 1))
+                       for worker in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(self.read_file()), 10)
+        self.assertLess(saves.call_count, 10)
+
+    def test_failed_change_does_not_stop_the_others(self):
+        user_manager = UserManager(self.directory)
+        user_manager.update('ann', {'active': True})
+        self.assertRaises(KeyError, user_manager._submit, lambda users: users['bob'])
+        self.assertTrue(user_manager.delete_user('ann'))
+        self.assertEqual(self.read_file(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import io
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from wiki.web.file_storage import DedupFileManager, FileManager  # run with python -m unittest Tests/file_storage_test/archive_download_test.py
+
+TEXT = b"".join(b"row %d,some,csv,values\n" % i for i in range(5000))
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 8
+
+
+class TestArchiveDownload(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_archive(self, file_manager):
+        file_manager.save_stream("data.csv", io.BytesIO(TEXT))
+        file_manager.save_stream("image.png", io.BytesIO(PNG))
+        body = b"".join(file_manager.stream_archive(["data.csv", "image.png", "data.csv", "missing.txt"]))
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ["data.csv", "image.png"])
+            self.assertEqual(archive.read("data.csv"), TEXT)
+            self.assertEqual(archive.read("image.png"), PNG)
+            self.assertEqual(archive.getinfo("data.csv").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.getinfo("image.png").compress_type, zipfile.ZIP_STORED)
+
+    def test_flat_store(self):
+        self.check_archive(FileManager(self.directory))
+
+    def test_compressed_store(self):
+        file_manager = DedupFileManager(self.directory, compression="xz")
+        try:
+            self.check_archive(file_manager)
+        finally:
+            file_manager.catalog.close()
+
+    def test_files_are_opened_lazily(self):
+        file_manager = FileManager(self.directory)
+        file_manager.save_stream("a.csv", io.BytesIO(TEXT))
+        file_manager.save_stream("b.csv", io.BytesIO(TEXT))
+        chunks = file_manager.stream_archive(["a.csv", "b.csv"])
+        first = next(chunks)
+        file_manager.delete_file("b.csv")
+        with zipfile.ZipFile(io.BytesIO(first + b"".join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ["a.csv"])
+
+
+if __name__ == '__main__':
+    unittest.main()
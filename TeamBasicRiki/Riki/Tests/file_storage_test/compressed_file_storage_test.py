@@ -0,0 +1,78 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+
+from wiki.web.file_storage import DedupFileManager  # run with python -m unittest Tests/file_storage_test/compressed_file_storage_test.py
+
+TEXT = b"".join(b"line %d of a rather repetitive log file\n" % i for i in range(2000))
+RANDOM = os.urandom(64 * 1024)
+
+
+class TestCompressedFileStorage(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.directory = tempfile.mkdtemp()
+        self.file_manager = DedupFileManager(self.directory, compression="gzip")
+
+    def tearDown(self):
+        self.file_manager.catalog.close()
+        shutil.rmtree(self.directory)
+
+    def download(self, name, **headers):
+        with self.app.test_request_context(headers=headers):
+            response = self.file_manager.download_file(name)
+            return response, b"".join(response.response)
+
+    def test_text_is_stored_compressed(self):
+        self.file_manager.save_stream("app.log", io.BytesIO(TEXT))
+        blob = self.file_manager.catalog.get_blob("app.log")
+        self.assertEqual(blob.encoding, "gzip")
+        self.assertEqual(os.path.getsize(self.file_manager.blob_path(blob.sha256)), blob.stored_size)
+        self.assertLess(blob.stored_size, len(TEXT) // 4)
+        with self.file_manager.open_file("app.log") as f:
+            self.assertEqual(f.read(), TEXT)
+        stats = self.file_manager.stats()
+        self.assertEqual((stats["size"], stats["unique"], stats["stored"]), (len(TEXT), len(TEXT), blob.stored_size))
+
+    def test_incompressible_files_are_stored_raw(self):
+        self.file_manager.save_stream("noise.txt", io.BytesIO(RANDOM))
+        self.file_manager.save_stream("archive.txt", io.BytesIO(gzip.compress(TEXT)))
+        self.file_manager.save_stream("small.txt", io.BytesIO(b"tiny"))
+        for name in ("noise.txt", "archive.txt", "small.txt"):
+            self.assertIsNone(self.file_manager.catalog.get_blob(name).encoding)
+
+    def test_sent_encoded_to_accepting_clients(self):
+        self.file_manager.save_stream("app.log", io.BytesIO(TEXT))
+        response, body = self.download("app.log", **{"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(int(response.headers["Content-Length"]), len(body))
+        self.assertEqual(gzip.decompress(body), TEXT)
+
+    def test_decoded_for_other_clients(self):
+        self.file_manager.save_stream("app.log", io.BytesIO(TEXT))
+        response, body = self.download("app.log")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(int(response.headers["Content-Length"]), len(TEXT))
+        self.assertEqual(body, TEXT)
+        response, body = self.download("app.log", Range="bytes=1000-1999")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, TEXT[1000:2000])
+        self.assertEqual(response.headers["Content-Range"], "bytes 1000-1999/%d" % len(TEXT))
+
+    def test_duplicate_keeps_encoding(self):
+        self.file_manager.save_stream("a.log", io.BytesIO(TEXT))
+        self.file_manager.compression = None
+        self.file_manager.save_stream("b.log", io.BytesIO(TEXT))
+        self.assertEqual(self.file_manager.catalog.get_blob("b.log").encoding, "gzip")
+        self.assertEqual(os.listdir(os.path.join(self.directory, "tmp")), [])
+        self.assertEqual(self.download("b.log")[1], TEXT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from wiki.web.file_storage import DedupFileManager  # run with python -m unittest Tests/file_storage_test/dedup_file_storage_test.py
+
+
+class TestDedupFileStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_manager = DedupFileManager(self.directory)
+
+    def tearDown(self):
+        self.file_manager.catalog.close()
+        shutil.rmtree(self.directory)
+
+    def blobs(self):
+        return [name for _, _, files in os.walk(os.path.join(self.directory, "blobs")) for name in files]
+
+    def test_duplicate_content_is_stored_once(self):
+        _, checksum, _ = self.file_manager.save_stream("a.pdf", io.BytesIO(b"same"))
+        self.file_manager.save_stream("b.pdf", io.BytesIO(b"same"))
+        self.assertEqual(self.file_manager.get_downloadable_files(), ["a.pdf", "b.pdf"])
+        self.assertEqual(self.blobs(), [checksum])
+        self.assertTrue(self.file_manager.blob_path(checksum).startswith(
+            os.path.join(self.directory, "blobs", checksum[:2], checksum[2:4])))
+        stats = self.file_manager.stats()
+        self.assertEqual((stats["files"], stats["blobs"], stats["size"], stats["stored"]), (2, 1, 8, 4))
+
+    def test_delete_counts_references(self):
+        _, checksum, _ = self.file_manager.save_stream("a.pdf", io.BytesIO(b"same"))
+        self.file_manager.save_stream("b.pdf", io.BytesIO(b"same"))
+        self.assertTrue(self.file_manager.delete_file("a.pdf"))
+        self.assertEqual(self.blobs(), [checksum])
+        self.assertTrue(self.file_manager.delete_file("b.pdf"))
+        self.assertEqual(self.blobs(), [])
+        self.assertFalse(self.file_manager.delete_file("b.pdf"))
+
+    def test_same_name_is_rejected(self):
+        self.file_manager.save_stream("a.pdf", io.BytesIO(b"one"))
+        file = io.BytesIO(b"two")
+        file.filename = "a.pdf"
+        file.stream = file
+        self.assertFalse(self.file_manager.upload_file(file))
+        self.assertEqual(len(self.blobs()), 1)
+        self.assertEqual(os.listdir(os.path.join(self.directory, "tmp")), [])
+
+    def test_list_files(self):
+        for name, data, uploader in [("b.txt", b"22", "ann"), ("a.txt", b"1", "bob"), ("c_1.txt", b"333", "ann")]:
+            self.file_manager.save_stream(name, io.BytesIO(data), uploader=uploader)
+        files, total = self.file_manager.list_files(sort="size", descending=True, limit=2)
+        self.assertEqual(total, 3)
+        self.assertEqual([(f.name, f.size, f.uploader) for f in files], [("c_1.txt", 3, "ann"), ("b.txt", 2, "ann")])
+        files, total = self.file_manager.list_files(offset=2, limit=2)
+        self.assertEqual(([f.name for f in files], total), (["c_1.txt"], 3))
+        files, total = self.file_manager.list_files(search="_")  # matched literally
+        self.assertEqual(([f.name for f in files], total), (["c_1.txt"], 1))
+
+    def test_flat_files_are_imported(self):
+        with open(os.path.join(self.directory, "old.txt"), "wb") as f:
+            f.write(b"old")
+        file_manager = DedupFileManager(self.directory)
+        self.assertEqual(file_manager.get_downloadable_files(), ["old.txt"])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "old.txt")))
+        file_manager.catalog.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import io
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+
+from wiki.web.file_storage import DedupFileManager, FileManager  # run with python -m unittest Tests/file_storage_test/download_range_test.py
+from wiki.web.ranges import parse_ranges
+
+DATA = bytes(range(256)) * 4  # 1024 bytes
+
+
+class TestDownloadRanges(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.directory = tempfile.mkdtemp()
+        self.file_manager = FileManager(self.directory)
+        self.file_manager.save_stream("data.bin", io.BytesIO(DATA))
+        self.etag = self.file_manager.locate("data.bin")[1]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def download(self, **headers):
+        with self.app.test_request_context(headers=headers):
+            response = self.file_manager.download_file("data.bin")
+            return response, b"".join(response.response)
+
+    def test_full_download(self):
+        response, body = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, DATA)
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertEqual(response.headers["ETag"], '"%s"' % self.etag)
+
+    def test_single_range(self):
+        response, body = self.download(Range="bytes=1000-")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, DATA[1000:])
+        self.assertEqual(response.headers["Content-Range"], "bytes 1000-1023/1024")
+
+    def test_multiple_ranges(self):
+        response, body = self.download(Range="bytes=0-9,100-109")
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.headers["Content-Type"].startswith("multipart/byteranges"))
+        self.assertEqual(int(response.headers["Content-Length"]), len(body))
+        self.assertIn(b"Content-Range: bytes 0-9/1024\r\n\r\n" + DATA[0:10], body)
+        self.assertIn(b"Content-Range: bytes 100-109/1024\r\n\r\n" + DATA[100:110], body)
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.download(Range="bytes=2000-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers["Content-Range"], "bytes */1024")
+
+    def test_if_range(self):
+        response, _ = self.download(Range="bytes=0-9", **{"If-Range": '"%s"' % self.etag})
+        self.assertEqual(response.status_code, 206)
+        response, body = self.download(Range="bytes=0-9", **{"If-Range": '"changed"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, DATA)
+
+    def test_if_none_match(self):
+        response, _ = self.download(**{"If-None-Match": '"%s"' % self.etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_offload_to_front_end(self):
+        self.app.config["FILE_SENDFILE_HEADER"] = "X-Accel-Redirect"
+        response, body = self.download()
+        self.assertEqual(response.headers["X-Accel-Redirect"], "/protected/data.bin")
+        self.assertEqual(body, b"")
+
+    def test_dedup_store_uses_sha256_etag(self):
+        file_manager = DedupFileManager(tempfile.mkdtemp())
+        _, checksum, _ = file_manager.save_stream("data.bin", io.BytesIO(DATA))
+        with self.app.test_request_context(headers={"Range": "bytes=-4"}):
+            response = file_manager.download_file("data.bin")
+            self.assertEqual(b"".join(response.response), DATA[-4:])
+        self.assertEqual(response.headers["ETag"], '"%s"' % checksum)
+        file_manager.catalog.close()
+        shutil.rmtree(file_manager._directory)
+
+    def test_parse_ranges_merges_overlaps(self):
+        self.assertEqual(parse_ranges("bytes=0-9,5-19,30-", 40), [(0, 20), (30, 40)])
+        self.assertEqual(parse_ranges("bytes=50-", 40), [])
+        self.assertIsNone(parse_ranges("bytes=9-5", 40))
+
+
+if __name__ == '__main__':
+    unittest.main()
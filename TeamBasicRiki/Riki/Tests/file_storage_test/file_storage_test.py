@@ -1,10 +1,12 @@
+import hashlib
+import io
 import os
 import sys
 import unittest
 from werkzeug.datastructures import FileStorage
 
 sys.path.append(os.path.join(os.getcwd(), "wiki"))  # used to make test run, still need to run from command line
-from wiki.web.file_storage import FileManager  # run with python -m unittest Tests/file_storage_test/file_storage_test.py
+from wiki.web.file_storage import FileManager, UploadTooLarge  # run with python -m unittest Tests/file_storage_test/file_storage_test.py
 
 
 class TestFileStorage(unittest.TestCase):
@@ -52,6 +54,39 @@ class TestFileStorage(unittest.TestCase):
         result = self.file_manager.upload_file(file)
         self.assertFalse(result)
 
+    def test_save_stream(self):
+        data = b"x" * 200000  # several chunks
+        name, checksum, size = self.file_manager.save_stream("big.bin", io.BytesIO(data))
+        self.assertEqual(name, "big.bin")
+        self.assertEqual(checksum, hashlib.sha256(data).hexdigest())
+        self.assertEqual(size, len(data))
+        with open(os.path.join(self.directory, name), "rb") as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.listdir(self.directory), ["big.bin"])  # no temp files left
+
+    def test_save_stream_too_large(self):
+        with self.assertRaises(UploadTooLarge):
+            self.file_manager.save_stream("big.bin", io.BytesIO(b"x" * 200000), max_size=1000)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_save_stream_secure_filename(self):
+        name, _, _ = self.file_manager.save_stream("../../escape.txt", io.BytesIO(b"data"))
+        self.assertEqual(name, "escape.txt")
+        self.assertEqual(self.file_manager.get_downloadable_files(), ["escape.txt"])
+
+    def test_uploads_in_progress_are_not_listed(self):
+        open(os.path.join(self.directory, ".upload-1234"), "w").close()
+        self.assertEqual(self.file_manager.get_downloadable_files(), [])
+
+    def test_list_files(self):
+        for name, data in [("b.txt", b"22"), ("a.txt", b"1"), ("c.txt", b"333")]:
+            self.file_manager.save_stream(name, io.BytesIO(data))
+        files, total = self.file_manager.list_files(sort="size", descending=True, limit=2)
+        self.assertEqual(total, 3)
+        self.assertEqual([(f.name, f.size) for f in files], [("c.txt", 3), ("b.txt", 2)])
+        files, total = self.file_manager.list_files(search="A")
+        self.assertEqual(([f.name for f in files], total), (["a.txt"], 1))
+
     def test_delete_file(self):
         test_file_name = "test_delete.txt"
         open(os.path.join(self.directory, test_file_name), "w").close()
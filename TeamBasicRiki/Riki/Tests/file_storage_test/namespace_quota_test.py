@@ -0,0 +1,125 @@
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from flask import Flask
+
+from wiki.web.file_catalog import FileCatalog  # run with python -m unittest Tests/file_storage_test/namespace_quota_test.py
+from wiki.web.file_storage import DedupFileManager, FileManager, QuotaExceeded, namespace_directory
+from wiki.web.resumable import ResumableUploads
+
+
+class TestNamespaces(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.managers = []
+
+    def tearDown(self):
+        for file_manager in self.managers:
+            file_manager.catalog.close()
+        shutil.rmtree(self.directory)
+
+    def dedup(self, namespace=None, quota=None):
+        file_manager = DedupFileManager(self.directory, namespace=namespace, quota=quota)
+        self.managers.append(file_manager)
+        return file_manager
+
+    def test_namespaces_are_separate(self):
+        ann, bob, shared = self.dedup("ann"), self.dedup("bob"), self.dedup()
+        ann.save_stream("notes.txt", io.BytesIO(b"same"))
+        bob.save_stream("notes.txt", io.BytesIO(b"same"))
+        shared.save_stream("other.txt", io.BytesIO(b"shared"))
+        self.assertEqual(ann.get_downloadable_files(), ["notes.txt"])
+        self.assertEqual(shared.get_downloadable_files(), ["other.txt"])
+        self.assertFalse(shared.delete_file("notes.txt"))
+        self.assertTrue(ann.delete_file("notes.txt"))
+        self.assertTrue(bob.exists("notes.txt"))
+        self.assertEqual(shared.stats()["blobs"], 2)
+
+    def test_usage_is_counted_incrementally(self):
+        ann = self.dedup("ann")
+        ann.save_stream("a.txt", io.BytesIO(b"12345"))
+        ann.save_stream("b.txt", io.BytesIO(b"12345"))
+        self.assertEqual(ann.usage(), (2, 10))
+        ann.delete_file("a.txt")
+        self.assertEqual(ann.usage(), (1, 5))
+        self.assertEqual(self.dedup("bob").usage(), (0, 0))
+
+    def test_quota(self):
+        ann = self.dedup("ann", quota=10)
+        ann.save_stream("a.txt", io.BytesIO(b"123456"))
+        self.assertRaises(QuotaExceeded, ann.save_stream, "b.txt", io.BytesIO(b"123456"))
+        self.assertRaises(QuotaExceeded, ann.check_quota, 5)
+        self.assertEqual(ann.get_downloadable_files(), ["a.txt"])
+        self.assertEqual(os.listdir(os.path.join(self.directory, "tmp")), [])
+        ann.save_stream("b.txt", io.BytesIO(b"1234"))
+        self.dedup("bob", quota=10).save_stream("c.txt", io.BytesIO(b"123456"))
+
+    def test_resumable_uploads_belong_to_a_namespace(self):
+        ann_uploads = ResumableUploads(self.dedup("ann", quota=10))
+        bob_uploads = ResumableUploads(self.dedup("bob"))
+        upload_id = ann_uploads.create("a.txt", 4)
+        self.assertIsNone(bob_uploads.info(upload_id))
+        self.assertFalse(bob_uploads.terminate(upload_id))
+        self.assertRaises(QuotaExceeded, ann_uploads.create, "b.txt", 11)
+        ann_uploads.append(upload_id, 0, io.BytesIO(b"data"))
+        self.assertEqual(ann_uploads.file_manager.get_downloadable_files(), ["a.txt"])
+
+    def test_catalog_without_namespaces_is_migrated(self):
+        path = os.path.join(self.directory, "catalog.sqlite3")
+        db = sqlite3.connect(path)
+        db.executescript("""
+            CREATE TABLE blobs (sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL);
+            CREATE TABLE files (name TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER, mtime REAL, uploader TEXT);
+            INSERT INTO blobs VALUES ('ab', 3, 2);
+            INSERT INTO files VALUES ('a.txt', 'ab', 3, 1.0, NULL), ('b.txt', 'ab', 3, 2.0, 'ann');
+        """)
+        db.commit()
+        db.close()
+        catalog = FileCatalog(path)
+        try:
+            self.assertEqual(catalog.names(), ["a.txt", "b.txt"])
+            self.assertEqual(catalog.usage(), (2, 6))
+            self.assertEqual(catalog.names("ann"), [])
+        finally:
+            catalog.close()
+
+    def test_flat_namespaces_are_sharded(self):
+        ann = FileManager(self.directory, "ann")
+        ann.save_stream("a.txt", io.BytesIO(b"data"))
+        directory = namespace_directory(self.directory, "ann")
+        self.assertTrue(os.path.isfile(os.path.join(directory, "a.txt")))
+        self.assertEqual(os.path.basename(os.path.dirname(directory)), os.path.basename(directory)[:2])
+        self.assertEqual(FileManager(self.directory).get_downloadable_files(), [])
+        self.assertEqual(FileManager(self.directory, "bob").get_downloadable_files(), [])
+
+    def test_names_cannot_reach_into_another_namespace(self):
+        FileManager(self.directory, "alice").save_stream("secret.txt", io.BytesIO(b"secret"))
+        key = os.path.basename(namespace_directory(self.directory, "alice"))
+        shared, bob = FileManager(self.directory), FileManager(self.directory, "bob")
+        for name in ("x/../.namespaces/%s/%s/secret.txt" % (key[:2], key),
+                     "../%s/secret.txt" % key,
+                     ".namespaces/%s/%s/secret.txt" % (key[:2], key)):
+            for file_manager in (shared, bob):
+                self.assertIsNone(file_manager.locate(name))
+                self.assertIsNone(file_manager.open_file(name))
+                self.assertFalse(file_manager.delete_file(name))
+        self.assertTrue(FileManager(self.directory, "alice").exists("secret.txt"))
+
+    def test_offloaded_namespace_download_keeps_its_directory(self):
+        app = Flask(__name__)
+        app.config["FILE_SENDFILE_HEADER"] = "X-Accel-Redirect"
+        ann = FileManager(self.directory, "ann")
+        ann.save_stream("a.txt", io.BytesIO(b"data"))
+        with app.test_request_context():
+            response = ann.download_file("a.txt")
+        location = os.path.relpath(os.path.join(namespace_directory(self.directory, "ann"), "a.txt"),
+                                   self.directory)
+        self.assertEqual(response.headers["X-Accel-Redirect"], "/protected/" + location)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from wiki.web.file_storage import DedupFileManager, FileExists, FileManager, UploadError, UploadTooLarge  # run with python -m unittest Tests/file_storage_test/resumable_upload_test.py
+from wiki.web.resumable import OffsetMismatch, ResumableUploads
+
+DATA = os.urandom(200000)
+
+
+class TestResumableUploads(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_manager = FileManager(self.directory)
+        self.uploads = ResumableUploads(self.file_manager, max_size=1000000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_upload_in_chunks(self):
+        upload_id = self.uploads.create("big.bin", len(DATA), "ann")
+        self.assertEqual(self.uploads.append(upload_id, 0, io.BytesIO(DATA[:50000])), (50000, None))
+        self.assertEqual(self.uploads.info(upload_id)["offset"], 50000)
+        offset, stored = self.uploads.append(upload_id, 50000, io.BytesIO(DATA[50000:]))
+        self.assertEqual((offset, stored[0], stored[2]), (len(DATA), "big.bin", len(DATA)))
+        with open(os.path.join(self.directory, "big.bin"), "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertIsNone(self.uploads.info(upload_id))
+        self.assertEqual(os.listdir(self.uploads.directory), [])
+
+    def test_finished_upload_is_not_finalized_again(self):
+        upload_id = self.uploads.create("small.bin", 4)
+        info = self.uploads.info(upload_id)
+        import_file = self.file_manager.import_file
+
+        def slow_import(*args):
+            time.sleep(0.3)
+            return import_file(*args)
+        self.file_manager.import_file = slow_import
+        results = []
+        first = threading.Thread(target=lambda: results.append(
+            self.uploads.append(upload_id, 0, io.BytesIO(b"data"))))
+        first.start()
+        time.sleep(0.1)
+        # a retried last chunk while the first one is being stored
+        self.assertRaises(OffsetMismatch, self.uploads.append, upload_id, 4, io.BytesIO(b""))
+        first.join()
+        self.assertEqual(results[0][1][0], "small.bin")
+        self.assertIsNone(self.uploads.append(upload_id, 4, io.BytesIO(b"")))
+        # a request that read the session just before it was finished
+        self.uploads.info = lambda upload_id: info
+        self.assertIsNone(self.uploads.append(upload_id, 4, io.BytesIO(b"")))
+
+    def test_wrong_offset(self):
+        upload_id = self.uploads.create("big.bin", len(DATA))
+        self.uploads.append(upload_id, 0, io.BytesIO(DATA[:1000]))
+        with self.assertRaises(OffsetMismatch) as raised:
+            self.uploads.append(upload_id, 0, io.BytesIO(DATA[:1000]))
+        self.assertEqual(raised.exception.offset, 1000)
+
+    def test_chunk_past_length_is_rolled_back(self):
+        upload_id = self.uploads.create("small.bin", 10)
+        with self.assertRaises(UploadError):
+            self.uploads.append(upload_id, 0, io.BytesIO(b"x" * 20))
+        self.assertEqual(self.uploads.info(upload_id)["offset"], 0)
+
+    def test_limits(self):
+        with self.assertRaises(UploadTooLarge):
+            self.uploads.create("big.bin", 2000000)
+        self.file_manager.save_stream("taken.bin", io.BytesIO(b"x"))
+        with self.assertRaises(FileExists):
+            self.uploads.create("taken.bin", 10)
+
+    def test_terminate(self):
+        upload_id = self.uploads.create("big.bin", len(DATA))
+        self.assertTrue(self.uploads.terminate(upload_id))
+        self.assertIsNone(self.uploads.info(upload_id))
+        self.assertFalse(self.uploads.terminate("../../etc"))
+
+    def test_abandoned_uploads_are_collected(self):
+        upload_id = self.uploads.create("big.bin", len(DATA))
+        old = time.time() - 2 * self.uploads.expire_after
+        os.utime(os.path.join(self.uploads.directory, upload_id, "data"), (old, old))
+        self.assertEqual(self.uploads.collect_garbage(), 1)
+        self.assertIsNone(self.uploads.info(upload_id))
+
+    def test_dedup_store(self):
+        file_manager = DedupFileManager(os.path.join(self.directory, "dedup"))
+        uploads = ResumableUploads(file_manager)
+        upload_id = uploads.create("big.bin", len(DATA))
+        offset, (name, checksum, size) = uploads.append(upload_id, 0, io.BytesIO(DATA))
+        with open(file_manager.blob_path(checksum), "rb") as f:
+            self.assertEqual(f.read(), DATA)
+        file_manager.catalog.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
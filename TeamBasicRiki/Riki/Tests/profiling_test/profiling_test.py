@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask_login import login_user
+
+from wiki import create_app
+from wiki.web import profiling
+from wiki.web.user import User
+
+# run with python -m unittest Tests/profiling_test/profiling_test.py
+
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(directory=os.getcwd())
+        self.profile_dir = tempfile.mkdtemp()
+        self.app.config['PROFILING_ENABLED'] = True
+        self.app.config['PROFILE_DIR'] = self.profile_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def _profiled_request(self, roles):
+        with self.app.test_request_context('/?_profile=1'):
+            login_user(User(None, 'profiler', {'roles': roles, 'active': True}))
+            profiling.start_profiling()
+            sorted(range(10000), reverse=True)
+            return profiling.stop_profiling(self.app.response_class('ok'))
+
+    def test_admin_request_is_profiled(self):
+        response = self._profiled_request(['admin'])
+        self.assertIn('X-Profile-Summary', response.headers)
+        self.assertIn(response.headers['X-Profile-File'], os.listdir(self.profile_dir))
+
+    def test_non_admin_request_is_not_profiled(self):
+        response = self._profiled_request([])
+        self.assertNotIn('X-Profile-Summary', response.headers)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_disabled_by_default(self):
+        self.app.config['PROFILING_ENABLED'] = False
+        response = self._profiled_request(['admin'])
+        self.assertNotIn('X-Profile-Summary', response.headers)
+
+    def test_summarize_orders_by_cumulative_time(self):
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
+        sorted(range(10000))
+        profile.disable()
+        rows = profiling.summarize(profile, limit=3)
+        self.assertLessEqual(len(rows), 3)
+        cumulative = [row[3] for row in rows]
+        self.assertEqual(cumulative, sorted(cumulative, reverse=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from wiki import create_app
+from wiki.core import Page
+from wiki.core import Wiki
+from wiki.web.prewarm import Prewarmer
+
+# run with python -m unittest Tests/render_test/prewarm_test.py
+
+
+class RenderCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(directory=os.getcwd())
+        self.content_dir = tempfile.mkdtemp()
+        self.app.config['CONTENT_DIR'] = self.content_dir
+        self.wiki = Wiki(self.content_dir)
+        with open(self.wiki.path('cached'), 'w') as f:
+            f.write('title: Cached\n\nFirst version')
+
+    def tearDown(self):
+        Page.cache.clear()
+        shutil.rmtree(self.content_dir)
+
+    def test_pages_are_rendered_once(self):
+        with self.app.test_request_context():
+            first = self.wiki.get('cached')
+            first['title'] = 'Changed in memory'
+            second = self.wiki.get('cached')
+        self.assertEqual(second.title, 'Cached')
+        self.assertEqual(second.html, first.html)
+
+    def test_external_edits_invalidate(self):
+        with self.app.test_request_context():
+            self.wiki.get('cached')
+            with open(self.wiki.path('cached'), 'w') as f:
+                f.write('title: Cached\n\nSecond version, longer')
+            page = self.wiki.get('cached')
+        self.assertIn('Second version', page.html)
+
+
+class PrewarmerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(directory=os.getcwd())
+        self.content_dir = tempfile.mkdtemp()
+        self.app.config['CONTENT_DIR'] = self.content_dir
+        self.prewarmer = Prewarmer(self.app, delay=0.2)
+        self.warmed = []
+        original = self.prewarmer.warm
+        self.prewarmer.warm = lambda path, url: (self.warmed.append(url), original(path, url))
+        with self.app.test_request_context():
+            self.page = Wiki(self.content_dir).get_bare('saved')
+            self.page.title = 'Saved'
+            self.page.body = 'Body'
+            self.page.save(update=False)
+
+    def tearDown(self):
+        Page.cache.clear()
+        shutil.rmtree(self.content_dir)
+
+    def test_rapid_saves_are_coalesced(self):
+        for _ in range(5):
+            self.prewarmer.schedule(self.page)
+        self.prewarmer.shutdown()
+        self.assertEqual(self.warmed, ['saved'])
+        self.assertIsNotNone(Page.cache.get(self.page.path))
+
+    def test_saved_page_is_not_rendered_again(self):
+        with self.app.test_request_context():
+            self.page.save()
+        with mock.patch.object(Page, 'render') as render, \
+                mock.patch.object(Wiki, 'index') as index:
+            self.prewarmer.warm(self.page.path, 'saved')
+        render.assert_not_called()
+        index.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import tracemalloc
+import unittest
+
+from wiki import create_app
+from wiki.core import Processor
+from wiki.web.metrics import Metrics, record_render_timings
+from wiki.web import metrics as metrics_module
+
+# run with python -m unittest Tests/render_test/processor_timing_test.py
+
+TEXT = """title: Timing
+tags: test
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+    :::python
+    print("hello")
+
+[[home|Home]]
+"""
+
+
+class ProcessorTimingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(directory=os.getcwd())
+
+    def test_not_instrumented_by_default(self):
+        with self.app.test_request_context():
+            processor = Processor(TEXT)
+            processor.process()
+        self.assertEqual(processor.timings, {})
+
+    def test_stage_timings(self):
+        with self.app.test_request_context():
+            processor = Processor(TEXT, instrument=True)
+            html, body, meta = processor.process()
+        self.assertIn("<a href='/home/'>Home</a>", html)
+        for stage in ('process_pre', 'process_markdown', 'split_raw',
+                      'process_meta', 'process_post', 'post.wikilink',
+                      'markdown.block.TableProcessor',
+                      'markdown.tree.HiliteTreeprocessor'):
+            self.assertIn(stage, processor.timings)
+            self.assertGreaterEqual(processor.timings[stage]['wall'], 0)
+        self.assertIsNone(processor.timings['process_markdown']['alloc'])
+
+    def test_nested_blocks_are_timed_once(self):
+        text = 'title: Nested\n\n> outer\n>\n> > inner\n> >\n> > > innermost\n\n' \
+               '* one\n\n    * two\n\n        * three\n'
+        with self.app.test_request_context():
+            processor = Processor(text, instrument=True)
+            html, body, meta = processor.process()
+        self.assertEqual(html.count('<blockquote>'), 3)
+        timings = processor.timings
+        self.assertEqual(timings['markdown.block.BlockQuoteProcessor']['calls'], 1)
+        for name in ('markdown.block.BlockQuoteProcessor', 'markdown.block.ListIndentProcessor',
+                     'markdown.block.UListProcessor'):
+            self.assertLessEqual(timings[name]['wall'], timings['process_markdown']['wall'])
+
+    def test_allocation_deltas_while_tracing(self):
+        tracemalloc.start()
+        try:
+            with self.app.test_request_context():
+                processor = Processor(TEXT, instrument=True)
+                processor.process()
+        finally:
+            tracemalloc.stop()
+        self.assertIsInstance(processor.timings['process_markdown']['alloc'], int)
+
+    def test_timings_reach_metrics(self):
+        registry = Metrics()
+        original = metrics_module.metrics
+        metrics_module.metrics = registry
+        try:
+            with self.app.test_request_context():
+                processor = Processor(TEXT, instrument=True)
+                processor.process()
+            record_render_timings(processor)
+        finally:
+            metrics_module.metrics = original
+        snapshot = registry.snapshot()
+        self.assertEqual(snapshot['counters']['render.count'], 1)
+        self.assertEqual(snapshot['timings']['render.process_post.wall']['count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
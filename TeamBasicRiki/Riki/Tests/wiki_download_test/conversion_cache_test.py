@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from wiki.web.conversion_cache import ConversionCache  # run with python -m unittest Tests/wiki_download_test/conversion_cache_test.py
+
+
+class TestConversionCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ConversionCache(self.directory, max_bytes=100)
+        self.page = Mock()
+        self.page.title = "Test Page"
+        self.page.content = "Test content"
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, page, filetype, stream):
+        self.calls += 1
+        stream.write(b'x' * 40)
+
+    def _store(self, key):
+        self.cache.store(key, lambda stream: stream.write(b'x' * 40)).close()
+
+    def test_converts_once(self):
+        with self.cache.open_or_convert(self.page, 'pdf', self._write) as f:
+            first = f.read()
+        with self.cache.open_or_convert(self.page, 'pdf', self._write) as f:
+            second = f.read()
+        self.assertEqual(first, b'x' * 40)
+        self.assertEqual(first, second)
+        self.assertEqual(self.calls, 1)
+
+    def test_key_depends_on_content_and_format(self):
+        pdf_key = ConversionCache.key(self.page, 'pdf')
+        self.assertNotEqual(pdf_key, ConversionCache.key(self.page, 'docx'))
+        self.page.content = "Changed content"
+        self.assertNotEqual(pdf_key, ConversionCache.key(self.page, 'pdf'))
+
+    def test_evicts_least_recently_used(self):
+        self._store('a.pdf')
+        self._store('b.pdf')
+        os.utime(self.cache.path('a.pdf'), ns=(1, 1))
+        self.cache.open('a.pdf').close()  # touching makes b the oldest
+        os.utime(self.cache.path('b.pdf'), ns=(2, 2))
+        self._store('c.pdf')
+        self.assertEqual(sorted(os.listdir(self.directory)), ['a.pdf', 'c.pdf'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from wiki.web.conversion_cache import ConversionCache
+from wiki.web.conversion_jobs import ConversionJobManager, JobRejected, PageSnapshot  # run with python -m unittest Tests/wiki_download_test/conversion_jobs_test.py
+
+
+class TestConversionJobs(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ConversionCache(self.directory)
+        self.manager = ConversionJobManager(self.cache, workers=1)
+        self.page = PageSnapshot('test', 'Test Page', 'Test content', '<p>Test content</p>')
+
+    def tearDown(self):
+        self.manager.shutdown()
+        shutil.rmtree(self.directory)
+
+    def test_job_writes_artifact_to_cache(self):
+        job = self.manager.wait(self.manager.submit(self.page, 'pdf', 'tester'), 60)
+        self.assertEqual(job.status, 'Success')
+        with self.cache.open(job.id) as artifact:
+            self.assertEqual(len(artifact.read()), job.size)
+
+    def test_finished_job_is_known_to_other_managers(self):
+        job = self.manager.wait(self.manager.submit(self.page, 'txt', 'tester'), 60)
+        other = ConversionJobManager(self.cache)
+        self.assertEqual(other.get(job.id).status, 'Success')
+        self.assertIsNone(other.get('not-a-job'))
+        other.shutdown()
+
+    def test_unfinished_job_is_shared_with_other_managers(self):
+        job = self.manager.submit(self.page, 'pdf', 'tester')
+        other = ConversionJobManager(self.cache, per_user=1)
+        self.assertTrue(other.get(job.id).active)
+        self.assertEqual(other.submit(self.page, 'pdf', 'someone else').id, job.id)
+        other_page = PageSnapshot('other', 'Other Page', 'Other content', '<p>Other content</p>')
+        with self.assertRaises(JobRejected):
+            other.submit(other_page, 'pdf', 'tester')
+        self.assertEqual(other.wait(other.get(job.id), 60).status, 'Success')
+        other.shutdown()
+
+    def test_job_of_a_stopped_process_is_failed(self):
+        job = self.manager.submit(self.page, 'pdf', 'tester')
+        self.manager.store.db.execute('UPDATE jobs SET pid = ? WHERE id = ?', (2 ** 22 + 1, job.id))
+        other = ConversionJobManager(self.cache)
+        self.assertEqual(other.get(job.id).status, 'Failed')
+        self.assertEqual(other.queue_depth, 0)
+        other.shutdown()
+
+    def test_same_page_reuses_job(self):
+        job = self.manager.submit(self.page, 'docx', 'tester')
+        self.assertIs(self.manager.submit(self.page, 'docx', 'someone else'), job)
+
+    def test_evicted_artifact_is_converted_again(self):
+        job = self.manager.wait(self.manager.submit(self.page, 'txt', 'tester'), 60)
+        os.remove(self.cache.path(job.id))
+        other = ConversionJobManager(self.cache)
+        again = other.submit(self.page, 'txt', 'tester')
+        self.assertIsNotNone(again.future)
+        self.assertEqual(other.wait(again, 60).status, 'Success')
+        self.assertIsNotNone(self.cache.open(job.id))
+        other.shutdown()
+        os.remove(self.cache.path(job.id))
+        again = self.manager.wait(self.manager.submit(self.page, 'txt', 'tester'), 60)
+        self.assertEqual(again.status, 'Success')
+        with self.cache.open(job.id) as artifact:
+            self.assertEqual(len(artifact.read()), again.size)
+
+    def test_limits(self):
+        self.manager.per_user = 0
+        with self.assertRaises(JobRejected) as context:
+            self.manager.submit(self.page, 'pdf', 'tester')
+        self.assertEqual(context.exception.status_code, 429)
+        self.manager.max_queue = 0
+        with self.assertRaises(JobRejected) as context:
+            self.manager.submit(self.page, 'pdf', 'tester')
+        self.assertEqual(context.exception.status_code, 503)
+
+    def test_unsupported_filetype(self):
+        with self.assertRaises(ValueError):
+            self.manager.submit(self.page, 'exe', 'tester')
+
+
+if __name__ == '__main__':
+    unittest.main()
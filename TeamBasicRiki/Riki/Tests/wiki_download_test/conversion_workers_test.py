@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+from wiki.web.conversion_workers import IsolatedWorkerPool, JobTimeout, WorkerCrashed, _Worker  # run with python -m unittest Tests/wiki_download_test/conversion_workers_test.py
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def crash():
+    os._exit(3)
+
+
+def allocate(size):
+    return len(bytearray(size))
+
+
+def fail():
+    raise ValueError('broken page')
+
+
+class TestIsolatedWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = IsolatedWorkerPool(workers=1, timeout=2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_result(self):
+        self.assertEqual(self.pool.submit(sleep, 0).result(timeout=10), 0)
+
+    def test_exception_is_raised_in_caller(self):
+        with self.assertRaises(ValueError):
+            self.pool.submit(fail).result(timeout=10)
+        self.assertEqual(self.pool.submit(os.getpid).result(timeout=10),
+                         self.pool.submit(os.getpid).result(timeout=10))
+
+    def test_timeout_kills_worker(self):
+        self.pool.timeout = 0.5
+        with self.assertRaises(JobTimeout):
+            self.pool.submit(sleep, 30).result(timeout=10)
+        self.assertEqual(self.pool.submit(sleep, 0).result(timeout=10), 0)
+
+    def test_crash_fails_only_its_job(self):
+        with self.assertRaises(WorkerCrashed):
+            self.pool.submit(crash).result(timeout=10)
+        self.assertEqual(self.pool.submit(sleep, 0).result(timeout=10), 0)
+
+    @unittest.skipUnless(os.name == 'posix', 'memory limits need the resource module')
+    def test_memory_limit(self):
+        self.pool.memory_limit = 512 * 1024 * 1024
+        with self.assertRaises(MemoryError):
+            self.pool.submit(allocate, 1024 * 1024 * 1024).result(timeout=10)
+        self.assertEqual(self.pool.submit(allocate, 1024).result(timeout=10), 1024)
+
+    @unittest.skipUnless(os.name == 'posix', 'memory limits need the resource module')
+    def test_memory_limit_ignores_the_parent_address_space(self):
+        # idle threads map their stacks, a forked worker would inherit them
+        stop = threading.Event()
+        threads = [threading.Thread(target=stop.wait) for _ in range(100)]
+        for thread in threads:
+            thread.start()
+        try:
+            self.pool.memory_limit = 512 * 1024 * 1024
+            self.assertEqual(self.pool.submit(allocate, 64 * 1024 * 1024).result(timeout=10),
+                             64 * 1024 * 1024)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def test_failed_worker_start_fails_only_its_job(self):
+        start = _Worker.__init__
+        failures = [OSError(11, 'Resource temporarily unavailable')]
+
+        def flaky_start(worker, *args):
+            if failures:
+                raise failures.pop()
+            start(worker, *args)
+        with mock.patch.object(_Worker, '__init__', flaky_start):
+            with self.assertRaises(WorkerCrashed):
+                self.pool.submit(sleep, 0).result(timeout=10)
+            self.assertEqual(self.pool.submit(sleep, 0).result(timeout=10), 0)
+
+    def test_workers_are_recycled(self):
+        self.pool.max_jobs_per_worker = 2
+        pids = [self.pool.submit(os.getpid).result(timeout=10) for _ in range(4)]
+        self.assertEqual(pids[0], pids[1])
+        self.assertEqual(pids[2], pids[3])
+        self.assertNotEqual(pids[1], pids[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
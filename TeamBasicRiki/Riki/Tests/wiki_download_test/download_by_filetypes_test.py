@@ -1,4 +1,8 @@
+import base64
+import subprocess
+import sys
 import unittest
+from io import BytesIO
 from unittest.mock import Mock
 from wiki.web.converter import Converter, get_file_size # run with python -m unittest Tests/wiki_download_test/download_by_filetypes_test.py
 
@@ -8,6 +12,7 @@ class TestConverter(unittest.TestCase):
         self.page = Mock()
         self.page.title = "Test Page"
         self.page.content = "Test content"
+        self.page.html = "<p>Test content</p>"
 
     def test_get_file_size(self):
         # Test get_file_size function with various sizes
@@ -50,6 +55,44 @@ class TestConverter(unittest.TestCase):
         self.assertTrue(isinstance(file_size, str))
         self.assertTrue(file_size.endswith('KB'))
 
+    def test_convert_to_HTML_uses_rendered_html(self):
+        data, _ = Converter(self.page).to_bytes('html')
+        self.assertIn(b'<p>Test content</p>', data)
+        self.assertIn(b'.codehilite', data)
+        self.assertTrue(data.startswith(b'<!DOCTYPE html>'))
+
+        fragment, _ = Converter(self.page, standalone=False).to_bytes('html')
+        self.assertEqual(fragment, b'<p>Test content</p>')
+
+    def test_to_bytes_matches_base64(self):
+        converter = Converter(self.page)
+        for filetype in ('txt', 'html'):
+            data, file_size = converter.to_bytes(filetype)
+            base64_content, _ = getattr(converter, f'convert_to_{filetype.upper()}')()
+            self.assertTrue(isinstance(data, bytes))
+            self.assertEqual(base64.b64decode(base64_content), data)
+            self.assertEqual(file_size, get_file_size(data))
+
+    def test_write_to_stream(self):
+        converter = Converter(self.page)
+        for filetype in converter.filetypes:
+            stream = BytesIO()
+            size = converter.write_to(filetype, stream)
+            self.assertEqual(size, len(stream.getvalue()))
+            self.assertGreater(size, 0)
+        self.assertTrue(stream.getvalue().startswith(b'PK'))
+
+    def test_write_to_unsupported_filetype(self):
+        converter = Converter(self.page)
+        with self.assertRaises(ValueError):
+            converter.write_to('exe', BytesIO())
+
+    def test_conversion_libraries_are_imported_lazily(self):
+        code = ('import sys, wiki.web.converter; '
+                'print(any(m in sys.modules for m in ("docx", "pdfdocument", "reportlab")))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'False')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,98 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest.mock import Mock
+
+from wiki import create_app
+from wiki.web.conversion_jobs import JobRejected, PageSnapshot
+from wiki.web.export import ExportLimiter, export_pages, select_pages  # run with python -m unittest Tests/wiki_download_test/export_test.py
+from wiki.web.zipstream import stream_zip
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.pages = [
+            PageSnapshot('home', 'Home', 'title: Home\n\nWelcome', '<p>Welcome</p>'),
+            PageSnapshot('docs/intro', 'Intro', 'title: Intro\n\nHello', '<p>Hello</p>'),
+        ]
+
+    def test_export_pages(self):
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(export_pages(self.pages, 'txt', workers=1))))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(sorted(archive.namelist()), ['docs/intro.txt', 'home.txt'])
+        self.assertEqual(archive.read('home.txt'), b'title: Home\n\nWelcome')
+
+    def test_export_docx_is_stored(self):
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(export_pages(self.pages[:1], 'docx', workers=1))))
+        self.assertEqual(archive.getinfo('home.docx').compress_type, zipfile.ZIP_STORED)
+
+    def test_export_failed_page_becomes_error_entry(self):
+        broken = PageSnapshot('broken', 'Broken', None, '')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(export_pages(self.pages[:1] + [broken], 'txt', workers=1))))
+        self.assertEqual(sorted(archive.namelist()), ['broken.txt.error.txt', 'home.txt'])
+        self.assertIn(b'Converting broken failed', archive.read('broken.txt.error.txt'))
+
+    def test_export_unsupported_filetype(self):
+        with self.assertRaises(ValueError):
+            export_pages(self.pages, 'exe')
+
+    def test_select_pages_by_prefix(self):
+        wiki = Mock()
+        wiki.index.return_value = self.pages
+        self.assertEqual(select_pages(wiki, prefix='/docs/'), self.pages[1:])
+
+    def test_stream_zip_yields_while_building(self):
+        def chunks():
+            yield b'a' * 1000
+            yield b'b' * 1000
+
+        stream = stream_zip([('big.bin', chunks(), zipfile.ZIP_STORED, None)])
+        first = next(stream)
+        self.assertTrue(first.startswith(b'PK'))
+        data = first + b''.join(stream)
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertEqual(archive.read('big.bin'), b'a' * 1000 + b'b' * 1000)
+
+
+class TestExportLimits(unittest.TestCase):
+    def test_limiter_rejects_when_full(self):
+        limiter = ExportLimiter(max_exports=2, per_user=1)
+        release = limiter.acquire('ann')
+        with self.assertRaises(JobRejected) as rejected:
+            limiter.acquire('ann')
+        self.assertEqual(rejected.exception.status_code, 429)
+        limiter.acquire('bob')
+        with self.assertRaises(JobRejected) as rejected:
+            limiter.acquire('carl')
+        self.assertEqual(rejected.exception.status_code, 503)
+        release()
+        release()
+        self.assertEqual(limiter.running, 1)
+        limiter.acquire('carl')
+
+    def test_export_route_holds_a_slot_until_closed(self):
+        content_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, content_dir)
+        with open(os.path.join(content_dir, 'home.md'), 'w') as f:
+            f.write('title: Home\n\nWelcome')
+        app = create_app(directory=os.getcwd())
+        app.config.update(CONTENT_DIR=content_dir, PRIVATE=False)
+        client = app.test_client()
+        first = client.get('/export/?fileType=md')
+        self.assertEqual(first.status_code, 200)
+        second = client.get('/export/?fileType=md')
+        self.assertEqual(second.status_code, 429)
+        self.assertIn('error', second.get_json())
+        archive = zipfile.ZipFile(io.BytesIO(first.get_data()))
+        self.assertEqual(archive.namelist(), ['home.md'])
+        first.close()
+        self.assertEqual(app.extensions['export_limiter'].running, 0)
+        self.assertEqual(client.get('/export/?fileType=exe').status_code, 400)
+        self.assertEqual(app.extensions['export_limiter'].running, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
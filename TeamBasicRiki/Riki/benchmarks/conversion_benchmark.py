@@ -0,0 +1,333 @@
+"""
+    Conversion Benchmark
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Measures how the page converters scale with the size of a page.
+
+    Synthetic pages from a few kilobytes to several megabytes are
+    generated with Faker. They mix paragraphs, headings, lists, fenced
+    code blocks, tables and wiki links, roughly like real wiki pages.
+    Each page is rendered like the wiki does and then converted to every
+    format with the ``Converter.convert_to_*`` methods. For every format
+    and page size the benchmark reports throughput, latency percentiles
+    and the peak memory of a single conversion.
+
+    Run it from the Riki directory::
+
+        python benchmarks/conversion_benchmark.py --output results.json
+        python benchmarks/conversion_benchmark.py --compare results.json
+
+    Pages are generated from a fixed seed, so two runs convert exactly
+    the same input and their results can be compared. With ``--compare``
+    the run is checked against an earlier result file and the script
+    exits with status 1 if a median latency or a peak memory got worse
+    than ``--threshold``.
+
+    Some converters scale much worse than linearly (a 64 KB page takes
+    seconds as PDF). Once a single conversion takes longer than
+    ``--budget`` seconds, the larger sizes are skipped for that format
+    and recorded as such in the results.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from faker import Faker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wiki import create_app  # noqa: E402
+from wiki.core import Processor  # noqa: E402
+from wiki.web.conversion_jobs import PageSnapshot  # noqa: E402
+from wiki.web.converter import Converter  # noqa: E402
+
+#: name, approximate size of the page source in bytes, iterations
+SIZES = [
+    ('small', 2 * 1024, 50),
+    ('medium', 64 * 1024, 20),
+    ('large', 1024 * 1024, 5),
+    ('huge', 4 * 1024 * 1024, 3),
+]
+
+LANGUAGES = ['python', 'javascript', 'sql']
+
+
+def code_block(fake):
+    language = fake.random_element(LANGUAGES)
+    lines = []
+    for _ in range(fake.random_int(3, 20)):
+        indent = '    ' * fake.random_int(0, 2)
+        if language == 'python':
+            lines.append('%s%s = %s(%r)' % (indent, fake.word(), fake.word(), fake.word()))
+        elif language == 'javascript':
+            lines.append('%sconst %s = %s("%s");' % (indent, fake.word(), fake.word(), fake.word()))
+        else:
+            lines.append('SELECT %s FROM %s WHERE id = %d;' % (fake.word(), fake.word(), fake.random_int()))
+    return '```%s\n%s\n```' % (language, '\n'.join(lines))
+
+
+def table(fake):
+    columns = fake.random_int(2, 6)
+    rows = ['| ' + ' | '.join(fake.word().title() for _ in range(columns)) + ' |',
+            '|' + '---|' * columns]
+    for _ in range(fake.random_int(2, 15)):
+        rows.append('| ' + ' | '.join(fake.word() for _ in range(columns)) + ' |')
+    return '\n'.join(rows)
+
+
+def paragraph(fake):
+    sentences = fake.sentences(fake.random_int(2, 8))
+    for _ in range(fake.random_int(0, 3)):
+        target = '/'.join(fake.words(fake.random_int(1, 2)))
+        if fake.boolean():
+            link = '[[%s]]' % target
+        else:
+            link = '[[%s|%s]]' % (target, fake.word().title())
+        sentences.insert(fake.random_int(0, len(sentences)), link)
+    return ' '.join(sentences)
+
+
+def bullet_list(fake):
+    return '\n'.join('- ' + fake.sentence() for _ in range(fake.random_int(2, 8)))
+
+
+def generate_page(fake, size):
+    """
+        Generates the source of a page of about `size` bytes.
+
+        :param fake: the :class:`faker.Faker` to draw content from
+        :param int size: the approximate size in bytes
+
+        :returns: the markdown source including the meta header
+        :rtype: str
+    """
+    title = fake.sentence(nb_words=4).rstrip('.')
+    blocks = ['title: %s\ntags: %s\n' % (title, ', '.join(fake.words(3)))]
+    length = len(blocks[0])
+    while length < size:
+        kind = fake.random_int(0, 9)
+        if kind == 0:
+            block = '## ' + fake.sentence().rstrip('.')
+        elif kind in (1, 2):
+            block = code_block(fake)
+        elif kind == 3:
+            block = table(fake)
+        elif kind == 4:
+            block = bullet_list(fake)
+        else:
+            block = paragraph(fake)
+        blocks.append(block)
+        length += len(block) + 2
+    return '\n\n'.join(blocks)
+
+
+def render(url, content):
+    processor = Processor(content)
+    html, body, meta = processor.process()
+    return PageSnapshot(url, meta.get('title', url), content, html)
+
+
+def percentile(values, percent):
+    """
+        Returns the `percent` percentile of `values` by nearest rank.
+    """
+    ordered = sorted(values)
+    rank = max(1, int(round(percent / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def convert(page, filetype):
+    return getattr(Converter(page), 'convert_to_' + filetype.upper())()
+
+
+def measure(page, filetype, iterations):
+    """
+        Converts `page` `iterations` times and summarizes the run.
+
+        The peak memory is measured in one extra conversion with
+        :mod:`tracemalloc` enabled, which is slow and therefore not part
+        of the timed iterations.
+
+        :returns: the result entry for the page and file type
+        :rtype: dict
+    """
+    # warm up caches such as the pygments stylesheet
+    begin = time.perf_counter()
+    output = convert(page, filetype)
+    warmup = time.perf_counter() - begin
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        begin = time.perf_counter()
+        convert(page, filetype)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        convert(page, filetype)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    page_bytes = len(page.content.encode('utf-8'))
+    return {
+        'iterations': iterations,
+        'warmup_seconds': warmup,
+        'page_bytes': page_bytes,
+        'output_size': output[1],
+        'latency_ms': {
+            'min': min(latencies) * 1000,
+            'mean': sum(latencies) / len(latencies) * 1000,
+            'p50': percentile(latencies, 50) * 1000,
+            'p95': percentile(latencies, 95) * 1000,
+            'p99': percentile(latencies, 99) * 1000,
+            'max': max(latencies) * 1000,
+        },
+        'throughput': {
+            'pages_per_second': iterations / elapsed,
+            'megabytes_per_second': page_bytes * iterations / elapsed / 1024 / 1024,
+        },
+        'peak_memory_bytes': peak,
+    }
+
+
+def run(formats, sizes, seed, scale=1.0, budget=5.0):
+    """
+        Runs the benchmark.
+
+        :param list formats: the file types to convert to
+        :param list sizes: entries of :data:`SIZES` to generate pages for
+        :param int seed: the seed of the page generator
+        :param float scale: factor applied to the number of iterations
+        :param float budget: seconds a single conversion may take before
+            larger sizes are skipped for its format
+
+        :returns: the results, ready to be dumped as JSON
+        :rtype: dict
+    """
+    fake = Faker()
+    fake.seed_instance(seed)
+    app = create_app(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    results = []
+    too_slow = set()
+    # wiki links are rendered with url_for
+    with app.test_request_context():
+        for name, size, iterations in sizes:
+            page = render('benchmark/' + name, generate_page(fake, size))
+            for filetype in formats:
+                if filetype in too_slow:
+                    results.append({'format': filetype, 'size': name, 'skipped': True})
+                    print('%-5s %-7s skipped, over the budget' % (filetype, name), file=sys.stderr)
+                    continue
+                entry = measure(page, filetype, max(1, int(iterations * scale)))
+                entry.update({'format': filetype, 'size': name})
+                results.append(entry)
+                if entry['warmup_seconds'] > budget:
+                    too_slow.add(filetype)
+                print('%-5s %-7s p50 %9.2f ms  p95 %9.2f ms  %8.2f MB/s  peak %s' % (
+                    filetype, name, entry['latency_ms']['p50'],
+                    entry['latency_ms']['p95'],
+                    entry['throughput']['megabytes_per_second'],
+                    format_bytes(entry['peak_memory_bytes'])), file=sys.stderr)
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'converter_version': Converter.version,
+            'seed': seed,
+            'budget_seconds': budget,
+        },
+        'results': results,
+    }
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f GB' % size
+
+
+def compare(baseline, current, threshold, min_delta_ms=1.0):
+    """
+        Compares two result sets.
+
+        :param dict baseline: the results of an earlier run
+        :param dict current: the results of this run
+        :param float threshold: the relative change counted as regression
+        :param float min_delta_ms: latency changes below this are noise
+
+        :returns: the regressions as human readable lines
+        :rtype: list
+    """
+    previous = {(entry['format'], entry['size']): entry for entry in baseline['results']}
+    regressions = []
+    for entry in current['results']:
+        before = previous.get((entry['format'], entry['size']))
+        if before is None or before.get('skipped') or entry.get('skipped'):
+            continue
+        checks = [
+            ('p50 latency', before['latency_ms']['p50'], entry['latency_ms']['p50'], min_delta_ms),
+            ('peak memory', before['peak_memory_bytes'], entry['peak_memory_bytes'], 0),
+        ]
+        for label, old, new, min_delta in checks:
+            change = (new - old) / old if old else 0.0
+            line = '%-5s %-7s %-12s %+7.1f%%' % (entry['format'], entry['size'], label, change * 100)
+            print(line, file=sys.stderr)
+            if change > threshold and new - old > min_delta:
+                regressions.append(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the page converters.')
+    parser.add_argument('--format', dest='formats', action='append',
+                        choices=Converter.filetypes,
+                        help='only benchmark this format, may be repeated')
+    parser.add_argument('--size', dest='sizes', action='append',
+                        choices=[name for name, _, _ in SIZES],
+                        help='only benchmark this page size, may be repeated')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='factor applied to the number of iterations')
+    parser.add_argument('--seed', type=int, default=4711)
+    parser.add_argument('--budget', type=float, default=5.0,
+                        help='skip larger pages for a format once a conversion '
+                             'takes longer than this many seconds (default 5)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare with the results in this file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown counted as regression (default 0.1)')
+    args = parser.parse_args(argv)
+
+    formats = args.formats or list(Converter.filetypes)
+    sizes = [entry for entry in SIZES if not args.sizes or entry[0] in args.sizes]
+    results = run(formats, sizes, args.seed, args.scale, args.budget)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print('%d regression(s):' % len(regressions), file=sys.stderr)
+            for line in regressions:
+                print('  ' + line, file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
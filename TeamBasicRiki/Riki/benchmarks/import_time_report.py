@@ -0,0 +1,126 @@
+"""
+    Import Time Report
+    ~~~~~~~~~~~~~~~~~~
+
+    Shows what importing the web application costs a worker process.
+
+    The application is imported in a fresh interpreter with
+    ``-X importtime``, once as a worker that only serves page views and
+    once as a worker that also converts pages and therefore loads the
+    conversion libraries. For both the report shows the import time, the
+    resident memory afterwards and the slowest top level packages, plus
+    the difference, which is what a worker saves while it does not
+    convert anything.
+
+    Run it from the Riki directory::
+
+        python benchmarks/import_time_report.py
+        python benchmarks/import_time_report.py --json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#: modules a converting worker loads on top of the application
+CONVERSION_MODULES = ['docx', 'pdfdocument.document']
+
+CHILD = '''
+import resource
+import sys
+{imports}
+rss = None
+with open('/proc/self/status') as f:
+    for line in f:
+        if line.startswith('VmRSS:'):
+            rss = int(line.split()[1]) * 1024
+if rss is None:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+sys.stdout.write('%d %d\\n' % (rss, len(sys.modules)))
+'''
+
+
+def parse_importtime(output):
+    """
+        Parses the ``-X importtime`` lines of `output`.
+
+        :returns: a list of (module, self us, cumulative us, depth)
+        :rtype: list
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        own = int(own)
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        entries.append((name.strip(), own, int(cumulative), depth))
+    return entries
+
+
+def measure(modules):
+    """
+        Imports `modules` in a fresh interpreter.
+
+        :param list modules: the modules to import
+        :returns: the measurements of the child process
+        :rtype: dict
+    """
+    imports = '\n'.join('import %s' % module for module in modules)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD.format(imports=imports)],
+        cwd=ROOT, capture_output=True, text=True, check=True)
+    rss, count = map(int, result.stdout.split())
+    entries = parse_importtime(result.stderr)
+    packages = {}
+    for name, own, cumulative, depth in entries:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + own
+    return {
+        'modules': modules,
+        'import_us': sum(own for _, own, _, _ in entries),
+        'rss_bytes': rss,
+        'module_count': count,
+        'packages_us': sorted(packages.items(), key=lambda item: -item[1]),
+    }
+
+
+def report(view, convert, top):
+    lines = []
+    for label, result in (('page views only', view), ('with conversions', convert)):
+        lines.append('%s: %.1f ms import, %.1f MB RSS, %d modules' % (
+            label, result['import_us'] / 1000.0,
+            result['rss_bytes'] / 1024.0 / 1024.0, result['module_count']))
+        for package, us in result['packages_us'][:top]:
+            lines.append('    %-24s %8.1f ms' % (package, us / 1000.0))
+    lines.append('saved per worker that does not convert: %.1f ms import, %.1f MB RSS, %d modules' % (
+        (convert['import_us'] - view['import_us']) / 1000.0,
+        (convert['rss_bytes'] - view['rss_bytes']) / 1024.0 / 1024.0,
+        convert['module_count'] - view['module_count']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report the import cost of a worker.')
+    parser.add_argument('--module', default='wiki.web.routes',
+                        help='the module a worker imports (default wiki.web.routes)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='the number of packages to list')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    view = measure([args.module])
+    convert = measure([args.module] + CONVERSION_MODULES)
+    if args.json:
+        json.dump({'view': view, 'convert': convert}, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print(report(view, convert, args.top))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+    Password Hash Calibration
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Finds the password hash cost for a target latency on this machine.
+
+    :func:`wiki.web.passwords.calibrate` picks the parameters, then one
+    hash and one verification are timed a few times with them, and with
+    the cost currently in ``config.py`` for comparison. The result is
+    printed as the config lines to use. Run it on the production machine,
+    a hash that takes 250 ms on a laptop may take much longer on a small
+    server.
+
+    Run it from the Riki directory::
+
+        python benchmarks/password_hash_calibration.py
+        python benchmarks/password_hash_calibration.py --algorithm pbkdf2_sha256 --target 100
+        python benchmarks/password_hash_calibration.py --json
+
+    Keep in mind that ``PASSWORD_HASH_WORKERS`` hashes run at once, so
+    a login burst is served at about ``PASSWORD_HASH_WORKERS / target``
+    logins per second.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from wiki.web.passwords import ALGORITHMS  # noqa: E402
+from wiki.web.passwords import calibrate  # noqa: E402
+from wiki.web.passwords import hash_password  # noqa: E402
+from wiki.web.passwords import verify_password  # noqa: E402
+
+
+def measure(algorithm, params, rounds):
+    hashes, verifications = [], []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        encoded = hash_password('correct horse battery staple', algorithm, params)
+        hashes.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        verify_password('correct horse battery staple', encoded)
+        verifications.append(time.perf_counter() - start)
+    return {
+        'algorithm': algorithm,
+        'params': params,
+        'hash_ms': statistics.median(hashes) * 1000,
+        'verify_ms': statistics.median(verifications) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calibrate the password hash cost.')
+    parser.add_argument('--algorithm', choices=ALGORITHMS,
+                        default=getattr(config, 'PASSWORD_KDF', 'scrypt'))
+    parser.add_argument('--target', type=float, default=250,
+                        help='the time one hash should take in ms (default 250)')
+    parser.add_argument('--max-memory', type=int, default=64,
+                        help='the memory one scrypt hash may use in MB (default 64)')
+    parser.add_argument('--rounds', type=int, default=5,
+                        help='the number of hashes timed per setting')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    params = calibrate(args.algorithm, args.target / 1000.0, args.max_memory * 1024 * 1024)
+    results = {'calibrated': measure(args.algorithm, params, args.rounds)}
+    if getattr(config, 'PASSWORD_KDF', None) == args.algorithm:
+        results['configured'] = measure(
+            args.algorithm, getattr(config, 'PASSWORD_KDF_PARAMS', None), args.rounds)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return 0
+    for name, result in sorted(results.items()):
+        print('%-10s %-14s %-40s hash %7.1f ms  verify %7.1f ms' % (
+            name, result['algorithm'], json.dumps(result['params'], sort_keys=True),
+            result['hash_ms'], result['verify_ms']))
+    print()
+    print('PASSWORD_KDF = %r' % args.algorithm)
+    print('PASSWORD_KDF_PARAMS = %r' % (params,))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,3 +8,96 @@ CONTENT_DIR = '/Users/smcho/Dropbox/NKU/Course/CSC440/project/Riki/content'
 USER_DIR = '/Users/smcho/Dropbox/NKU/Course/CSC440/project/Riki/user'
 NUMBER_OF_HISTORY = 5
 PRIVATE = True
+
+# Where users are kept: 'json' (users.json in USER_DIR, fine for a few
+# users) or 'sqlite' (users.sqlite3, imports an existing users.json once).
+USER_BACKEND = 'json'
+
+# Which users are logged in is kept in memory, or in this SQLite file so
+# that all worker processes share it. None keeps it in memory.
+SESSION_STORE_PATH = None
+
+# How passwords of new users are stored: 'hash' or 'cleartext'. A login
+# with a cleartext password or an outdated hash stores it hashed anew.
+DEFAULT_AUTHENTICATION_METHOD = 'hash'
+# 'scrypt' or 'pbkdf2_sha256'; tune the cost with
+# benchmarks/password_hash_calibration.py on the production machine.
+PASSWORD_KDF = 'scrypt'
+PASSWORD_KDF_PARAMS = {'n': 2 ** 14, 'r': 8, 'p': 1}
+# Passwords hashed at once, and how many more may wait before a login
+# is turned away.
+PASSWORD_HASH_WORKERS = 2
+PASSWORD_HASH_QUEUE = 16
+
+# Per-request profiling, only available to users with the 'admin' role.
+# Add ?_profile=1 (or an "X-Profile: 1" header) to a request to profile it.
+PROFILING_ENABLED = False
+PROFILE_DIR = 'profiles'
+PROFILING_TOP = 10
+
+# Time every render pipeline stage and report it on /metrics/.
+# Tracing allocations as well slows rendering down considerably.
+RENDER_INSTRUMENTATION = False
+RENDER_TRACE_ALLOCATIONS = False
+
+# Converted pages are cached on disk, keyed by the page content, so the
+# convert-then-download flow only converts once.
+CONVERSION_CACHE_DIR = 'ConversionCache'
+CONVERSION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# PDF/DOCX/HTML/TXT conversions run on a background process pool.
+CONVERSION_WORKERS = 2
+CONVERSION_QUEUE_MAX = 32
+CONVERSION_USER_LIMIT = 2
+
+# Number of processes converting pages for /export/ and "flask export".
+# Each export starts its own, so /export/ runs at most
+# EXPORT_MAX_CONCURRENT exports at once and EXPORT_USER_LIMIT per user.
+EXPORT_WORKERS = 2
+EXPORT_MAX_CONCURRENT = 2
+EXPORT_USER_LIMIT = 1
+
+# After a page is saved, build its conversions to the file types listed
+# in PREWARM_FORMATS (e.g. ['pdf', 'docx']) in the background, ahead of
+# the first download. Nothing runs while the list is empty.
+PREWARM_ENABLED = True
+PREWARM_FORMATS = []
+PREWARM_WORKERS = 1
+PREWARM_DELAY = 1.0
+
+# Limits of a single conversion. A worker that exceeds its time is
+# killed, the memory limit (bytes of address space) makes a runaway
+# conversion fail with a MemoryError. Workers are replaced after
+# CONVERSION_JOBS_PER_WORKER jobs.
+CONVERSION_TIMEOUT = 60
+CONVERSION_MEMORY_LIMIT = 1024 * 1024 * 1024
+CONVERSION_JOBS_PER_WORKER = 50
+
+# The largest file that may be uploaded to the file storage, in bytes.
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024 * 1024
+
+# How uploaded files are stored: 'flat' keeps one file per name, 'dedup'
+# stores every distinct content once, named by its SHA-256.
+FILE_STORAGE_BACKEND = 'dedup'
+
+# Store compressible files of the 'dedup' backend compressed: 'gzip',
+# which most clients accept as it is, 'xz' or None.
+FILE_COMPRESSION = 'gzip'
+
+# Let the front-end server send stored files: None, 'X-Sendfile' or
+# 'X-Accel-Redirect'. For nginx, FILE_ACCEL_REDIRECT_PREFIX must be an
+# internal location aliased to the file storage directory.
+FILE_SENDFILE_HEADER = None
+FILE_ACCEL_REDIRECT_PREFIX = '/protected/'
+
+# The most bytes each user may store in their own files, and all users
+# together in the shared files, None for no limit. Quotas are enforced
+# by the 'dedup' backend, whose catalog keeps the usage counts.
+FILE_STORAGE_QUOTA = 1024 * 1024 * 1024
+FILE_STORAGE_SHARED_QUOTA = None
+
+# Number of files listed per page of the file storage.
+FILE_STORAGE_PAGE_SIZE = 50
+
+# Seconds after which an abandoned resumable upload is removed.
+UPLOAD_SESSION_EXPIRY = 24 * 3600
@@ -6,6 +6,9 @@ from collections import OrderedDict
 from io import open
 import os
 import re
+import threading
+import time
+import tracemalloc
 
 from flask import abort
 from flask import url_for
@@ -67,6 +70,10 @@ def wikilink(text, url_formatter=None):
     return text
 
 
+def _name(func):
+    return getattr(func, '__name__', type(func).__name__)
+
+
 class Processor(object):
     """
         The processor handles the processing of file content into
@@ -74,16 +81,28 @@ class Processor(object):
 
         It also offers some helper methods that can be used for various
         cases.
+
+        When instrumentation is enabled, every stage, every registered
+        pre/postprocessor and every markdown extension processor is
+        timed. The results are kept in :attr:`timings` and handed to
+        the registered :attr:`timing_hooks`.
     """
 
     preprocessors = []
     postprocessors = [wikilink]
 
-    def __init__(self, text):
+    #: record per stage wall time and allocation deltas
+    instrument = False
+    #: callables that receive the processor after an instrumented run
+    timing_hooks = []
+
+    def __init__(self, text, instrument=None):
         """
             Initialization of the processor.
 
             :param str text: the text to process
+            :param bool instrument: overrides the class wide
+                :attr:`instrument` setting for this processor
         """
         self.md = markdown.Markdown(extensions=[
             'codehilite',
@@ -100,13 +119,90 @@ class Processor(object):
         self.final = None
         self.meta = None
 
+        if instrument is not None:
+            self.instrument = instrument
+        self.timings = OrderedDict()
+        if self.instrument:
+            self.instrument_markdown()
+
+    def measure(self, name, func, *args):
+        """
+            Calls `func` with the given arguments and, if instrumentation
+            is enabled, adds its wall time and allocation delta to the
+            :attr:`timings` entry `name`.
+
+            Allocation deltas are only available while :mod:`tracemalloc`
+            is tracing, otherwise they are recorded as None.
+
+            :param str name: the name of the timings entry
+            :param function func: the function to call
+
+            :returns: whatever `func` returns
+        """
+        if not self.instrument:
+            return func(*args)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            allocated = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            wall = time.perf_counter() - start
+            entry = self.timings.get(name)
+            if entry is None:
+                entry = self.timings[name] = {
+                    'calls': 0, 'wall': 0.0, 'alloc': None}
+            entry['calls'] += 1
+            entry['wall'] += wall
+            if tracing:
+                delta = tracemalloc.get_traced_memory()[0] - allocated
+                entry['alloc'] = (entry['alloc'] or 0) + delta
+
+    def instrument_markdown(self):
+        """
+            Wraps the processors registered by the markdown extensions
+            (e.g. ``HiliteTreeprocessor`` from codehilite or
+            ``TableProcessor`` from tables) so that their share of
+            :meth:`process_markdown` shows up in :attr:`timings` as
+            ``markdown.<kind>.<class name>``.
+
+            Block processors parse nested blocks by running the parser
+            again, so a blockquote inside a blockquote calls the same
+            processor while it is still running. Only the outermost call
+            is recorded, its time already includes the nested ones.
+        """
+        registries = (
+            ('pre', self.md.preprocessors),
+            ('block', self.md.parser.blockprocessors),
+            ('tree', self.md.treeprocessors),
+            ('post', self.md.postprocessors),
+        )
+        self._depth = {}
+        for kind, registry in registries:
+            for processor in registry:
+                name = 'markdown.{0}.{1}'.format(kind, type(processor).__name__)
+                processor.run = self._measured(name, processor.run)
+
+    def _measured(self, name, func):
+        def wrapper(*args):
+            if self._depth.get(name):
+                return func(*args)
+            self._depth[name] = 1
+            try:
+                return self.measure(name, func, *args)
+            finally:
+                self._depth[name] = 0
+        return wrapper
+
     def process_pre(self):
         """
             Content preprocessor.
         """
         current = self.input
         for processor in self.preprocessors:
-            current = processor(current)
+            current = self.measure(
+                'pre.' + _name(processor), processor, current)
         self.pre = current
 
     def process_markdown(self):
@@ -146,7 +242,8 @@ class Processor(object):
         """
         current = self.html
         for processor in self.postprocessors:
-            current = processor(current)
+            current = self.measure(
+                'post.' + _name(processor), processor, current)
         self.final = current
 
     def process(self):
@@ -155,28 +252,92 @@ class Processor(object):
             pre and post processing, markdown rendering and meta data
             handling.
         """
-        self.process_pre()
-        self.process_markdown()
-        self.split_raw()
-        self.process_meta()
-        self.process_post()
+        self.measure('process_pre', self.process_pre)
+        self.measure('process_markdown', self.process_markdown)
+        self.measure('split_raw', self.split_raw)
+        self.measure('process_meta', self.process_meta)
+        self.measure('process_post', self.process_post)
+
+        if self.instrument:
+            for hook in self.timing_hooks:
+                hook(self)
 
         return self.final, self.markdown, self.meta
 
 
+def _stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class RenderCache(object):
+    """
+        Keeps the rendered state of recently used pages in memory. An
+        entry is only valid as long as the modification time and the
+        size of the page file are unchanged, so edits made outside of
+        the wiki are picked up as well.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+            Returns the cached ``(content, html, body, meta)`` of the
+            page at `path`, or None if there is no current entry.
+        """
+        key = _stat_key(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != key:
+                return None
+            self._entries.move_to_end(path)
+            return entry[1]
+
+    def put(self, path, key, rendered):
+        with self._lock:
+            self._entries[path] = (key, rendered)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class Page(object):
+    #: rendered pages shared by all :class:`Wiki` instances
+    cache = RenderCache()
+    #: callables that receive the page after it was saved
+    save_hooks = []
+
     def __init__(self, path, url, new=False):
         self.path = path
         self.url = url
         self._meta = OrderedDict()
-        if not new:
+        self._stat = None
+        if not new and not self.load_cached():
             self.load()
             self.render()
+            self.store_cached()
 
     def __repr__(self):
         return "<Page: {}@{}>".format(self.url, self.path)
 
     def load(self):
+        # stat before reading, a concurrent write then only ever makes
+        # the cache entry look older than it is
+        self._stat = _stat_key(self.path)
         with open(self.path, 'r', encoding='utf-8') as f:
             self.content = f.read()
 
@@ -184,6 +345,29 @@ class Page(object):
         processor = Processor(self.content)
         self._html, self.body, self._meta = processor.process()
 
+    def load_cached(self):
+        """
+            Takes the content and rendered state from the render cache.
+
+            :returns: True if the page was found in the cache
+            :rtype: bool
+        """
+        rendered = self.cache.get(self.path)
+        if rendered is None:
+            return False
+        self.content, self._html, self.body, meta = rendered
+        self._meta = OrderedDict(meta)
+        return True
+
+    def store_cached(self):
+        """
+            Puts the loaded and rendered page into the render cache.
+        """
+        if self._stat is None:
+            return
+        self.cache.put(self.path, self._stat, (
+            self.content, self._html, self.body, OrderedDict(self._meta)))
+
     def save(self, update=True):
         folder = os.path.dirname(self.path)
         if not os.path.exists(folder):
@@ -197,6 +381,9 @@ class Page(object):
         if update:
             self.load()
             self.render()
+            self.store_cached()
+        for hook in self.save_hooks:
+            hook(self)
 
     @property
     def meta(self):
@@ -296,6 +483,7 @@ class Wiki(object):
         if not self.exists(url):
             return False
         os.remove(path)
+        Page.cache.discard(path)
         return True
 
     def index(self):
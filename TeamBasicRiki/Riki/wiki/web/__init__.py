@@ -1,4 +1,5 @@
 import os
+import tracemalloc
 
 from flask import current_app
 from flask import Flask
@@ -6,8 +7,9 @@ from flask import g
 from flask_login import LoginManager
 from werkzeug.local import LocalProxy
 
+from wiki.core import Processor
 from wiki.core import Wiki
-from wiki.web.user import UserManager
+from wiki.web.user import make_user_manager
 
 class WikiError(Exception):
     pass
@@ -23,12 +25,20 @@ current_wiki = LocalProxy(get_wiki)
 def get_users():
     users = getattr(g, '_users', None)
     if users is None:
-        users = g._users = UserManager(current_app.config['USER_DIR'])
+        users = g._users = make_user_manager(current_app.config['USER_DIR'],
+                                             current_app.config.get('USER_BACKEND', 'json'))
     return users
 
 current_users = LocalProxy(get_users)
 
 
+def close_users(exception=None):
+    # the SQLite backend holds a connection per request
+    users = g.pop('_users', None)
+    if users is not None:
+        users.close()
+
+
 def create_app(directory):
     app = Flask(__name__)
     app.config['CONTENT_DIR'] = directory
@@ -42,6 +52,34 @@ def create_app(directory):
         raise WikiError(msg)
 
     loginmanager.init_app(app)
+    app.teardown_appcontext(close_users)
+
+    from wiki.web import profiling
+    profiling.init_app(app)
+
+    from wiki.web import sessions
+    sessions.init_app(app)
+
+    from wiki.web import passwords
+    passwords.init_app(app)
+
+    from wiki.web import export
+    export.init_app(app)
+
+    from wiki.web import bulk_users
+    bulk_users.init_app(app)
+
+    from wiki.web import prewarm
+    prewarm.init_app(app)
+
+    if app.config.get('RENDER_INSTRUMENTATION'):
+        from wiki.web.metrics import record_render_timings
+        Processor.instrument = True
+        if record_render_timings not in Processor.timing_hooks:
+            Processor.timing_hooks.append(record_render_timings)
+        if app.config.get('RENDER_TRACE_ALLOCATIONS') \
+                and not tracemalloc.is_tracing():
+            tracemalloc.start()
 
     from wiki.web.routes import bp
     app.register_blueprint(bp)
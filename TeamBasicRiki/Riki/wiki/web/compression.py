@@ -0,0 +1,153 @@
+"""
+    Compression
+    ~~~~~~~~~~~
+
+    Decides which stored files are worth compressing and compresses them
+    with the standard library codecs.
+
+    A file is compressed only if both checks agree:
+
+    1. Content sniffing. Files starting with the magic number of an
+       already compressed format (archives, images, office documents,
+       PDFs) are stored as they are. So are files whose type is not
+       known to be textual, unless their first bytes look like text.
+    2. A ratio probe. The first :data:`PROBE_SIZE` bytes are compressed
+       and the file is only stored compressed if that saves at least
+       :data:`MIN_SAVING` of the probe.
+
+    Encodings are named by their HTTP content coding. ``gzip`` can be
+    sent to most clients as it is, ``xz`` (lzma) compresses text better
+    but is always decompressed before sending.
+"""
+import gzip
+import lzma
+import mimetypes
+import os
+import shutil
+import zlib
+
+#: bytes read from a file at a time
+CHUNK_SIZE = 64 * 1024
+#: bytes of a file the compression ratio is probed on
+PROBE_SIZE = 256 * 1024
+#: files smaller than this are not worth the bookkeeping
+MIN_SIZE = 1024
+#: the fraction of the probe that compressing must save
+MIN_SAVING = 0.1
+
+ENCODINGS = ('gzip', 'xz')
+
+#: formats that are compressed already
+COMPRESSED_MAGIC = (
+    b'PK\x03\x04',              # zip, docx, xlsx, odt, jar, epub
+    b'\x1f\x8b',                # gzip
+    b'\xfd7zXZ\x00',            # xz
+    b'BZh',                     # bzip2
+    b'\x28\xb5\x2f\xfd',        # zstd
+    b'7z\xbc\xaf\x27\x1c',      # 7z
+    b'Rar!',                    # rar
+    b'\x89PNG',                 # png
+    b'\xff\xd8\xff',            # jpeg
+    b'GIF8',                    # gif
+    b'RIFF',                    # webp, wav, avi
+    b'%PDF',                    # pdf, its streams are deflated
+    b'OggS',                    # ogg
+    b'ID3',                     # mp3
+    b'fLaC',                    # flac
+)
+
+#: types worth compressing besides text/*
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'application/xml',
+    'application/javascript',
+    'application/x-javascript',
+    'application/x-sh',
+    'application/x-tex',
+    'application/rtf',
+    'application/sql',
+    'application/x-yaml',
+    'image/svg+xml',
+    'image/bmp',
+)
+
+
+def is_compressed(head, name=None):
+    """
+        :param bytes head: the first bytes of a file
+        :param str name: the file name, media files are assumed to be
+            compressed
+    """
+    if head.startswith(COMPRESSED_MAGIC) or head[4:8] == b'ftyp':  # mp4, mov, heic
+        return True
+    mimetype = mimetypes.guess_type(name)[0] if name else None
+    return bool(mimetype) and mimetype.split('/')[0] in ('image', 'audio', 'video') \
+        and mimetype not in COMPRESSIBLE_TYPES
+
+
+def looks_compressible(name, head):
+    """
+        :param str name: the file name, its extension gives the type
+        :param bytes head: the first bytes of the file
+    """
+    mimetype = mimetypes.guess_type(name)[0]
+    if mimetype and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES):
+        return True
+    # text without a known extension, such as logs or READMEs
+    return b'\x00' not in head[:8192]
+
+
+def compress_bytes(data, encoding):
+    if encoding == 'xz':
+        return lzma.compress(data, preset=6)
+    return zlib.compress(data, 6)
+
+
+def choose_encoding(path, name, encoding='gzip'):
+    """
+        Sniffs the file at `path` and probes how well it compresses.
+
+        :param str path: the file
+        :param str name: the name it is stored under
+        :param str encoding: the encoding to use, one of
+            :data:`ENCODINGS`
+
+        :returns: `encoding` if the file should be stored compressed,
+            otherwise None
+    """
+    if encoding not in ENCODINGS:
+        return None
+    with open(path, 'rb') as f:
+        head = f.read(PROBE_SIZE)
+    if len(head) < MIN_SIZE or is_compressed(head, name) or not looks_compressible(name, head):
+        return None
+    if len(compress_bytes(head, encoding)) > len(head) * (1 - MIN_SAVING):
+        return None
+    return encoding
+
+
+def open_encoded(path, encoding, mode='rb'):
+    """
+        Opens a stored file, decoding or encoding it transparently.
+
+        :param str encoding: the encoding of the file, None for raw files
+    """
+    if encoding == 'gzip':
+        return gzip.open(path, mode, compresslevel=6)
+    if encoding == 'xz':
+        return lzma.open(path, mode, preset=6 if 'w' in mode else None)
+    return open(path, mode)
+
+
+def compress_file(source, target, encoding):
+    """
+        Writes the contents of `source` compressed to `target`.
+
+        :returns: the size of `target`
+    """
+    with open(source, 'rb') as fin, open(target, 'wb') as raw:
+        with open_encoded(raw, encoding, 'wb') as fout:
+            shutil.copyfileobj(fin, fout, CHUNK_SIZE)
+        raw.flush()
+        os.fsync(raw.fileno())
+        return raw.tell()
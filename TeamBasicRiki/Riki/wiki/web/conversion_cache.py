@@ -0,0 +1,158 @@
+import hashlib
+import os
+import tempfile
+
+from wiki.web.converter import Converter
+
+
+class ConversionCache(object):
+    """
+    On-disk cache for converted pages.
+
+    Artifacts are keyed by the hash of the page content, the target file
+    type and the converter version, so an edit to the page or a change
+    to the converter never serves a stale file. The total size of the
+    cache is bounded; once it grows past `max_bytes` the least recently
+    used artifacts are evicted.
+
+    Attributes:
+        directory (str): The directory the artifacts are stored in.
+        max_bytes (int): The maximum total size of all artifacts.
+
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        """
+        Initialize ConversionCache object.
+
+        Args:
+            directory (str): The directory to store the artifacts in.
+            max_bytes (int): The maximum total size of all artifacts.
+
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    @staticmethod
+    def key(page, filetype):
+        """
+        Build the cache key for a page and file type.
+
+        Args:
+            page (object): The page object to be converted.
+            filetype (str): The target file type, e.g. 'pdf'.
+
+        Returns:
+            str: The cache key, which is also the artifact's file name.
+
+        """
+        digest = hashlib.sha256()
+        digest.update(page.title.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(page.content.encode('utf-8'))
+        return '{0}-v{1}.{2}'.format(
+            digest.hexdigest(), Converter.version, filetype.lower())
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def open(self, key):
+        """
+        Open a cached artifact and mark it as recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            file: The artifact opened for binary reading, or None if it
+                is not cached.
+
+        """
+        path = self.path(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another worker in the meantime, the open file
+            # is still readable
+            pass
+        return f
+
+    def store(self, key, write):
+        """
+        Store an artifact and evict old ones if the cache is too big.
+
+        The artifact is written to a temporary file first and renamed
+        into place, so concurrent readers never see a partial file.
+
+        Args:
+            key (str): The cache key.
+            write (callable): Called with a binary stream to write the
+                artifact into.
+
+        Returns:
+            file: The stored artifact opened for binary reading.
+
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            result = open(tmp_path, 'rb')
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+        return result
+
+    def open_or_convert(self, page, filetype, write):
+        """
+        Open the cached artifact for a page, converting it on a miss.
+
+        Args:
+            page (object): The page object to be converted.
+            filetype (str): The target file type, e.g. 'pdf'.
+            write (callable): Called with the page, the file type and a
+                binary stream on a cache miss, must write the artifact
+                into the stream.
+
+        Returns:
+            file: The converted page opened for binary reading.
+
+        """
+        key = self.key(page, filetype)
+        f = self.open(key)
+        if f is None:
+            f = self.store(key, lambda stream: write(page, filetype, stream))
+        return f
+
+    def evict(self):
+        """
+        Remove the least recently used artifacts until the cache fits
+        into `max_bytes` again.
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
@@ -0,0 +1,493 @@
+"""
+    Conversion Jobs
+    ~~~~~~~~~~~~~~~
+
+    Runs page conversions in the background so that generating a large
+    PDF or DOCX never blocks a web worker. Jobs are executed on a bounded
+    pool of isolated worker processes, see :mod:`conversion_workers`,
+    and write their result into the :class:`ConversionCache`.
+
+    A job's id is the cache key of its artifact. The state of every job
+    is kept in a small SQLite database next to the cache, see
+    :class:`JobStore`, so any web worker process can answer for a job
+    another one accepted, and the queue and per user limits hold for all
+    processes together.
+"""
+import collections
+from concurrent.futures import TimeoutError as FutureTimeout
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+
+from wiki.web.conversion_cache import ConversionCache
+from wiki.web.conversion_workers import IsolatedWorkerPool
+from wiki.web.converter import Converter
+from wiki.web.metrics import metrics
+
+#: the picklable part of a page the converter needs
+PageSnapshot = collections.namedtuple('PageSnapshot', ['url', 'title', 'content', 'html'])
+
+JOB_ID_REGEX = re.compile(r'^[0-9a-f]{64}-v\d+\.[a-z]+$')
+
+QUEUED = 'Queued'
+RUNNING = 'Running'
+SUCCESS = 'Success'
+FAILED = 'Failed'
+
+
+class JobRejected(Exception):
+    """
+    Raised when a job cannot be accepted.
+
+    Attributes:
+        status_code (int): The HTTP status code to answer with.
+
+    """
+
+    def __init__(self, message, status_code):
+        super(JobRejected, self).__init__(message)
+        self.status_code = status_code
+
+
+def snapshot(page):
+    return PageSnapshot(page.url, page.title, page.content, page.html)
+
+
+def run_conversion(page, filetype, cache_dir, cache_max_bytes):
+    """
+    Convert a page into the conversion cache. Runs in a pool process.
+
+    Args:
+        page (PageSnapshot): The page to convert.
+        filetype (str): The target file type, e.g. 'pdf'.
+        cache_dir (str): The directory of the conversion cache.
+        cache_max_bytes (int): The size limit of the conversion cache.
+
+    Returns:
+        int: The size of the converted file in bytes.
+
+    """
+    cache = ConversionCache(cache_dir, cache_max_bytes)
+    store = JobStore(JobStore.path_for(cache))
+    try:
+        store.set_running(ConversionCache.key(page, filetype))
+    finally:
+        store.close()
+    write = lambda page, filetype, stream: Converter(page).write_to(filetype, stream)
+    with cache.open_or_convert(page, filetype, write) as artifact:
+        return os.fstat(artifact.fileno()).st_size
+
+
+class ConversionJob(object):
+    """
+    A single conversion of a page into a file type.
+
+    Attributes:
+        id (str): The job id, which is the cache key of the artifact.
+        owner (str): The user or address that submitted the job.
+        url (str): The URL of the converted page.
+        filetype (str): The target file type.
+        status (str): One of Queued, Running, Success or Failed.
+        size (int): The size of the artifact once the job succeeded.
+        error (str): The error message if the job failed.
+
+    """
+
+    def __init__(self, id, owner, url, filetype):
+        self.id = id
+        self.owner = owner
+        self.url = url
+        self.filetype = filetype
+        self.status = QUEUED
+        self.size = None
+        self.error = None
+        self.future = None
+        self.submitted = time.time()
+        self.finished = None
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    def to_dict(self):
+        return {
+            'jobId': self.id,
+            'url': self.url,
+            'fileType': self.filetype,
+            'conversionStatus': self.status,
+            'size': self.size,
+            'error': self.error,
+        }
+
+
+class JobStore(object):
+    """
+    The state of all conversion jobs, shared by the web worker processes.
+
+    Every job is a row of a SQLite database in WAL mode. A job that is
+    still queued or running records the host and process that accepted
+    it, so the job of a process that died is reported as failed instead
+    of blocking the queue forever.
+
+    Attributes:
+        path (str): The database file.
+
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        owner TEXT,
+        url TEXT,
+        filetype TEXT NOT NULL,
+        status TEXT NOT NULL,
+        size INTEGER,
+        error TEXT,
+        submitted REAL NOT NULL,
+        finished REAL,
+        host TEXT,
+        pid INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+    """
+
+    COLUMNS = 'id, owner, url, filetype, status, size, error, submitted, finished, host, pid'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        db = self.db
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(self.SCHEMA)
+
+    @staticmethod
+    def path_for(cache):
+        # a dotfile, so the cache does not evict it
+        return os.path.join(cache.directory, '.jobs.sqlite3')
+
+    @property
+    def db(self):
+        # sqlite connections must not be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return db
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def transaction(self):
+        """
+        Returns a context manager holding the write lock of the database,
+        so checking the limits and adding a job happen atomically across
+        processes.
+        """
+        return _Transaction(self.db)
+
+    def get(self, job_id):
+        row = self.db.execute(
+            'SELECT %s FROM jobs WHERE id = ?' % self.COLUMNS, (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = self._job(row)
+        if job.active and not _process_alive(row[9], row[10]):
+            self.finish(job.id, error='The conversion was lost when its web worker stopped.')
+            return self.get(job_id)
+        return job
+
+    def add(self, job):
+        self.db.execute(
+            'INSERT OR REPLACE INTO jobs (%s) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+            % self.COLUMNS,
+            (job.id, job.owner, job.url, job.filetype, job.status, job.size, job.error,
+             job.submitted, job.finished, socket.gethostname(), os.getpid()))
+
+    def set_running(self, job_id):
+        self.db.execute('UPDATE jobs SET status = ? WHERE id = ? AND status = ?',
+                        (RUNNING, job_id, QUEUED))
+
+    def finish(self, job_id, size=None, error=None):
+        self.db.execute(
+            'UPDATE jobs SET status = ?, size = ?, error = ?, finished = ? WHERE id = ?',
+            (FAILED if error is not None else SUCCESS, size, error, time.time(), job_id))
+
+    def active(self):
+        """
+        Returns:
+            list: The queued and running jobs, oldest first.
+
+        """
+        rows = self.db.execute(
+            'SELECT %s FROM jobs WHERE status IN (?, ?) ORDER BY submitted'
+            % self.COLUMNS, (QUEUED, RUNNING)).fetchall()
+        jobs = []
+        for row in rows:
+            if _process_alive(row[9], row[10]):
+                jobs.append(self._job(row))
+            else:
+                self.finish(row[0], error='The conversion was lost when its web worker stopped.')
+        return jobs
+
+    def forget_finished(self, before):
+        self.db.execute('DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?',
+                        (SUCCESS, FAILED, before))
+
+    @staticmethod
+    def _job(row):
+        job = ConversionJob(row[0], row[1], row[2], row[3])
+        job.status, job.size, job.error, job.submitted, job.finished = row[4:9]
+        return job
+
+
+class _Transaction(object):
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
+
+
+def _process_alive(host, pid):
+    if pid is None or host != socket.gethostname() or os.name == 'nt':
+        # only processes of this machine can be checked
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ConversionJobManager(object):
+    """
+    Accepts conversion jobs and tracks them until they are finished.
+
+    The jobs are kept in a :class:`JobStore` next to the cache, which all
+    managers using the same cache share. Jobs this process accepted are
+    also kept in `jobs` together with their future.
+
+    Attributes:
+        cache (ConversionCache): The cache finished artifacts end up in.
+        store (JobStore): The state of all jobs.
+        workers (int): The number of pool processes.
+        max_queue (int): The maximum number of unfinished jobs.
+        per_user (int): The maximum number of unfinished jobs per owner.
+        keep_for (int): Seconds finished jobs are remembered for.
+        timeout (float): Seconds a single conversion may take.
+        memory_limit (int): The address space limit of a worker in bytes.
+        max_jobs_per_worker (int): Jobs after which a worker is replaced.
+
+    """
+
+    def __init__(self, cache, workers=2, max_queue=32, per_user=2, keep_for=3600,
+                 timeout=60, memory_limit=None, max_jobs_per_worker=50):
+        self.cache = cache
+        self.store = JobStore(JobStore.path_for(cache))
+        self.workers = workers
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.keep_for = keep_for
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = IsolatedWorkerPool(
+                self.workers, self.timeout, self.memory_limit,
+                self.max_jobs_per_worker)
+        return self._executor
+
+    @property
+    def queue_depth(self):
+        return len(self.store.active())
+
+    def submit(self, page, filetype, owner):
+        """
+        Submit the conversion of a page.
+
+        An unfinished job for the same artifact is reused, even one
+        another process accepted, and an artifact that is still cached
+        finishes immediately. A successful job whose artifact was evicted
+        is converted again.
+
+        Args:
+            page (Page): The page to convert.
+            filetype (str): The target file type, e.g. 'pdf'.
+            owner (str): The user or address submitting the job.
+
+        Returns:
+            ConversionJob: The job converting the page.
+
+        Raises:
+            ValueError: If the file type is not supported.
+            JobRejected: If the queue or the owner's limit is full.
+
+        """
+        filetype = filetype.lower()
+        if filetype not in Converter.filetypes:
+            raise ValueError(f'Unsupported file type: {filetype}')
+        job_id = ConversionCache.key(page, filetype)
+        with self._lock:
+            self._forget_finished()
+            with self.store.transaction():
+                known = self.store.get(job_id)
+                if known is not None and known.active:
+                    return self.jobs.get(job_id) or known
+                job = ConversionJob(job_id, owner, page.url, filetype)
+                cached = self.cache.open(job_id)
+                if cached is not None:
+                    with cached:
+                        if known is not None and known.status == SUCCESS:
+                            return self.jobs.get(job_id) or known
+                        self._finish(job, size=os.fstat(cached.fileno()).st_size)
+                    self.store.add(job)
+                    return job
+                # failed, or its artifact was evicted since, convert again
+                self._check_limits(owner)
+                self.store.add(job)
+            self.jobs[job_id] = job
+            try:
+                job.future = self.executor.submit(
+                    run_conversion, snapshot(page), filetype,
+                    self.cache.directory, self.cache.max_bytes)
+            except BaseException as e:
+                self._finish(job, error=str(e) or type(e).__name__)
+                self.store.finish(job.id, error=job.error)
+                raise
+            metrics.incr('conversion.submitted')
+            metrics.gauge('conversion.queue_depth', self.queue_depth)
+        job.future.add_done_callback(lambda future: self._completed(job, future))
+        return job
+
+    def get(self, job_id):
+        """
+        Look up a job and refresh its status.
+
+        Jobs that are no longer in the store are reported as finished if
+        their artifact is in the cache.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            ConversionJob: The job, or None if it is unknown.
+
+        """
+        if not JOB_ID_REGEX.match(job_id):
+            return None
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            if job.status == QUEUED and job.future is not None \
+                    and job.future.running():
+                job.status = RUNNING
+            return job
+        job = self.store.get(job_id)
+        if job is not None:
+            return job
+        cached = self.cache.open(job_id)
+        if cached is None:
+            return None
+        with cached:
+            job = ConversionJob(job_id, None, None, job_id.rsplit('.', 1)[1])
+            self._finish(job, size=os.fstat(cached.fileno()).st_size)
+        return job
+
+    def wait(self, job, timeout):
+        """
+        Wait for a job to finish, whichever process runs it.
+
+        Args:
+            job (ConversionJob): The job to wait for.
+            timeout (float): Seconds to wait at most.
+
+        Returns:
+            ConversionJob: The job with its latest status, which is still
+                active if it did not finish in time.
+
+        """
+        if job.future is not None:
+            try:
+                job.future.exception(timeout)
+            except FutureTimeout:
+                return job
+            # the done callback updates the job right after the future
+            while job.active:
+                time.sleep(0.01)
+            return job
+        deadline = time.time() + timeout
+        while job.active and time.time() < deadline:
+            time.sleep(0.2)
+            job = self.get(job.id) or job
+        return job
+
+    def position(self, job):
+        """
+        Returns the number of unfinished jobs submitted before `job`.
+        """
+        position = 0
+        for other in self.store.active():
+            if other.id == job.id:
+                return position
+            position += 1
+        return None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.store.close()
+
+    def _check_limits(self, owner):
+        active = self.store.active()
+        if len(active) >= self.max_queue:
+            metrics.incr('conversion.rejected')
+            raise JobRejected('The conversion queue is full, please try again later.', 503)
+        if sum(1 for job in active if job.owner == owner) >= self.per_user:
+            metrics.incr('conversion.rejected')
+            raise JobRejected('Too many conversions in progress, please wait for them to finish.', 429)
+
+    def _completed(self, job, future):
+        size = error = None
+        try:
+            size = future.result()
+            metrics.incr('conversion.completed')
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            metrics.incr('conversion.failed')
+        try:
+            # other processes see the result before this one reports it
+            self.store.finish(job.id, size, error)
+            metrics.gauge('conversion.queue_depth', self.queue_depth)
+        finally:
+            self._finish(job, size, error)
+
+    def _finish(self, job, size=None, error=None):
+        job.size = size
+        job.error = error
+        job.status = FAILED if error is not None else SUCCESS
+        job.finished = time.time()
+
+    def _forget_finished(self):
+        deadline = time.time() - self.keep_for
+        self.store.forget_finished(deadline)
+        for job_id, job in list(self.jobs.items()):
+            if not job.active and job.finished < deadline:
+                del self.jobs[job_id]
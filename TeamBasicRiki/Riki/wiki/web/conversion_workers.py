@@ -0,0 +1,215 @@
+"""
+    Conversion Workers
+    ~~~~~~~~~~~~~~~~~~
+
+    A process pool for running untrusted conversions. Unlike
+    :class:`concurrent.futures.ProcessPoolExecutor` every job has a wall
+    clock timeout after which its worker is killed, workers run with an
+    address space limit so a runaway conversion fails with a
+    :class:`MemoryError` instead of exhausting the machine, and workers
+    are replaced after a number of jobs so fragmented or leaked memory
+    is given back. A worker that dies or hangs fails only the job it was
+    running; it is replaced before the next job.
+
+    Workers are never forked from the web worker itself, which has many
+    threads: the address space limit would apply on top of everything
+    the parent had mapped, and locks held by other threads at the time
+    of the fork would stay locked in the child. They are started by a
+    fork server (or spawned where there is none) instead.
+"""
+from concurrent.futures import Future
+import multiprocessing
+import queue
+import threading
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class WorkerError(Exception):
+    """
+        Raised for a job whose worker process hung or died.
+    """
+
+
+class JobTimeout(WorkerError):
+    pass
+
+
+class WorkerCrashed(WorkerError):
+    pass
+
+
+def _worker_main(conn, memory_limit, max_jobs):
+    if memory_limit and resource is not None:
+        # RLIMIT_RSS is not enforced by Linux, limit the address space
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    for _ in range(max_jobs):
+        try:
+            fn, args = conn.recv()
+        except EOFError:
+            break
+        try:
+            conn.send((True, fn(*args)))
+        except MemoryError:
+            conn.send((False, MemoryError('The conversion ran out of memory.')))
+            # the heap may be in a sorry state, start over in a new worker
+            break
+        except Exception as e:
+            try:
+                conn.send((False, e))
+            except Exception:
+                # the exception itself could not be pickled
+                conn.send((False, WorkerError(repr(e))))
+    conn.close()
+
+
+class _Worker(object):
+    def __init__(self, context, memory_limit, max_jobs):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, memory_limit, max_jobs),
+            daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def stop(self, kill=False):
+        self.conn.close()
+        if kill:
+            self.process.kill()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+class IsolatedWorkerPool(object):
+    """
+        A pool of conversion processes with per job limits.
+
+        :param int workers: the number of worker processes
+        :param float timeout: seconds a job may take, None for no limit
+        :param int memory_limit: the address space limit of a worker in
+            bytes, None for no limit
+        :param int max_jobs_per_worker: the number of jobs after which a
+            worker is replaced
+    """
+
+    def __init__(self, workers=2, timeout=60, memory_limit=None,
+                 max_jobs_per_worker=50):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+            else 'spawn')
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, fn, *args):
+        """
+            Schedules ``fn(*args)`` on a worker process. `fn` and `args`
+            must be picklable.
+
+            :returns: the future of the job
+            :rtype: :class:`concurrent.futures.Future`
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot submit after shutdown')
+            self._queue.put((future, fn, args))
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._dispatch, name='conversion-worker',
+                    daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self._lock:
+            self._shutdown = True
+            threads = list(self._threads)
+        if cancel_futures:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _dispatch(self):
+        worker = None
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                future, fn, args = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if worker is None:
+                    try:
+                        worker = _Worker(self._context, self.memory_limit,
+                                         self.max_jobs_per_worker)
+                    except Exception as e:
+                        # out of processes or memory, fail the job but
+                        # keep dispatching
+                        future.set_exception(WorkerCrashed(
+                            'The conversion worker could not be started: %s' % e))
+                        continue
+                try:
+                    result = self._run(worker, fn, args)
+                except WorkerError as e:
+                    worker = None
+                    future.set_exception(e)
+                    continue
+                except MemoryError as e:
+                    # the worker exits after running out of memory
+                    worker.stop()
+                    worker = None
+                    future.set_exception(e)
+                    continue
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+                worker.jobs += 1
+                if worker.jobs >= self.max_jobs_per_worker \
+                        or not worker.process.is_alive():
+                    worker.stop()
+                    worker = None
+        finally:
+            if worker is not None:
+                worker.stop()
+
+    def _run(self, worker, fn, args):
+        try:
+            worker.conn.send((fn, args))
+            if not worker.conn.poll(self.timeout):
+                worker.stop(kill=True)
+                raise JobTimeout(
+                    'The conversion did not finish within %s seconds.'
+                    % self.timeout)
+            ok, value = worker.conn.recv()
+        except (EOFError, OSError):
+            worker.stop()
+            raise WorkerCrashed(
+                'The conversion worker died (exit code %s).'
+                % worker.process.exitcode)
+        if not ok:
+            raise value
+        return value
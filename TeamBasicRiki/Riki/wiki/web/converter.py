@@ -1,8 +1,43 @@
 import base64
-import markdown2
-from docx import Document
+import os
+from collections import OrderedDict
+from html import escape
 from io import BytesIO
-from pdfdocument.document import PDFDocument
+
+PYGMENTS_CSS = os.path.join(os.path.dirname(__file__), 'static', 'pygments.css')
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+{css}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+_pygments_css = None
+
+
+def get_pygments_css():
+    """
+    Read the stylesheet for highlighted code blocks, once per process.
+
+    Returns:
+        str: The contents of pygments.css.
+
+    """
+    global _pygments_css
+    if _pygments_css is None:
+        with open(PYGMENTS_CSS, encoding='utf-8') as f:
+            _pygments_css = f.read()
+    return _pygments_css
 
 
 def get_file_size(data):
@@ -16,8 +51,20 @@ def get_file_size(data):
         str: A string with the formatted file size.
 
     """
-    size_in_bytes = len(data)
+    return format_file_size(len(data))
+
+
+def format_file_size(size_in_bytes):
+    """
+    Format a size in bytes for readability.
 
+    Args:
+        size_in_bytes (int): The size to format.
+
+    Returns:
+        str: A string with the formatted file size.
+
+    """
     units = ['B', 'KB', 'MB', 'GB']
     factor = 1024
     size = size_in_bytes
@@ -37,50 +84,209 @@ def get_file_size(data):
     return formatted_size
 
 
+class CountingWriter(object):
+    """
+    Write-only wrapper around a stream that counts the bytes written.
+
+    Attributes:
+        stream (object): The wrapped binary stream.
+        size (int): The number of bytes written so far.
+
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def write(self, data):
+        self.stream.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        flush = getattr(self.stream, 'flush', None)
+        if flush is not None:
+            flush()
+
+
+#: file type -> writer, see :func:`register_format`
+FORMATS = OrderedDict()
+
+
+def register_format(filetype):
+    """
+    Register a writer for a file type.
+
+    Writers are called with the Converter and a binary stream and must
+    write the converted page into the stream. Libraries a writer needs
+    should be imported inside the writer, so that they are only loaded
+    by processes that actually convert to that format and not by every
+    web worker that imports this module.
+
+    Args:
+        filetype (str): The file type, e.g. 'pdf'.
+
+    Returns:
+        callable: A decorator registering the writer.
+
+    """
+    def decorator(writer):
+        FORMATS[filetype] = writer
+        return writer
+    return decorator
+
+
 class Converter(object):
     """
     converts content to different formats.
 
     Attributes:
         page (object): The page object to be converted.
+        standalone (bool): Whether HTML output is a complete document
+            with inlined styles or only the rendered page body.
+
+    The supported formats are the writers registered in `FORMATS`.
 
     Methods:
-        convert_to_PDF(): Convert content to PDF format.
-        convert_to_TXT(): Convert content to plain text format.
-        convert_to_HTML(): Convert content to HTML format.
-        convert_to_DOCX(): Convert content to DOCX format.
+        write_to(filetype, stream): Write the converted content into a stream.
+        to_bytes(filetype): Convert content to raw bytes.
+        convert_to_PDF(): Convert content to PDF format as base64.
+        convert_to_TXT(): Convert content to plain text format as base64.
+        convert_to_HTML(): Convert content to HTML format as base64.
+        convert_to_DOCX(): Convert content to DOCX format as base64.
 
     """
 
-    def __init__(self, page):
+    # Bump whenever the output of a conversion changes, cached artifacts
+    # of older versions are then no longer used.
+    version = 3
+
+    def __init__(self, page, standalone=True):
         """
         Initialize Converter object.
 
         Args:
             page (object): The page object to be converted.
+            standalone (bool): Whether HTML output is a complete document.
 
         """
         self.page = page
+        self.standalone = standalone
 
-    def convert_to_PDF(self):
+    def write_to(self, filetype, stream):
         """
-        Convert content to PDF format.
+        Write the content converted to the given format into a stream.
+
+        Args:
+            filetype (str): The target file type, e.g. 'pdf'.
+            stream (object): A binary stream to write into.
 
         Returns:
-            tuple: A tuple containing PDF content as base64 and file size.
+            int: The number of bytes written.
+
+        Raises:
+            ValueError: If the file type is not supported.
 
         """
-        markdown_content = self.page.content
-        pdf_buffer = BytesIO()
-        pdf_content = PDFDocument(pdf_buffer)
+        filetype = filetype.lower()
+        if filetype not in FORMATS:
+            raise ValueError(f'Unsupported file type: {filetype}')
+        writer = CountingWriter(stream)
+        FORMATS[filetype](self, writer)
+        return writer.size
+
+    def to_bytes(self, filetype):
+        """
+        Convert content to the given format.
+
+        Args:
+            filetype (str): The target file type, e.g. 'pdf'.
+
+        Returns:
+            tuple: A tuple containing the raw content and file size.
+
+        """
+        buffer = BytesIO()
+        self.write_to(filetype, buffer)
+        data = buffer.getvalue()
+        return data, get_file_size(data)
+
+    @register_format('pdf')
+    def write_PDF(self, stream):
+        """
+        Write content in PDF format into a stream.
+
+        Args:
+            stream (object): A binary stream to write into.
+
+        """
+        # reportlab takes a good part of a second to import
+        from pdfdocument.document import PDFDocument
+        pdf_content = PDFDocument(stream)
         pdf_content.init_report()
         pdf_content.h1(self.page.title)
-        pdf_content.p(markdown_content)
+        pdf_content.p(self.page.content)
         pdf_content.generate()
-        pdf_bytes = pdf_buffer.getvalue()
-        pdf_base64 = base64.b64encode(pdf_bytes).decode('utf-8')
-        file_size = get_file_size(pdf_bytes)
-        return pdf_base64, file_size
+
+    @register_format('txt')
+    def write_TXT(self, stream):
+        """
+        Write content in plain text format into a stream.
+
+        Args:
+            stream (object): A binary stream to write into.
+
+        """
+        stream.write(self.page.content.encode('utf-8'))
+
+    @register_format('html')
+    def write_HTML(self, stream):
+        """
+        Write content in HTML format into a stream.
+
+        Uses the HTML the page was already rendered to for display, so
+        the export matches what users see in the wiki.
+
+        Args:
+            stream (object): A binary stream to write into.
+
+        """
+        html = self.page.html
+        if self.standalone:
+            html = HTML_TEMPLATE.format(
+                title=escape(self.page.title),
+                css=get_pygments_css(),
+                body=html
+            )
+        stream.write(html.encode('utf-8'))
+
+    @register_format('docx')
+    def write_DOCX(self, stream):
+        """
+        Write content in DOCX format into a stream.
+
+        Args:
+            stream (object): A binary stream to write into.
+
+        """
+        from docx import Document
+        doc = Document()
+        doc.add_paragraph(self.page.content)
+        doc.save(stream)
+
+    def _to_base64(self, filetype):
+        data, file_size = self.to_bytes(filetype)
+        return base64.b64encode(data).decode('utf-8'), file_size
+
+    def convert_to_PDF(self):
+        """
+        Convert content to PDF format.
+
+        Returns:
+            tuple: A tuple containing PDF content as base64 and file size.
+
+        """
+        return self._to_base64('pdf')
 
     def convert_to_TXT(self):
         """
@@ -90,10 +296,7 @@ class Converter(object):
             tuple: A tuple containing text content as base64 and file size.
 
         """
-        txt_content = self.page.content.encode('utf-8')
-        txt_base64 = base64.b64encode(txt_content).decode('utf-8')
-        formatted_size = get_file_size(txt_content)
-        return txt_base64, formatted_size
+        return self._to_base64('txt')
 
     def convert_to_HTML(self):
         """
@@ -103,11 +306,7 @@ class Converter(object):
             tuple: A tuple containing HTML content as base64 and file size.
 
         """
-        html_content = markdown2.markdown(self.page.content)
-        html_content_bytes = html_content.encode('utf-8')
-        html_base64 = base64.b64encode(html_content_bytes).decode('utf-8')
-        formatted_size = get_file_size(html_content_bytes)
-        return html_base64, formatted_size
+        return self._to_base64('html')
 
     def convert_to_DOCX(self):
         """
@@ -117,11 +316,8 @@ class Converter(object):
             tuple: A tuple containing DOCX content as base64 and file size.
 
         """
-        doc = Document()
-        doc.add_paragraph(self.page.content)
-        docx_content = BytesIO()
-        doc.save(docx_content)
-        docx_bytes = docx_content.getvalue()
-        docx_base64 = base64.b64encode(docx_bytes).decode('utf-8')
-        file_size = get_file_size(docx_bytes)
-        return docx_base64, file_size
+        return self._to_base64('docx')
+
+
+# the supported file types in registration order
+Converter.filetypes = tuple(FORMATS)
@@ -0,0 +1,200 @@
+"""
+    Bulk Export
+    ~~~~~~~~~~~
+
+    Exports a selection of wiki pages (everything, a tag or a url
+    prefix) as a ZIP archive of converted documents. Pages are converted
+    in parallel on isolated worker processes and each document is added
+    to the archive as soon as it is done, while the archive itself is
+    streamed to the client or the output file. A page whose conversion
+    fails or exceeds its limits is replaced by a short error note
+    instead of aborting the whole export.
+
+    Every export starts its own worker processes, so the web app only
+    runs ``EXPORT_MAX_CONCURRENT`` exports at once, and
+    ``EXPORT_USER_LIMIT`` per user; further requests are turned away
+    with :class:`wiki.web.conversion_jobs.JobRejected`.
+"""
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+import threading
+import zipfile
+
+import click
+from flask import current_app
+
+from wiki.core import Wiki
+from wiki.web.conversion_jobs import JobRejected
+from wiki.web.conversion_jobs import snapshot
+from wiki.web.conversion_workers import IsolatedWorkerPool
+from wiki.web.converter import Converter
+from wiki.web.zipstream import stream_zip
+
+#: formats that are already compressed and are stored as they are
+STORED_FORMATS = ('docx',)
+
+
+def select_pages(wiki, tag=None, prefix=None):
+    """
+        Selects the pages to export.
+
+        :param wiki: the :class:`wiki.core.Wiki` to export from
+        :param str tag: only export pages with this tag
+        :param str prefix: only export pages whose url starts with this
+
+        :returns: the selected pages
+        :rtype: list
+    """
+    if tag:
+        pages = wiki.index_by_tag(tag)
+    else:
+        pages = wiki.index()
+    if prefix:
+        prefix = prefix.strip('/')
+        pages = [page for page in pages if page.url.startswith(prefix)]
+    return pages
+
+
+def convert_snapshot(page, filetype):
+    """
+        Converts a page snapshot to raw bytes. Runs in a pool process.
+    """
+    if filetype == 'md':
+        return page.content.encode('utf-8')
+    return Converter(page).to_bytes(filetype)[0]
+
+
+class ExportLimiter(object):
+    """
+        Counts the exports running in this process.
+
+        :param int max_exports: the number of exports running at once
+        :param int per_user: the number of exports one user may run at
+            once
+    """
+
+    def __init__(self, max_exports=2, per_user=1):
+        self.max_exports = max_exports
+        self.per_user = per_user
+        self._lock = threading.Lock()
+        self._running = Counter()
+
+    def acquire(self, owner):
+        """
+            Takes a slot for an export of `owner`.
+
+            :raises JobRejected: with status 503 if every slot is taken
+                and 429 if `owner` has used up its own
+
+            :returns: a function that gives the slot back, calling it
+                again does nothing
+        """
+        with self._lock:
+            if sum(self._running.values()) >= self.max_exports:
+                raise JobRejected('Too many exports in progress, please try again later.', 503)
+            if self._running[owner] >= self.per_user:
+                raise JobRejected('Your previous export is still in progress, '
+                                  'please wait for it to finish.', 429)
+            self._running[owner] += 1
+        released = threading.Event()
+
+        def release():
+            with self._lock:
+                if released.is_set():
+                    return
+                released.set()
+                self._running[owner] -= 1
+                if not self._running[owner]:
+                    del self._running[owner]
+        return release
+
+    @property
+    def running(self):
+        with self._lock:
+            return sum(self._running.values())
+
+
+def export_pages(pages, filetype, workers=2, timeout=60, memory_limit=None):
+    """
+        Converts pages and streams them as a ZIP archive.
+
+        At most two conversions per worker are in flight at any time, so
+        memory use does not depend on the number of exported pages.
+
+        :param list pages: the pages to export
+        :param str filetype: the target file type, e.g. 'pdf'
+        :param int workers: the number of conversion processes
+        :param float timeout: seconds the conversion of one page may take
+        :param int memory_limit: the address space limit of a conversion
+            process in bytes
+
+        :returns: a generator of the archive's bytes
+    """
+    filetype = filetype.lower()
+    if filetype != 'md' and filetype not in Converter.filetypes:
+        raise ValueError('Unsupported file type: %s' % filetype)
+    compress_type = zipfile.ZIP_STORED if filetype in STORED_FORMATS \
+        else zipfile.ZIP_DEFLATED
+    # only the picklable part of the pages is sent to the pool
+    snapshots = [snapshot(page) for page in pages]
+    pool = IsolatedWorkerPool(workers, timeout, memory_limit)
+    return stream_zip(
+        (name, [data], compress_type if ok else zipfile.ZIP_DEFLATED, len(data))
+        for name, ok, data in _convert_all(snapshots, filetype, pool)
+    )
+
+
+def _convert_all(snapshots, filetype, pool):
+    pending = iter(snapshots)
+    in_flight = {}
+    try:
+        while True:
+            while len(in_flight) < pool.workers * 2:
+                page = next(pending, None)
+                if page is None:
+                    break
+                future = pool.submit(convert_snapshot, page, filetype)
+                in_flight[future] = page
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                page = in_flight.pop(future)
+                try:
+                    yield '%s.%s' % (page.url, filetype), True, future.result()
+                except Exception as e:
+                    message = 'Converting %s failed: %s\n' % (
+                        page.url, str(e) or type(e).__name__)
+                    yield '%s.%s.error.txt' % (page.url, filetype), False, \
+                        message.encode('utf-8')
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+@click.command('export')
+@click.option('--tag', help='Only export pages with this tag.')
+@click.option('--prefix', help='Only export pages below this url.')
+@click.option('--format', 'filetype', default='pdf', show_default=True,
+              type=click.Choice(('md',) + Converter.filetypes))
+@click.option('--workers', default=2, show_default=True)
+@click.option('--timeout', default=60, show_default=True,
+              help='Seconds the conversion of one page may take.')
+@click.argument('output', type=click.File('wb'))
+def export_command(tag, prefix, filetype, workers, timeout, output):
+    """Export wiki pages as a ZIP archive of documents to OUTPUT."""
+    # rendering the pages builds wiki links with url_for
+    with current_app.test_request_context():
+        wiki = Wiki(current_app.config['CONTENT_DIR'])
+        pages = select_pages(wiki, tag, prefix)
+    memory_limit = current_app.config.get('CONVERSION_MEMORY_LIMIT')
+    for chunk in export_pages(pages, filetype, workers, timeout, memory_limit):
+        output.write(chunk)
+    click.echo('Exported %d pages.' % len(pages), err=True)
+
+
+def init_app(app):
+    app.extensions['export_limiter'] = ExportLimiter(
+        app.config.get('EXPORT_MAX_CONCURRENT', 2),
+        app.config.get('EXPORT_USER_LIMIT', 1))
+    app.cli.add_command(export_command)
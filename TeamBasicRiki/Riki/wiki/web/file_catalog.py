@@ -0,0 +1,285 @@
+"""
+    File Catalog
+    ~~~~~~~~~~~~
+
+    The persistent index of a content addressed file store. It maps file
+    names to the SHA-256 of their contents and keeps a reference count
+    per blob, so a blob is only removed once the last name pointing to
+    it is deleted. It also records each file's size, upload time and
+    uploader, so listing, sorting and filtering the files never touches
+    the file system, and each blob's content coding if it is stored
+    compressed.
+
+    Files belong to a namespace, a user's own files or the
+    :data:`SHARED` files, and names only need to be unique within their
+    namespace. Blobs are shared by all namespaces. The number and total
+    size of the files in each namespace are kept in the ``usage`` table,
+    updated together with the files, so checking a quota is a single
+    lookup. A namespace is charged for the full size of its files, even
+    if their contents are also stored for somebody else.
+
+    The catalog is a SQLite database. Changes are made in
+    :meth:`FileCatalog.transaction`, which holds the database's write
+    lock; the store moves blob files in and out while holding it, so the
+    files on disk always match the reference counts, even with several
+    worker processes.
+"""
+import collections
+from contextlib import contextmanager
+import sqlite3
+import time
+
+FILES_TABLE = """
+CREATE TABLE IF NOT EXISTS files (
+    namespace TEXT NOT NULL DEFAULT '',
+    name TEXT NOT NULL,
+    sha256 TEXT NOT NULL REFERENCES blobs (sha256),
+    size INTEGER,
+    mtime REAL,
+    uploader TEXT,
+    PRIMARY KEY (namespace, name)
+)"""
+
+SCHEMA = FILES_TABLE + """;
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL,
+    encoding TEXT,
+    stored_size INTEGER
+);
+CREATE TABLE IF NOT EXISTS usage (
+    namespace TEXT PRIMARY KEY,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS files_namespace_size ON files (namespace, size);
+CREATE INDEX IF NOT EXISTS files_namespace_mtime ON files (namespace, mtime);
+CREATE INDEX IF NOT EXISTS files_namespace_uploader ON files (namespace, uploader);
+"""
+
+#: the namespace of the files shared by all users
+SHARED = ''
+
+#: a listed file, `sha256` and `uploader` may be None
+StoredFile = collections.namedtuple('StoredFile', ['name', 'size', 'mtime', 'sha256', 'uploader'])
+
+#: how the contents of a file are stored, `encoding` is None for raw blobs
+Blob = collections.namedtuple('Blob', ['sha256', 'size', 'encoding', 'stored_size'])
+
+SORT_KEYS = ('name', 'size', 'mtime', 'uploader')
+
+
+def escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class FileCatalog(object):
+    """
+        :param str path: the path of the database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # transactions are started explicitly, see transaction()
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.executescript(SCHEMA)
+        self._migrate()
+        self.db.executescript(INDEXES)
+
+    def _migrate(self):
+        columns = set(row[1] for row in self.db.execute('PRAGMA table_info(files)'))
+        if 'size' not in columns:
+            with self.transaction():
+                for column in ('size INTEGER', 'mtime REAL', 'uploader TEXT'):
+                    self.db.execute('ALTER TABLE files ADD COLUMN ' + column)
+                self.db.execute(
+                    'UPDATE files SET size = '
+                    '(SELECT size FROM blobs WHERE blobs.sha256 = files.sha256)')
+        columns = set(row[1] for row in self.db.execute('PRAGMA table_info(blobs)'))
+        if 'encoding' not in columns:
+            with self.transaction():
+                for column in ('encoding TEXT', 'stored_size INTEGER'):
+                    self.db.execute('ALTER TABLE blobs ADD COLUMN ' + column)
+        columns = set(row[1] for row in self.db.execute('PRAGMA table_info(files)'))
+        if 'namespace' not in columns:
+            # the primary key changes, so the table is rebuilt, and the
+            # files of the catalog become the shared files
+            with self.transaction():
+                self.db.execute('ALTER TABLE files RENAME TO files_old')
+                self.db.execute(FILES_TABLE)
+                self.db.execute(
+                    'INSERT INTO files (namespace, name, sha256, size, mtime, uploader) '
+                    'SELECT ?, name, sha256, size, mtime, uploader FROM files_old', (SHARED,))
+                self.db.execute('DROP TABLE files_old')
+                self.recount_usage()
+
+    def recount_usage(self):
+        """
+            Recomputes the usage of every namespace from the files. Must
+            be called in a transaction.
+        """
+        self.db.execute('DELETE FROM usage')
+        self.db.execute(
+            'INSERT INTO usage (namespace, files, bytes) '
+            'SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM files GROUP BY namespace')
+
+    def close(self):
+        self.db.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+            Runs the block as one write transaction. Other writers wait
+            until it is committed or rolled back.
+        """
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            yield self
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def get(self, name, namespace=SHARED):
+        """
+            :returns: the sha256 of the file `name` or None
+        """
+        row = self.db.execute(
+            'SELECT sha256 FROM files WHERE namespace = ? AND name = ?',
+            (namespace, name)).fetchone()
+        return row[0] if row else None
+
+    def get_blob(self, name, namespace=SHARED):
+        """
+            :returns: the :class:`Blob` holding the contents of the file
+                `name` or None
+        """
+        row = self.db.execute(
+            'SELECT sha256, blobs.size, encoding, COALESCE(stored_size, blobs.size) '
+            'FROM files JOIN blobs USING (sha256) WHERE namespace = ? AND name = ?',
+            (namespace, name)).fetchone()
+        return Blob(*row) if row else None
+
+    def names(self, namespace=SHARED):
+        return [row[0] for row in self.db.execute(
+            'SELECT name FROM files WHERE namespace = ? ORDER BY name', (namespace,))]
+
+    def usage(self, namespace=SHARED):
+        """
+            :returns: the number of files in `namespace` and their total
+                size in bytes
+            :rtype: tuple
+        """
+        row = self.db.execute(
+            'SELECT files, bytes FROM usage WHERE namespace = ?', (namespace,)).fetchone()
+        return tuple(row) if row else (0, 0)
+
+    def query(self, search=None, uploader=None, sort='name', descending=False,
+              offset=0, limit=50, namespace=SHARED):
+        """
+            Lists a page of the files of a namespace.
+
+            :param str search: only list files whose name contains this
+            :param str uploader: only list files uploaded by this user
+            :param str sort: one of :data:`SORT_KEYS`
+            :param bool descending: reverse the order
+            :param int offset: the number of files to skip
+            :param int limit: the maximum number of files to return
+            :param str namespace: the namespace to list
+
+            :returns: the :class:`StoredFile` entries of the page and the
+                total number of matching files
+            :rtype: tuple
+        """
+        where = ['namespace = ?']
+        args = [namespace]
+        if search:
+            where.append("name LIKE ? ESCAPE '\\'")
+            args.append('%' + escape_like(search) + '%')
+        if uploader:
+            where.append('uploader = ?')
+            args.append(uploader)
+        clause = ' WHERE ' + ' AND '.join(where)
+        total = self.db.execute('SELECT COUNT(*) FROM files' + clause, args).fetchone()[0]
+        if sort not in SORT_KEYS:
+            sort = 'name'
+        order = '%s %s, name' % (sort, 'DESC' if descending else 'ASC')
+        rows = self.db.execute(
+            'SELECT name, size, mtime, sha256, uploader FROM files%s '
+            'ORDER BY %s LIMIT ? OFFSET ?' % (clause, order),
+            args + [limit, offset])
+        return [StoredFile(*row) for row in rows], total
+
+    def add(self, name, sha256, size, uploader=None, mtime=None, encoding=None,
+            stored_size=None, namespace=SHARED):
+        """
+            Adds the file `name` to `namespace` and references its blob.
+            Must be called in a transaction. `encoding` and `stored_size`
+            describe a new blob and are ignored if the blob is already
+            stored.
+
+            :returns: True if the blob was not referenced before, False if
+                it is already stored, or None if `name` is taken
+        """
+        try:
+            self.db.execute(
+                'INSERT INTO files (namespace, name, sha256, size, mtime, uploader) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (namespace, name, sha256, size,
+                 time.time() if mtime is None else mtime, uploader))
+        except sqlite3.IntegrityError:
+            return None
+        self.db.execute(
+            'INSERT INTO usage (namespace, files, bytes) VALUES (?, 1, ?) '
+            'ON CONFLICT (namespace) DO UPDATE SET files = files + 1, bytes = bytes + ?',
+            (namespace, size, size))
+        self.db.execute(
+            'INSERT INTO blobs (sha256, size, refs, encoding, stored_size) '
+            'VALUES (?, ?, 1, ?, ?) '
+            'ON CONFLICT (sha256) DO UPDATE SET refs = refs + 1',
+            (sha256, size, encoding, stored_size))
+        refs = self.db.execute(
+            'SELECT refs FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()[0]
+        return refs == 1
+
+    def remove(self, name, namespace=SHARED):
+        """
+            Removes the file `name` from `namespace` and releases its
+            blob. Must be called in a transaction.
+
+            :returns: the sha256 of the file and whether its blob is no
+                longer referenced, or None if there is no such file
+        """
+        row = self.db.execute(
+            'SELECT sha256, size FROM files WHERE namespace = ? AND name = ?',
+            (namespace, name)).fetchone()
+        if row is None:
+            return None
+        sha256, size = row
+        self.db.execute('DELETE FROM files WHERE namespace = ? AND name = ?', (namespace, name))
+        self.db.execute(
+            'UPDATE usage SET files = files - 1, bytes = bytes - ? WHERE namespace = ?',
+            (size or 0, namespace))
+        self.db.execute('UPDATE blobs SET refs = refs - 1 WHERE sha256 = ?', (sha256,))
+        unreferenced = self.db.execute(
+            'DELETE FROM blobs WHERE sha256 = ? AND refs <= 0', (sha256,)).rowcount > 0
+        return sha256, unreferenced
+
+    def stats(self):
+        """
+            :returns: the number of files and blobs, the total size of all
+                files in all namespaces, the size of the distinct contents
+                and the size of the stored, possibly compressed, blobs
+            :rtype: dict
+        """
+        files, logical = self.db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files').fetchone()
+        blobs, unique, stored = self.db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0), '
+            'COALESCE(SUM(COALESCE(stored_size, size)), 0) FROM blobs').fetchone()
+        return {'files': files, 'blobs': blobs, 'size': logical, 'unique': unique,
+                'stored': stored}
@@ -1,30 +1,510 @@
+import errno
+import hashlib
 import os
-from flask import send_from_directory
+import tempfile
+import zipfile
+from flask import abort
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+from wiki.web.compression import choose_encoding, compress_file, is_compressed, open_encoded
+from wiki.web.file_catalog import SHARED, FileCatalog, StoredFile
+from wiki.web.ranges import send_stored_file
+from wiki.web.zipstream import stream_zip
+
+#: bytes copied per read while receiving an upload
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    def __init__(self, max_size):
+        super(UploadTooLarge, self).__init__(
+            'The file is larger than the limit of %d bytes.' % max_size)
+        self.max_size = max_size
+
+
+class FileExists(UploadError):
+    pass
+
+
+class QuotaExceeded(UploadError):
+    def __init__(self, quota):
+        super(QuotaExceeded, self).__init__(
+            'The file does not fit into the quota of %d bytes.' % quota)
+        self.quota = quota
+
+
+def file_digest(path):
+    """
+        :returns: the sha256 hex digest and the size of the file at `path`
+    """
+    checksum = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            checksum.update(chunk)
+            size += len(chunk)
+    return checksum.hexdigest(), size
+
+
+def namespace_directory(directory, namespace):
+    """
+        :returns: the directory holding the files of `namespace` in the
+            flat layout, ``.namespaces/<ab>/<sha256 of the namespace>``
+            below `directory`, or `directory` itself for the shared files
+    """
+    if namespace is None:
+        return directory
+    key = hashlib.sha256(namespace.encode('utf-8')).hexdigest()
+    return os.path.join(directory, '.namespaces', key[:2], key)
+
 
 class FileManager(object):
-    def __init__(self, directory):
-        self._directory = directory
+    """
+        Stores each file under its name, the shared files at the top of
+        `directory` and the files of a namespace in a directory of their
+        own, see :func:`namespace_directory`.
+
+        :param str directory: the directory of the store
+        :param str namespace: the user whose files are managed, None for
+            the shared files
+    """
+
+    #: the most bytes the namespace may hold, see :meth:`check_quota`
+    quota = None
+
+    def __init__(self, directory, namespace=None):
+        self.namespace = namespace
+        #: the top directory of the store, shared by all namespaces
+        self._root = directory
+        self._directory = namespace_directory(directory, namespace)
+        # temporary files must be on the same file system as the store
+        self._tmp = self._directory
+        #: where resumable upload sessions are kept
+        self.upload_directory = os.path.join(directory, '.uploads')
         if not os.path.exists(self._directory):
-            os.mkdir(self._directory)
+            os.makedirs(self._directory)
 
     def get_downloadable_files(self):
-        return os.listdir(self._directory)
+        # dotfiles are uploads in progress
+        return [name for name in os.listdir(self._directory) if not name.startswith('.')]
+
+    def list_files(self, search=None, sort='name', descending=False, offset=0, limit=50):
+        """
+            Lists a page of the stored files.
+
+            The flat layout has no catalog, so this scans the directory;
+            :class:`DedupFileManager` answers from its index instead.
+
+            :param str search: only list files whose name contains this
+            :param str sort: one of 'name', 'size', 'mtime' or 'uploader'
+            :param bool descending: reverse the order
+            :param int offset: the number of files to skip
+            :param int limit: the maximum number of files to return
+
+            :returns: the :class:`StoredFile` entries of the page and the
+                total number of matching files
+            :rtype: tuple
+        """
+        files = []
+        for entry in os.scandir(self._directory):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            if search and search.lower() not in entry.name.lower():
+                continue
+            stat = entry.stat()
+            files.append(StoredFile(entry.name, stat.st_size, stat.st_mtime, None, None))
+        if sort not in ('name', 'size', 'mtime'):
+            sort = 'name'
+        files.sort(key=lambda file: (getattr(file, sort), file.name), reverse=descending)
+        return files[offset:offset + limit], len(files)
 
     def download_file(self, file_name):
-       dir_path = os.path.join(os.getcwd(), self._directory)
-       return send_from_directory(dir_path, file_name, as_attachment=True)
+        located = self.locate(file_name)
+        if located is None:
+            abort(404)
+        path, etag = located
+        return send_stored_file(path, file_name, etag, self._root)
+
+    def locate(self, file_name):
+        """
+            :returns: the path of the stored file `file_name` and a strong
+                ETag of its contents, or None if there is no such file
+        """
+        # stored names never contain a separator, see check_name; a name
+        # like x/../.namespaces/... would reach into another namespace
+        if '/' in file_name or os.sep in file_name or file_name.startswith('.'):
+            return None
+        path = safe_join(self._directory, file_name)
+        if path is None or os.path.dirname(path) != self._directory \
+                or not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        return path, '%x-%x-%x' % (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def open_file(self, file_name):
+        """
+            :returns: the contents of `file_name` as a binary file object,
+                or None if there is no such file
+        """
+        located = self.locate(file_name)
+        return open(located[0], 'rb') if located else None
+
+    def file_size(self, file_name):
+        located = self.locate(file_name)
+        return os.path.getsize(located[0]) if located else None
+
+    def stream_archive(self, file_names):
+        """
+            Streams stored files as a ZIP archive while it is being built.
+
+            Every file is read in chunks of :data:`CHUNK_SIZE` and only
+            opened when its turn comes, so memory use does not depend on
+            the size of the archive. Files that are compressed already,
+            judged by their name and first bytes, are stored as they are,
+            everything else is deflated. Names that are not stored, or
+            are deleted before their turn, are left out.
+
+            :param list file_names: the files to add, duplicates are
+                added once
+
+            :returns: a generator of the archive's bytes
+        """
+        return stream_zip(self._archive_entries(file_names))
+
+    def _archive_entries(self, file_names):
+        seen = set()
+        for name in file_names:
+            if name in seen:
+                continue
+            seen.add(name)
+            size = self.file_size(name)
+            try:
+                f = self.open_file(name) if size is not None else None
+            except FileNotFoundError:
+                f = None
+            if f is None:
+                continue
+            try:
+                head = f.read(CHUNK_SIZE)
+            except BaseException:
+                f.close()
+                raise
+            compress_type = zipfile.ZIP_STORED if is_compressed(head, name) \
+                else zipfile.ZIP_DEFLATED
+            yield name, self._read_chunks(f, head), compress_type, size
 
-    def upload_file(self, file):
-        current_files = self.get_downloadable_files()
-        if file.filename == "" or file.filename in current_files:
+    def _read_chunks(self, f, head):
+        with f:
+            while head:
+                yield head
+                head = f.read(CHUNK_SIZE)
+
+    def upload_file(self, file, max_size=None, uploader=None):
+        if file.filename == "":
+            return False
+        try:
+            self.save_stream(file.filename, file.stream, max_size, uploader)
+        except FileExists:
             return False
-        file.save(os.path.join(self._directory, file.filename))
         return True
 
+    def save_stream(self, file_name, stream, max_size=None, uploader=None):
+        """
+            Stores the contents of a binary stream under `file_name`.
+
+            The stream is copied in chunks of :data:`CHUNK_SIZE` into a
+            hidden temporary file, so memory use does not depend on the
+            size of the upload and the file is not listed before it is
+            complete. The finished file is then published atomically and
+            never replaces an existing file.
+
+            :param str file_name: the name to store the file under
+            :param stream: a binary stream to read the contents from
+            :param int max_size: the maximum size in bytes, None for no
+                limit
+            :param str uploader: the name of the uploading user, kept by
+                stores with a catalog
+
+            :raises UploadError: if the name is not a valid file name
+            :raises FileExists: if a file of that name already exists
+            :raises UploadTooLarge: as soon as the stream exceeds
+                `max_size`
+
+            :returns: the stored name, the sha256 hex digest and the size
+                of the file
+            :rtype: tuple
+        """
+        name = self.check_name(file_name)
+        if self.exists(name):
+            raise FileExists('A file named %s already exists.' % name)
+        tmp_path, checksum, size = self._receive(stream, max_size, self._tmp)
+        try:
+            self._store(tmp_path, name, checksum, size, uploader)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return name, checksum, size
+
+    def import_file(self, path, file_name, uploader=None):
+        """
+            Moves a complete file into the store without copying it.
+
+            :param str path: the file, on the same file system as the store
+            :param str file_name: the name to store the file under
+            :param str uploader: the name of the uploading user
+
+            :raises UploadError: if the name is not a valid file name
+            :raises FileExists: if a file of that name already exists, the
+                file at `path` is left alone then
+
+            :returns: the stored name, the sha256 hex digest and the size
+                of the file
+            :rtype: tuple
+        """
+        name = self.check_name(file_name)
+        if self.exists(name):
+            raise FileExists('A file named %s already exists.' % name)
+        checksum, size = file_digest(path)
+        self._store(path, name, checksum, size, uploader)
+        if os.path.exists(path):
+            os.remove(path)
+        return name, checksum, size
+
+    def check_quota(self, size):
+        """
+            Checks that a file of `size` bytes fits into the quota of the
+            namespace. Only :class:`DedupFileManager` enforces quotas.
+
+            :raises QuotaExceeded: if it does not fit
+        """
+
+    def usage(self):
+        """
+            :returns: the number of files in the namespace and their total
+                size, None if the store does not keep track
+        """
+        return None
+
+    def check_name(self, file_name):
+        """
+            :returns: the name a file called `file_name` is stored under
+            :raises UploadError: if there is no usable name
+        """
+        name = secure_filename(file_name)
+        if not name:
+            raise UploadError('Invalid file name: %r' % file_name)
+        return name
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self._directory, name))
+
+    def _store(self, tmp_path, name, checksum, size, uploader=None, mtime=None):
+        self._publish(tmp_path, os.path.join(self._directory, name))
+
+    def _receive(self, stream, max_size, directory):
+        """
+            Copies `stream` into a new hidden file in `directory`.
+
+            :returns: the path of the file, the sha256 hex digest and the
+                size of its contents
+        """
+        checksum = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            size = 0
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise UploadTooLarge(max_size)
+                    checksum.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, checksum.hexdigest(), size
+
+    def _publish(self, tmp_path, path):
+        try:
+            # unlike a rename, a link fails if the name was taken meanwhile
+            os.link(tmp_path, path)
+        except FileExistsError:
+            raise FileExists('A file named %s already exists.' % os.path.basename(path))
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EXDEV):
+                raise
+            # the file system has no hard links
+            if os.path.exists(path):
+                raise FileExists('A file named %s already exists.' % os.path.basename(path))
+            os.replace(tmp_path, path)
+
     def delete_file(self, file_name):
-        current_files = self.get_downloadable_files()
-        if file_name not in current_files:
+        located = self.locate(file_name)
+        if located is None:
             return False
-        os.remove(os.path.join(self._directory, file_name))
+        os.remove(located[0])
+        return True
+
+    def stats(self):
+        """
+            :returns: the statistics of a store with a catalog, None for
+                the flat layout
+        """
+        return None
+
+
+class DedupFileManager(FileManager):
+    """
+        A content addressed file store.
+
+        Every distinct content is stored once as a blob named after its
+        SHA-256, sharded into ``blobs/<ab>/<cd>/`` subdirectories so no
+        directory grows too large. A :class:`FileCatalog` maps file names
+        to blobs and counts references, so uploading a file that is
+        already stored under another name only adds a catalog entry, and
+        a blob is removed with the last name referring to it.
+
+        Files found at the top of the directory, left from the flat
+        :class:`FileManager` layout, are moved into the store.
+
+        With `compression` set, new blobs that sniff and probe as
+        compressible (see :mod:`wiki.web.compression`) are stored
+        compressed, and the catalog records their encoding.
+
+        Each manager works on the files of one namespace, all namespaces
+        share the blobs and the catalog. The catalog counts the bytes
+        stored in each namespace as files come and go, which is what the
+        `quota` is checked against.
+
+        :param str directory: the directory of the store
+        :param str compression: 'gzip', 'xz' or None to store every blob
+            raw
+        :param str namespace: the user whose files are managed, None for
+            the shared files
+        :param int quota: the most bytes the namespace may hold, None for
+            no limit
+    """
+
+    def __init__(self, directory, compression=None, namespace=None, quota=None):
+        # namespaces are kept apart by the catalog, not by directories
+        super(DedupFileManager, self).__init__(directory)
+        self.namespace = namespace
+        self._namespace = SHARED if namespace is None else namespace
+        self.compression = compression
+        self.quota = quota
+        self._blobs = os.path.join(directory, 'blobs')
+        self._tmp = os.path.join(directory, 'tmp')
+        for path in (self._blobs, self._tmp):
+            if not os.path.exists(path):
+                os.mkdir(path)
+        self.catalog = FileCatalog(os.path.join(directory, 'catalog.sqlite3'))
+        self._import_flat_files()
+
+    def blob_path(self, sha256):
+        return os.path.join(self._blobs, sha256[:2], sha256[2:4], sha256)
+
+    def get_downloadable_files(self):
+        return self.catalog.names(self._namespace)
+
+    def list_files(self, search=None, sort='name', descending=False, offset=0, limit=50):
+        return self.catalog.query(search, None, sort, descending, offset, limit,
+                                  self._namespace)
+
+    def _import_flat_files(self):
+        for entry in os.scandir(self._directory):
+            if not entry.is_file() or entry.name.startswith(('.', 'catalog.sqlite3')) \
+                    or self.catalog.get(entry.name) is not None:
+                continue
+            checksum, size = file_digest(entry.path)
+            self._store(entry.path, entry.name, checksum, size, mtime=entry.stat().st_mtime,
+                        namespace=SHARED)
+            if os.path.exists(entry.path):
+                os.remove(entry.path)
+
+    def locate(self, file_name):
+        sha256 = self.catalog.get(file_name, self._namespace)
+        if sha256 is None:
+            return None
+        return self.blob_path(sha256), sha256
+
+    def download_file(self, file_name):
+        blob = self.catalog.get_blob(file_name, self._namespace)
+        if blob is None:
+            abort(404)
+        return send_stored_file(self.blob_path(blob.sha256), file_name, blob.sha256,
+                                self._root, blob.encoding, blob.size)
+
+    def open_file(self, file_name):
+        blob = self.catalog.get_blob(file_name, self._namespace)
+        if blob is None:
+            return None
+        return open_encoded(self.blob_path(blob.sha256), blob.encoding)
+
+    def file_size(self, file_name):
+        blob = self.catalog.get_blob(file_name, self._namespace)
+        return blob.size if blob else None
+
+    def exists(self, name):
+        return self.catalog.get(name, self._namespace) is not None
+
+    def check_quota(self, size):
+        if self.quota is not None and self.catalog.usage(self._namespace)[1] + size > self.quota:
+            raise QuotaExceeded(self.quota)
+
+    def usage(self):
+        return self.catalog.usage(self._namespace)
+
+    def _store(self, tmp_path, name, checksum, size, uploader=None, mtime=None,
+               namespace=None):
+        # files imported into a given namespace are not charged against the quota
+        enforce_quota = namespace is None
+        namespace = self._namespace if namespace is None else namespace
+        path = self.blob_path(checksum)
+        source, encoding, stored_size = tmp_path, None, None
+        # compress outside the transaction, it may take a while
+        if self.compression and not os.path.exists(path):
+            encoding = choose_encoding(tmp_path, name, self.compression)
+        try:
+            if encoding:
+                fd, source = tempfile.mkstemp(dir=self._tmp, prefix='.compress-')
+                os.close(fd)
+                stored_size = compress_file(tmp_path, source, encoding)
+            with self.catalog.transaction():
+                # the usage cannot change until the file is added
+                if enforce_quota:
+                    self.check_quota(size)
+                if self.catalog.add(name, checksum, size, uploader, mtime,
+                                    encoding, stored_size, namespace) is None:
+                    raise FileExists('A file named %s already exists.' % name)
+                # a blob stored meanwhile keeps the encoding it was added with
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(source, path)
+        finally:
+            if source != tmp_path and os.path.exists(source):
+                os.remove(source)
+
+    def delete_file(self, file_name):
+        with self.catalog.transaction():
+            removed = self.catalog.remove(file_name, self._namespace)
+            if removed is None:
+                return False
+            sha256, unreferenced = removed
+            if unreferenced:
+                try:
+                    os.remove(self.blob_path(sha256))
+                except FileNotFoundError:
+                    pass
         return True
 
+    def stats(self):
+        return self.catalog.stats()
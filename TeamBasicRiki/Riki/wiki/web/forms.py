@@ -13,6 +13,7 @@ from wtforms.validators import ValidationError
 from wiki.core import clean_url
 from wiki.web import current_wiki
 from wiki.web import current_users
+from wiki.web.passwords import HasherBusy
 
 
 class URLForm(FlaskForm):
@@ -53,7 +54,11 @@ class LoginForm(FlaskForm):
         user = current_users.get_user(form.name.data)
         if not user:
             return
-        if not user.check_password(field.data):
+        try:
+            correct = user.check_password(field.data)
+        except HasherBusy:
+            raise ValidationError('Too many logins right now. Please try again in a moment.')
+        if not correct:
             raise ValidationError('Username and password do not match.')
 
 
@@ -0,0 +1,88 @@
+"""
+    Metrics
+    ~~~~~~~
+
+    A small in-process metrics registry. Counters, gauges and timings
+    are collected per worker process and exposed as JSON on the
+    ``/metrics/`` route.
+"""
+import threading
+
+
+class Metrics(object):
+    """
+        Thread safe store for counters, gauges and observed values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {}
+
+    def incr(self, name, value=1):
+        """
+            Increments the counter `name` by `value`.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """
+            Sets the gauge `name` to `value`.
+        """
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        """
+            Records a single observation (e.g. a duration in seconds) of
+            `name`. Keeps the count, total, minimum and maximum.
+        """
+        with self._lock:
+            entry = self.timings.get(name)
+            if entry is None:
+                self.timings[name] = {
+                    'count': 1, 'total': value, 'min': value, 'max': value}
+                return
+            entry['count'] += 1
+            entry['total'] += value
+            entry['min'] = min(entry['min'], value)
+            entry['max'] = max(entry['max'], value)
+
+    def snapshot(self):
+        """
+            Returns a copy of all collected metrics.
+
+            :rtype: dict
+        """
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'timings': dict(
+                    (name, dict(entry, mean=entry['total'] / entry['count']))
+                    for name, entry in self.timings.items()
+                ),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timings.clear()
+
+
+metrics = Metrics()
+
+
+def record_render_timings(processor):
+    """
+        :attr:`wiki.core.Processor.timing_hooks` callback that feeds the
+        stage timings of a render into :data:`metrics`.
+    """
+    metrics.incr('render.count')
+    for name, entry in processor.timings.items():
+        metrics.observe('render.' + name + '.wall', entry['wall'])
+        if entry['alloc'] is not None:
+            metrics.observe('render.' + name + '.alloc', entry['alloc'])
@@ -0,0 +1,227 @@
+"""
+    Passwords
+    ~~~~~~~~~
+
+    Hashes passwords with a deliberately expensive key derivation
+    function, ``scrypt`` or ``pbkdf2_sha256`` from :mod:`hashlib`.
+
+    Hashes describe themselves, ``scrypt$<n>$<r>$<p>$<salt>$<hash>`` or
+    ``pbkdf2_sha256$<iterations>$<salt>$<hash>``, so changing the cost
+    only affects new hashes and :meth:`PasswordHasher.needs_rehash` tells
+    a login to replace an outdated one. The salted SHA-512 digests of
+    :func:`wiki.web.user.make_salted_hash` still verify and are replaced
+    the same way.
+
+    The cost should be tuned with :func:`calibrate` (see
+    ``benchmarks/password_hash_calibration.py``) so one hash takes the
+    target time on the production machine, then put into the config.
+
+    Hashing runs on a small thread pool, :mod:`hashlib` releases the GIL
+    while it works. At most ``PASSWORD_HASH_WORKERS`` hashes run at once
+    and ``PASSWORD_HASH_QUEUE`` more may wait; a burst of logins beyond
+    that fails fast with :class:`HasherBusy` instead of occupying every
+    web worker.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from flask import current_app
+from flask import has_app_context
+
+ALGORITHMS = ('scrypt', 'pbkdf2_sha256')
+
+#: the cost used unless the config says otherwise
+DEFAULT_PARAMS = {
+    'scrypt': {'n': 2 ** 14, 'r': 8, 'p': 1},
+    'pbkdf2_sha256': {'iterations': 600000},
+}
+
+SALT_SIZE = 16
+HASH_SIZE = 32
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _scrypt(password, salt, n, r, p):
+    # scrypt needs 128 * r * (n + p) bytes, OpenSSL refuses more than 32 MB by default
+    return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p, dklen=HASH_SIZE,
+                          maxmem=128 * r * (n + p + 2) + 1024 * 1024)
+
+
+def hash_password(password, algorithm='scrypt', params=None):
+    """
+        :param str password: the password
+        :param str algorithm: one of :data:`ALGORITHMS`
+        :param dict params: the cost, see :data:`DEFAULT_PARAMS`
+
+        :returns: the encoded hash including algorithm, cost and salt
+        :rtype: str
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError('Unknown password hash algorithm: %s' % algorithm)
+    params = dict(DEFAULT_PARAMS[algorithm], **(params or {}))
+    salt = os.urandom(SALT_SIZE)
+    password = password.encode('utf-8')
+    if algorithm == 'scrypt':
+        digest = _scrypt(password, salt, params['n'], params['r'], params['p'])
+        return 'scrypt$%d$%d$%d$%s$%s' % (
+            params['n'], params['r'], params['p'], salt.hex(), digest.hex())
+    digest = hashlib.pbkdf2_hmac('sha256', password, salt, params['iterations'], HASH_SIZE)
+    return 'pbkdf2_sha256$%d$%s$%s' % (params['iterations'], salt.hex(), digest.hex())
+
+
+def parse_hash(encoded):
+    """
+        :returns: the algorithm and cost of an encoded hash, ('legacy',
+            {}) for a salted SHA-512 digest
+        :rtype: tuple
+    """
+    parts = encoded.split('$')
+    if parts[0] == 'scrypt' and len(parts) == 6:
+        return 'scrypt', {'n': int(parts[1]), 'r': int(parts[2]), 'p': int(parts[3])}
+    if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+        return 'pbkdf2_sha256', {'iterations': int(parts[1])}
+    return 'legacy', {}
+
+
+def verify_password(password, encoded):
+    """
+        Checks `password` against an encoded hash in constant time.
+
+        :rtype: bool
+    """
+    if not encoded:
+        return False
+    algorithm, params = parse_hash(encoded)
+    parts = encoded.split('$')
+    password = password.encode('utf-8')
+    try:
+        if algorithm == 'scrypt':
+            salt, expected = bytes.fromhex(parts[4]), parts[5]
+            digest = _scrypt(password, salt, params['n'], params['r'], params['p']).hex()
+        elif algorithm == 'pbkdf2_sha256':
+            salt, expected = bytes.fromhex(parts[2]), parts[3]
+            digest = hashlib.pbkdf2_hmac(
+                'sha256', password, salt, params['iterations'], len(expected) // 2).hex()
+        else:
+            # 64 bytes of salt around the password, then SHA-512
+            salt, expected = bytes.fromhex(encoded[:128]), encoded
+            digest = salt.hex() + hashlib.sha512(salt[:32] + password + salt[32:]).hexdigest()
+    except ValueError:
+        return False
+    return hmac.compare_digest(digest, expected)
+
+
+def calibrate(algorithm='scrypt', target=0.25, max_memory=64 * 1024 * 1024):
+    """
+        Finds the cost for which hashing a password takes about `target`
+        seconds on this machine.
+
+        For scrypt, `n` is doubled as far as `max_memory` allows and `p`
+        makes up for the rest of the time; pbkdf2 scales the number of
+        iterations.
+
+        :returns: the parameters for :func:`hash_password`
+        :rtype: dict
+    """
+    def timed(params):
+        start = time.perf_counter()
+        hash_password('calibration', algorithm, params)
+        return time.perf_counter() - start
+
+    if algorithm == 'pbkdf2_sha256':
+        iterations = 10000
+        elapsed = timed({'iterations': iterations})
+        iterations = max(int(iterations * target / elapsed) // 1000 * 1000, 1000)
+        return {'iterations': iterations}
+    if algorithm != 'scrypt':
+        raise ValueError('Unknown password hash algorithm: %s' % algorithm)
+    params = {'n': 2 ** 10, 'r': 8, 'p': 1}
+    elapsed = timed(params)
+    while elapsed * 2 <= target and 128 * params['r'] * params['n'] * 2 <= max_memory:
+        params['n'] *= 2
+        elapsed = timed(params)
+    params['p'] = max(int(round(target / elapsed)), 1)
+    return params
+
+
+class PasswordHasher(object):
+    """
+        Hashes and verifies passwords on a bounded thread pool.
+
+        :param str algorithm: the algorithm of new hashes
+        :param dict params: the cost of new hashes
+        :param int workers: the number of hashes computed at once
+        :param int max_pending: the number of hashes that may wait
+        :param float timeout: seconds a caller waits for its hash
+    """
+
+    def __init__(self, algorithm='scrypt', params=None, workers=2, max_pending=16,
+                 timeout=10):
+        if algorithm not in ALGORITHMS:
+            raise ValueError('Unknown password hash algorithm: %s' % algorithm)
+        self.algorithm = algorithm
+        self.params = dict(DEFAULT_PARAMS[algorithm], **(params or {}))
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hash')
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy('Too many password checks at once.')
+        try:
+            future = self._executor.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HasherBusy('The password check timed out.')
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.algorithm, self.params)
+
+    def verify(self, password, encoded):
+        return self._run(verify_password, password, encoded)
+
+    def needs_rehash(self, encoded):
+        return parse_hash(encoded) != (self.algorithm, self.params)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_default_hasher = None
+_default_hasher_lock = threading.Lock()
+
+
+def get_password_hasher():
+    """
+        :returns: the application's :class:`PasswordHasher`, or one with
+            the default cost outside of an application
+    """
+    global _default_hasher
+    if has_app_context() and 'password_hasher' in current_app.extensions:
+        return current_app.extensions['password_hasher']
+    with _default_hasher_lock:
+        if _default_hasher is None:
+            _default_hasher = PasswordHasher()
+        return _default_hasher
+
+
+def init_app(app):
+    app.extensions['password_hasher'] = PasswordHasher(
+        app.config.get('PASSWORD_KDF', 'scrypt'),
+        app.config.get('PASSWORD_KDF_PARAMS'),
+        app.config.get('PASSWORD_HASH_WORKERS', 2),
+        app.config.get('PASSWORD_HASH_QUEUE', 16),
+    )
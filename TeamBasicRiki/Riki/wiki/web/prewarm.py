@@ -0,0 +1,136 @@
+"""
+    Pre-warming
+    ~~~~~~~~~~~
+
+    After a page is saved, a background worker submits the conversions
+    listed in ``PREWARM_FORMATS`` to the conversion job queue, so the
+    next downloader does not pay for them.
+
+    Saving renders the page into the render cache already, the edit
+    view redirects to the page right away and needs it anyway. The
+    index, search and tag views take every other page from that cache
+    too, so there is nothing else to rebuild.
+
+    Saves are coalesced per page. A page saved again while its rebuild
+    is still waiting is rebuilt only once, and a page saved while its
+    rebuild is running is rebuilt once more afterwards.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from flask import current_app
+from flask import has_app_context
+
+from wiki.core import Page
+from wiki.web.metrics import metrics
+
+
+class Prewarmer(object):
+    """
+        Runs the post-save pipeline on a small thread pool.
+
+        :param app: the application the pages belong to
+        :param formats: the file types to pre-build conversions for
+        :param int workers: the number of background threads
+        :param float delay: seconds to wait for further saves of the same
+            page before rebuilding it
+    """
+
+    def __init__(self, app, formats=(), workers=1, delay=1.0):
+        self.app = app
+        self.formats = tuple(formats)
+        self.delay = delay
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='prewarm')
+        self._lock = threading.Lock()
+        self._scheduled = {}
+        self._running = set()
+        self._dirty = set()
+
+    def schedule(self, page):
+        """
+            Schedules the rebuild of a saved page.
+
+            :param page: the saved :class:`wiki.core.Page`
+        """
+        with self._lock:
+            if page.path in self._scheduled:
+                metrics.incr('prewarm.coalesced')
+                return
+            if page.path in self._running:
+                self._dirty.add(page.path)
+                metrics.incr('prewarm.coalesced')
+                return
+            self._scheduled[page.path] = page.url
+        self.executor.submit(self._run, page.path)
+
+    def _run(self, path):
+        time.sleep(self.delay)
+        with self._lock:
+            url = self._scheduled.pop(path)
+            self._running.add(path)
+        try:
+            self.warm(path, url)
+            metrics.incr('prewarm.completed')
+        except Exception:
+            metrics.incr('prewarm.failed')
+            self.app.logger.exception('Pre-warming %s failed', url)
+        finally:
+            with self._lock:
+                self._running.discard(path)
+                again = path in self._dirty
+                self._dirty.discard(path)
+                if again:
+                    self._scheduled[path] = url
+        if again:
+            self.executor.submit(self._run, path)
+
+    def warm(self, path, url):
+        """
+            Runs the pipeline for one page.
+
+            :param str path: the path of the page file
+            :param str url: the url of the page
+        """
+        from wiki.web.routes import get_conversion_jobs
+        from wiki.web.conversion_jobs import JobRejected
+
+        # rendering builds wiki links with url_for, if the page was
+        # changed since it was saved
+        with self.app.test_request_context():
+            page = Page(path, url)
+            for filetype in self.formats:
+                try:
+                    get_conversion_jobs().submit(page, filetype, 'prewarm')
+                except JobRejected:
+                    # a busy queue has priority over speculative work
+                    metrics.incr('prewarm.conversions_skipped')
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def prewarm_saved_page(page):
+    """
+        :attr:`wiki.core.Page.save_hooks` callback, hands the page to the
+        current application's :class:`Prewarmer`.
+    """
+    if not has_app_context():
+        return
+    prewarmer = current_app.extensions.get('prewarmer')
+    if prewarmer is not None:
+        prewarmer.schedule(page)
+
+
+def init_app(app):
+    if not app.config.get('PREWARM_ENABLED') or not app.config.get('PREWARM_FORMATS'):
+        return
+    app.extensions['prewarmer'] = Prewarmer(
+        app,
+        formats=app.config.get('PREWARM_FORMATS', ()),
+        workers=app.config.get('PREWARM_WORKERS', 1),
+        delay=app.config.get('PREWARM_DELAY', 1.0)
+    )
+    if prewarm_saved_page not in Page.save_hooks:
+        Page.save_hooks.append(prewarm_saved_page)
@@ -0,0 +1,137 @@
+"""
+    Profiling
+    ~~~~~~~~~
+
+    Opt-in per-request profiling. When ``PROFILING_ENABLED`` is set in
+    the config, an admin user can add the profiling flag (by default
+    ``?_profile=1`` or an ``X-Profile: 1`` header) to any request. The
+    request then runs under :mod:`cProfile`, the raw stats are dumped to
+    ``PROFILE_DIR`` and a short summary of the top functions comes back
+    in the ``X-Profile-Summary`` response header.
+"""
+import cProfile
+import os
+import pstats
+import time
+import uuid
+
+from flask import current_app
+from flask import g
+from flask import request
+from flask_login import current_user
+
+
+def is_admin(user):
+    """
+        Checks whether the given user has the ``admin`` role.
+
+        :param user: the user to check, may be anonymous
+
+        :returns: True if the user is an admin
+        :rtype: bool
+    """
+    getter = getattr(user, 'get', None)
+    if getter is None:
+        return False
+    return 'admin' in (getter('roles') or [])
+
+
+def profiling_requested():
+    """
+        Checks whether the current request asked to be profiled and is
+        allowed to be.
+
+        :returns: True if the request should run under the profiler
+        :rtype: bool
+    """
+    config = current_app.config
+    if not config.get('PROFILING_ENABLED'):
+        return False
+    param = config.get('PROFILING_PARAM', '_profile')
+    flag = request.args.get(param) or request.headers.get('X-Profile')
+    if flag not in ('1', 'true', 'yes'):
+        return False
+    return is_admin(current_user)
+
+
+def summarize(profile, limit=10):
+    """
+        Builds a summary of the most expensive functions of a profile.
+
+        :param profile: a :class:`cProfile.Profile` or :class:`pstats.Stats`
+        :param int limit: the number of functions to include
+
+        :returns: a list of ``(function, calls, total time, cumulative
+            time)`` tuples sorted by cumulative time
+        :rtype: list
+    """
+    stats = profile if isinstance(profile, pstats.Stats) \
+        else pstats.Stats(profile)
+    rows = []
+    for func, (_, calls, tottime, cumtime, _) in stats.stats.items():
+        filename, line, name = func
+        label = '{0}:{1}({2})'.format(os.path.basename(filename), line, name)
+        rows.append((label, calls, tottime, cumtime))
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return rows[:limit]
+
+
+def format_summary(rows):
+    """
+        Formats a summary from :func:`summarize` as a single header line.
+
+        :param list rows: the summary rows
+
+        :returns: the formatted summary
+        :rtype: str
+    """
+    return '; '.join(
+        '{0} calls={1} tot={2:.4f}s cum={3:.4f}s'.format(*row)
+        for row in rows
+    )
+
+
+def start_profiling():
+    if not profiling_requested():
+        return
+    profile = cProfile.Profile()
+    g._profile = profile
+    g._profile_started = time.perf_counter()
+    profile.enable()
+
+
+def stop_profiling(response):
+    profile = g.pop('_profile', None)
+    if profile is None:
+        return response
+    profile.disable()
+    elapsed = time.perf_counter() - g.pop('_profile_started')
+
+    config = current_app.config
+    directory = config.get('PROFILE_DIR', 'profiles')
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    endpoint = (request.endpoint or 'unknown').replace('.', '-')
+    filename = '{0}-{1}-{2}.prof'.format(
+        time.strftime('%Y%m%d-%H%M%S'), endpoint, uuid.uuid4().hex[:8])
+    profile.dump_stats(os.path.join(directory, filename))
+
+    rows = summarize(profile, config.get('PROFILING_TOP', 10))
+    response.headers['X-Profile-File'] = filename
+    response.headers['X-Profile-Time'] = '{0:.4f}s'.format(elapsed)
+    response.headers['X-Profile-Summary'] = format_summary(rows)
+    return response
+
+
+def discard_profiling(error=None):
+    # after_request is skipped when the view raises, make sure the
+    # profiler is never left running on this thread
+    profile = g.pop('_profile', None)
+    if profile is not None:
+        profile.disable()
+
+
+def init_app(app):
+    app.before_request(start_profiling)
+    app.after_request(stop_profiling)
+    app.teardown_request(discard_profiling)
@@ -0,0 +1,214 @@
+"""
+    Byte Ranges
+    ~~~~~~~~~~~
+
+    Sends stored files with ETags, conditional requests and byte ranges,
+    so an interrupted download can be resumed where it stopped instead
+    of starting from zero. Single ranges are answered with a plain
+    ``206 Partial Content``, several ranges with a
+    ``multipart/byteranges`` body. ``If-Range`` makes sure a resumed
+    download is not stitched together from two versions of a file.
+
+    If ``FILE_SENDFILE_HEADER`` is set to ``X-Sendfile`` or
+    ``X-Accel-Redirect``, the response only names the file and the
+    front-end server (Apache mod_xsendfile, lighttpd or nginx) transfers
+    it, including ranges, without tying up a Python worker. For
+    ``X-Accel-Redirect`` the file's path below the storage directory is
+    appended to ``FILE_ACCEL_REDIRECT_PREFIX``, which must map to the
+    storage directory in an ``internal`` nginx location.
+
+    Files stored compressed are sent as they are, with
+    ``Content-Encoding``, to clients that accept their encoding, and
+    decompressed on the fly for everybody else. Ranges then refer to the
+    bytes actually sent. Only files that need no decoding are offloaded.
+"""
+from datetime import datetime
+from datetime import timezone
+import mimetypes
+import os
+import secrets
+
+from flask import Response
+from flask import current_app
+from flask import request
+from werkzeug.http import dump_options_header
+from werkzeug.http import http_date
+from werkzeug.http import is_resource_modified
+from werkzeug.http import parse_if_range_header
+
+from wiki.web.compression import open_encoded
+
+#: bytes read from the file at a time
+CHUNK_SIZE = 64 * 1024
+#: requests with more ranges than this get the whole file
+MAX_RANGES = 16
+
+
+def parse_ranges(header, length):
+    """
+        Parses a ``Range`` header for a file of `length` bytes.
+
+        Overlapping and adjacent ranges are merged, which Werkzeug's
+        parser does not allow.
+
+        :param str header: the value of the header
+        :param int length: the size of the file
+
+        :returns: a sorted list of (start, stop) tuples, stop exclusive,
+            an empty list if no range is satisfiable, or None if the
+            header is missing, invalid or asks for too many ranges
+        :rtype: list
+    """
+    units, _, spec = header.partition('=')
+    parts = spec.split(',')
+    if units.strip().lower() != 'bytes' or len(parts) > MAX_RANGES:
+        return None
+    spans = []
+    for part in parts:
+        first, dash, last = part.strip().partition('-')
+        if not dash or not (first.isdigit() or first == '') \
+                or not (last.isdigit() or last == '') or first == last == '':
+            return None
+        if first == '':
+            # the last bytes of the file
+            start, stop = max(0, length - int(last)), length
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            stop = min(int(last) + 1, length) if last else length
+        if start < stop:
+            spans.append((start, stop))
+    spans.sort()
+    merged = []
+    for start, stop in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _if_range_matches(etag, last_modified):
+    if_range = parse_if_range_header(request.headers.get('If-Range'))
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date == last_modified.replace(microsecond=0)
+    return True
+
+
+def _read(path, spans, encoding=None):
+    with open_encoded(path, encoding) as f:
+        for start, stop in spans:
+            f.seek(start)
+            remaining = stop - start
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+
+
+def _part_header(boundary, mimetype, start, stop, length):
+    return ('\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (
+        boundary, mimetype, start, stop - 1, length)).encode('ascii')
+
+
+def _read_multipart(path, spans, length, mimetype, boundary, encoding=None):
+    with open_encoded(path, encoding) as f:
+        for start, stop in spans:
+            yield _part_header(boundary, mimetype, start, stop, length)
+            f.seek(start)
+            remaining = stop - start
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+    yield ('\r\n--%s--\r\n' % boundary).encode('ascii')
+
+
+def _multipart_length(spans, length, mimetype, boundary):
+    size = len(('\r\n--%s--\r\n' % boundary).encode('ascii'))
+    for start, stop in spans:
+        size += len(_part_header(boundary, mimetype, start, stop, length)) + stop - start
+    return size
+
+
+def send_stored_file(path, download_name, etag, root, encoding=None, size=None):
+    """
+        Sends a stored file as an attachment, honouring conditional and
+        range requests.
+
+        :param str path: the path of the file
+        :param str download_name: the file name offered to the client
+        :param str etag: a strong ETag of the file's contents
+        :param str root: the storage directory, used to build the
+            ``X-Accel-Redirect`` location
+        :param str encoding: the content coding the file is stored with,
+            None if it is stored raw
+        :param int size: the decoded size of a file stored with an
+            encoding
+
+        :returns: the response
+        :rtype: :class:`flask.Response`
+    """
+    stat = os.stat(path)
+    length = stat.st_size
+    last_modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    headers = {
+        'Content-Disposition': dump_options_header('attachment', {'filename': download_name}),
+        'Accept-Ranges': 'bytes',
+        'Last-Modified': http_date(last_modified),
+    }
+    decode = None
+    if encoding is not None:
+        headers['Vary'] = 'Accept-Encoding'
+        if request.accept_encodings.quality(encoding) > 0:
+            # the encoded bytes are a representation of their own
+            headers['Content-Encoding'] = encoding
+            etag = '%s-%s' % (etag, encoding)
+        else:
+            decode = encoding
+            length = size
+    headers['ETag'] = '"%s"' % etag
+
+    offload = None if encoding else current_app.config.get('FILE_SENDFILE_HEADER')
+    if offload == 'X-Sendfile':
+        headers['X-Sendfile'] = os.path.abspath(path)
+        return Response(mimetype=mimetype, headers=headers)
+    if offload == 'X-Accel-Redirect':
+        prefix = current_app.config.get('FILE_ACCEL_REDIRECT_PREFIX', '/protected/')
+        location = os.path.relpath(path, root).replace(os.sep, '/')
+        headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + location
+        return Response(mimetype=mimetype, headers=headers)
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    spans = None
+    if 'Range' in request.headers and _if_range_matches(etag, last_modified):
+        spans = parse_ranges(request.headers['Range'], length)
+    if spans is None:
+        headers['Content-Length'] = str(length)
+        return Response(_read(path, [(0, length)], decode), mimetype=mimetype,
+                        headers=headers, direct_passthrough=True)
+    if not spans:
+        headers['Content-Range'] = 'bytes */%d' % length
+        return Response(status=416, headers=headers)
+    if len(spans) == 1:
+        start, stop = spans[0]
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1, length)
+        headers['Content-Length'] = str(stop - start)
+        return Response(_read(path, spans, decode), status=206, mimetype=mimetype,
+                        headers=headers, direct_passthrough=True)
+    boundary = secrets.token_hex(16)
+    headers['Content-Length'] = str(_multipart_length(spans, length, mimetype, boundary))
+    return Response(_read_multipart(path, spans, length, mimetype, boundary, decode),
+                    status=206,
+                    content_type='multipart/byteranges; boundary=%s' % boundary,
+                    headers=headers, direct_passthrough=True)
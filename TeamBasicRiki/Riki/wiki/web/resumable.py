@@ -0,0 +1,239 @@
+"""
+    Resumable Uploads
+    ~~~~~~~~~~~~~~~~~
+
+    Large attachments are uploaded in pieces following the core of the
+    tus protocol (https://tus.io/protocols/resumable-upload), so a
+    dropped connection only costs the piece that was in flight:
+
+    1. ``POST /uploads/`` with ``Upload-Length`` and the file name in
+       ``Upload-Metadata`` creates a session and answers with its
+       ``Location``.
+    2. ``PATCH`` (or ``PUT``) to the location appends a chunk at the
+       offset given in ``Upload-Offset``.
+    3. ``HEAD`` on the location tells a reconnecting client the offset
+       to continue from.
+    4. The chunk that completes the upload finalizes it, the file is
+       moved into the :class:`wiki.web.file_storage.FileManager` without
+       being copied. ``DELETE`` abandons an upload.
+
+    Sessions live in the file store's ``.uploads`` directory, one
+    directory per session holding the received bytes and a small JSON
+    description, so they survive restarts and are shared between worker
+    processes. The offset of a session is the size of its data file.
+    Sessions that have not received anything for ``expire_after``
+    seconds are removed whenever a new session is created. A session
+    belongs to the namespace of the file manager it was created with and
+    is invisible to the others.
+"""
+import json
+import os
+import re
+import secrets
+import shutil
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+from wiki.web.file_storage import CHUNK_SIZE
+from wiki.web.file_storage import FileExists
+from wiki.web.file_storage import UploadError
+from wiki.web.file_storage import UploadTooLarge
+
+UPLOAD_ID_REGEX = re.compile(r'^[0-9a-f]{32}$')
+
+
+class OffsetMismatch(UploadError):
+    """
+        Raised for a chunk that does not continue where the upload
+        stands, or that arrives while another chunk is being written.
+
+        :ivar int offset: the current offset of the upload
+    """
+
+    def __init__(self, offset):
+        super(OffsetMismatch, self).__init__(
+            'The upload continues at offset %d.' % offset)
+        self.offset = offset
+
+
+class ResumableUploads(object):
+    """
+        The resumable upload sessions of a file store.
+
+        :param file_manager: the :class:`FileManager` finished uploads
+            are stored in
+        :param int max_size: the largest allowed upload in bytes, None
+            for no limit
+        :param float expire_after: seconds after which an abandoned
+            session is removed
+    """
+
+    def __init__(self, file_manager, max_size=None, expire_after=24 * 3600):
+        self.file_manager = file_manager
+        self.directory = file_manager.upload_directory
+        self.max_size = max_size
+        self.expire_after = expire_after
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, upload_id, *parts):
+        if not UPLOAD_ID_REGEX.match(upload_id):
+            return None
+        return os.path.join(self.directory, upload_id, *parts)
+
+    def create(self, file_name, length, uploader=None):
+        """
+            Starts an upload.
+
+            :param str file_name: the name to store the file under
+            :param int length: the size of the file in bytes
+            :param str uploader: the name of the uploading user
+
+            :raises UploadError: if the name or length is invalid
+            :raises UploadTooLarge: if `length` exceeds the limit
+            :raises QuotaExceeded: if the file would not fit into the
+                namespace's quota
+            :raises FileExists: if a file of that name already exists
+
+            :returns: the id of the upload
+            :rtype: str
+        """
+        name = self.file_manager.check_name(file_name)
+        if length < 0:
+            raise UploadError('Invalid upload length: %d' % length)
+        if self.max_size is not None and length > self.max_size:
+            raise UploadTooLarge(self.max_size)
+        if self.file_manager.exists(name):
+            raise FileExists('A file named %s already exists.' % name)
+        self.file_manager.check_quota(length)
+        self.collect_garbage()
+        upload_id = secrets.token_hex(16)
+        os.mkdir(self._path(upload_id))
+        open(self._path(upload_id, 'data'), 'wb').close()
+        info = {'name': name, 'length': length, 'uploader': uploader,
+                'namespace': self.file_manager.namespace, 'created': time.time()}
+        tmp_path = self._path(upload_id, '.info.json')
+        with open(tmp_path, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, self._path(upload_id, 'info.json'))
+        return upload_id
+
+    def info(self, upload_id):
+        """
+            :returns: the description of the upload including its current
+                ``offset``, or None if there is no such upload in the
+                namespace
+            :rtype: dict
+        """
+        path = self._path(upload_id)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, 'info.json')) as f:
+                info = json.load(f)
+            info['offset'] = os.path.getsize(os.path.join(path, 'data'))
+        except (FileNotFoundError, ValueError):
+            return None
+        if info.get('namespace') != self.file_manager.namespace:
+            return None
+        return info
+
+    def append(self, upload_id, offset, stream):
+        """
+            Appends a chunk to an upload and finalizes the upload once all
+            bytes have arrived.
+
+            :param str upload_id: the id of the upload
+            :param int offset: the offset the chunk starts at
+            :param stream: a binary stream to read the chunk from
+
+            :raises OffsetMismatch: if `offset` is not the current offset
+                or another chunk is being written
+            :raises UploadError: if the chunk goes past the announced
+                length
+            :raises FileExists: if the finished file's name was taken in
+                the meantime
+            :raises QuotaExceeded: if the finished file no longer fits
+                into the quota
+
+            :returns: the new offset, and the name, sha256 and size of the
+                stored file if the upload is finished, otherwise None; None
+                if there is no such upload or it was finished already
+            :rtype: tuple
+        """
+        info = self.info(upload_id)
+        if info is None:
+            return None
+        data_path = self._path(upload_id, 'data')
+        try:
+            f = open(data_path, 'r+b')
+        except FileNotFoundError:
+            # finished or abandoned since
+            return None
+        with f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    raise OffsetMismatch(info['offset'])
+            if not os.path.exists(self._path(upload_id, 'info.json')):
+                # finished by the request that held the lock before
+                return None
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise OffsetMismatch(current)
+            f.seek(current)
+            remaining = info['length'] - current
+            try:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if len(chunk) > remaining:
+                        raise UploadError('The chunk goes past the length of the upload.')
+                    f.write(chunk)
+                    remaining -= len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                # keep the upload consistent with the last good chunk
+                f.truncate(current)
+                raise
+            offset = f.tell()
+            if offset < info['length']:
+                return offset, None
+            # still locked, so a retried last chunk cannot store it twice
+            stored = self.file_manager.import_file(data_path, info['name'], info['uploader'])
+            shutil.rmtree(self._path(upload_id), ignore_errors=True)
+        return offset, stored
+
+    def terminate(self, upload_id):
+        if self.info(upload_id) is None:
+            return False
+        shutil.rmtree(self._path(upload_id), ignore_errors=True)
+        return True
+
+    def collect_garbage(self):
+        """
+            Removes sessions that did not receive any data for
+            `expire_after` seconds.
+
+            :returns: the number of removed sessions
+        """
+        deadline = time.time() - self.expire_after
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or not UPLOAD_ID_REGEX.match(entry.name):
+                continue
+            try:
+                mtime = os.stat(os.path.join(entry.path, 'data')).st_mtime
+            except FileNotFoundError:
+                mtime = entry.stat().st_mtime
+            if mtime < deadline:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        return removed
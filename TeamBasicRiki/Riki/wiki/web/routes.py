@@ -3,9 +3,9 @@
     ~~~~~~
 """
 import base64
+from datetime import datetime
 from io import BytesIO
-from flask import Blueprint, make_response, send_file
-from wiki.web.user import UserManager
+from flask import Blueprint, Response, current_app, send_file
 from flask import flash
 from flask import redirect
 from flask import render_template
@@ -16,7 +16,10 @@ from flask_login import login_required
 from flask_login import login_user
 from flask_login import logout_user
 from wiki.core import Processor
-from wiki.web.converter import Converter, get_file_size
+from wiki.web.converter import format_file_size, get_file_size
+from wiki.web.conversion_cache import ConversionCache
+from wiki.web.conversion_jobs import ConversionJobManager, JobRejected, JOB_ID_REGEX, FAILED
+from wiki.web.export import export_pages, select_pages
 from wiki.web.forms import EditorForm
 from wiki.web.forms import LoginForm
 from wiki.web.forms import SearchForm
@@ -25,9 +28,12 @@ from wiki.web import current_wiki
 from wiki.web import current_users
 from wiki.web.user import protect
 from wiki.web.forms import RegisterForm
-from config import USER_DIR
 from wiki.web.user import UserRegistrationController
-from wiki.web.file_storage import FileManager
+from wiki.web.file_storage import DedupFileManager, FileExists, FileManager, QuotaExceeded, UploadError, \
+    UploadTooLarge
+from wiki.web.resumable import OffsetMismatch, ResumableUploads
+from wiki.web.sessions import get_session_store
+from wiki.web.metrics import metrics
 
 bp = Blueprint('wiki', __name__)
 DIRECTORY = "UserFileStorage"
@@ -102,6 +108,34 @@ def move(url):
     return render_template('move.html', form=form, page=page)
 
 
+def get_conversion_cache():
+    return ConversionCache(
+        current_app.config.get('CONVERSION_CACHE_DIR', 'ConversionCache'),
+        current_app.config.get('CONVERSION_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+    )
+
+
+def get_conversion_jobs():
+    jobs = current_app.extensions.get('conversion_jobs')
+    if jobs is None:
+        jobs = current_app.extensions.setdefault('conversion_jobs', ConversionJobManager(
+            get_conversion_cache(),
+            workers=current_app.config.get('CONVERSION_WORKERS', 2),
+            max_queue=current_app.config.get('CONVERSION_QUEUE_MAX', 32),
+            per_user=current_app.config.get('CONVERSION_USER_LIMIT', 2),
+            timeout=current_app.config.get('CONVERSION_TIMEOUT', 60),
+            memory_limit=current_app.config.get('CONVERSION_MEMORY_LIMIT'),
+            max_jobs_per_worker=current_app.config.get('CONVERSION_JOBS_PER_WORKER', 50)
+        ))
+    return jobs
+
+
+def conversion_owner():
+    if current_user.is_authenticated and current_user.get_id():
+        return current_user.get_id()
+    return request.remote_addr
+
+
 @bp.route('/download/<path:url>/', methods=['GET'])
 @protect
 def download(url):
@@ -112,7 +146,9 @@ def download(url):
         url (str): The URL path of the wiki page.
 
     Returns:
-        flask.Response: The response containing the requested file.
+        flask.Response: The response containing the requested file, or
+            the status of the conversion job if it did not finish within
+            CONVERSION_TIMEOUT seconds.
 
     """
     page = current_wiki.get_or_404(url)
@@ -127,15 +163,37 @@ def download(url):
             mimetype='text/markdown'
         )
     else:
-        converter = Converter(page)
-        conversion_method = getattr(converter, f'convert_to_{filetype.upper()}')
-        file_content, _ = conversion_method()
-
-        # Convert base64 to bytes
-        file_bytes = base64.b64decode(file_content)
+        cache = get_conversion_cache()
+        artifact = None
+        job_id = request.args.get('job')
+        if job_id and JOB_ID_REGEX.match(job_id):
+            # the artifact a finished conversion job produced
+            artifact = cache.open(job_id)
+        if artifact is None:
+            artifact = cache.open(ConversionCache.key(page, filetype))
+        if artifact is None:
+            # converted on the worker pool like any other job, this
+            # request only waits for it
+            jobs = get_conversion_jobs()
+            try:
+                job = jobs.wait(jobs.submit(page, filetype, conversion_owner()),
+                                current_app.config.get('CONVERSION_TIMEOUT', 60))
+            except JobRejected as e:
+                return jsonify({'error': str(e)}), e.status_code
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if job.active:
+                return jsonify({'result': job_status(job)}), 202, {
+                    'Location': url_for('wiki.convert_status', job_id=job.id)}
+            if job.status == FAILED:
+                return jsonify({'result': job_status(job)}), 500
+            artifact = cache.open(job.id)
+            if artifact is None:
+                # evicted right away by a full cache
+                return jsonify({'error': 'The conversion cache is full, please try again.'}), 503
 
         return send_file(
-            BytesIO(file_bytes),
+            artifact,
             as_attachment=True,
             download_name=f'{url}.{filetype}',
             mimetype='application/octet-stream'
@@ -163,31 +221,26 @@ def convert(url):
 
     page = current_wiki.get_or_404(url)
 
+    if filetype.lower() == 'md':
+        file_size_info = {
+            'fileType': filetype,
+            'fileSize': get_file_size(page.content),
+            'conversionStatus': 'Success',
+        }
+        return jsonify({'result': file_size_info})
+
+    # the conversion runs in the background, the client polls the job
+    # status and downloads the artifact from the cache once it is done
     try:
-        if filetype.lower() == 'md':
-            file_size_info = {
-                'fileType': filetype,
-                'fileSize': get_file_size(page.content),
-                'conversionStatus': 'Success',
-            }
-            response_data = {'result': file_size_info}
-        else:
-            converter = Converter(page)
-            conversion_method = getattr(converter, f'convert_to_{filetype.upper()}')
-            file_content, file_size = conversion_method()
-
-            response = make_response(file_content)
-            response.headers['Content-Disposition'] = f'attachment; filename={url}.{filetype}'
-            response.headers['Content-Type'] = 'application/octet-stream'
-            response.headers['Content-Length'] = str(len(file_content))
-
-            file_size_info = {
-                'fileType': filetype,
-                'fileSize': file_size,
-                'conversionStatus': 'Success',
-            }
-
-            response_data = {'result': file_size_info}
+        job = get_conversion_jobs().submit(page, filetype, conversion_owner())
+    except JobRejected as e:
+        file_size_info = {
+            'fileType': filetype,
+            'fileSize': None,
+            'conversionStatus': 'Failed',
+            'error': str(e),
+        }
+        return jsonify({'result': file_size_info}), e.status_code
     except Exception as e:
         # If an exception occurs during conversion, set conversionStatus to 'Failed'
         file_size_info = {
@@ -196,9 +249,97 @@ def convert(url):
             'conversionStatus': 'Failed',
             'error': str(e),
         }
-        response_data = {'result': file_size_info}
+        return jsonify({'result': file_size_info})
+
+    file_size_info = job_status(job, data.get('encoding') == 'base64')
+    return jsonify({'result': file_size_info}), 200 if not job.active else 202
+
+
+@bp.route('/convert/status/<string:job_id>/', methods=['GET'])
+@protect
+def convert_status(job_id):
+    """
+    Route to poll the status of a conversion job.
+
+    Args:
+        job_id (str): The id returned by the convert route.
+
+    Returns:
+        flask.Response: The job status as JSON.
+
+    """
+    job = get_conversion_jobs().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown conversion job.'}), 404
+    file_size_info = job_status(job, request.args.get('encoding') == 'base64')
+    return jsonify({'result': file_size_info})
+
 
-    return jsonify(response_data)
+def job_status(job, include_content=False):
+    """
+    Describe a conversion job for the JSON API.
+
+    Args:
+        job (ConversionJob): The job to describe.
+        include_content (bool): Whether to include the finished artifact
+            as base64.
+
+    Returns:
+        dict: The job status.
+
+    """
+    file_size_info = job.to_dict()
+    file_size_info['fileSize'] = None if job.size is None else format_file_size(job.size)
+    if job.status == 'Queued':
+        file_size_info['position'] = get_conversion_jobs().position(job)
+    if include_content and job.status == 'Success':
+        # only the JSON API asks for the content itself
+        artifact = get_conversion_cache().open(job.id)
+        if artifact is not None:
+            with artifact:
+                file_size_info['content'] = base64.b64encode(artifact.read()).decode('utf-8')
+    return file_size_info
+
+
+@bp.route('/export/', methods=['GET'])
+@protect
+def export():
+    """
+    Route to export several wiki pages as a ZIP archive.
+
+    Query Args:
+        fileType (str): The format of the exported documents.
+        tag (str): Only export pages with this tag.
+        prefix (str): Only export pages below this URL.
+
+    Returns:
+        flask.Response: The archive, streamed while it is being built.
+
+    """
+    filetype = request.args.get('fileType', 'pdf')
+    tag = request.args.get('tag')
+    prefix = request.args.get('prefix')
+    pages = select_pages(current_wiki, tag, prefix)
+    # every export starts its own conversion processes
+    try:
+        release = current_app.extensions['export_limiter'].acquire(conversion_owner())
+    except JobRejected as e:
+        return jsonify({'error': str(e)}), e.status_code
+    try:
+        chunks = export_pages(pages, filetype,
+                              current_app.config.get('EXPORT_WORKERS', 2),
+                              current_app.config.get('CONVERSION_TIMEOUT', 60),
+                              current_app.config.get('CONVERSION_MEMORY_LIMIT'))
+    except ValueError as e:
+        release()
+        return jsonify({'error': str(e)}), 400
+    name = (tag or prefix or 'wiki').strip('/').replace('/', '_')
+    response = Response(chunks, mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename={name}-{filetype.lower()}.zip'
+    })
+    # the slot is held until the archive is sent or the client went away
+    response.call_on_close(release)
+    return response
 
 
 @bp.route('/delete/<path:url>/')
@@ -235,6 +376,15 @@ def search():
     return render_template('search.html', form=form, search=None)
 
 
+@bp.route('/metrics/')
+@protect
+def show_metrics():
+    """
+    Returns the metrics collected by this worker process as JSON.
+    """
+    return jsonify(metrics.snapshot())
+
+
 @bp.route('/user/login/', methods=['GET', 'POST'])
 def user_login():
     """
@@ -246,7 +396,7 @@ def user_login():
     if form.validate_on_submit():
         user = current_users.get_user(form.name.data)
         login_user(user)
-        user.set('authenticated', True)
+        get_session_store().login(user.name)
         flash('Login successful.', 'success')
         return redirect(request.args.get("next") or url_for('wiki.index'))
     return render_template('login.html', form=form)
@@ -258,9 +408,9 @@ def user_logout():
     """
     Handles user logout.
 
-    Logs out the current user and sets 'authenticated' to False.
+    Logs out the current user and ends their session.
     """
-    current_user.set('authenticated', False)
+    get_session_store().logout(current_user.name)
     logout_user()
     flash('Logout successful.', 'success')
     return redirect(url_for('wiki.index'))
@@ -297,8 +447,7 @@ def user_create():
     Displays the registration form and processes the form submission.
     """
     form = RegisterForm()
-    user_manager = UserManager(USER_DIR)
-    registration_controller = UserRegistrationController(user_manager)
+    registration_controller = UserRegistrationController(current_users)
 
     if form.validate_on_submit() and registration_controller.form_field_validation(form):
         return redirect(url_for('wiki.user_login'))
@@ -321,8 +470,8 @@ def user_delete(user_id):
     """
     user = current_users.get_user(user_id)
     if request.method == 'POST':
-        user_manager = UserManager(USER_DIR)
-        user_manager.delete_user(user.name)
+        current_users.delete_user(user.name)
+        get_session_store().logout(user.name)
         flash('User {} has been deleted.'.format(user.name), 'success')
         return redirect(url_for('wiki.index'))
 
@@ -340,45 +489,316 @@ def page_not_found(error):
     return render_template('404.html'), 404
 
 
+def get_file_manager():
+    """
+    Return the file store configured by FILE_STORAGE_BACKEND, either
+    'flat' (one file per name) or 'dedup' (content addressed blobs, stored
+    compressed as configured by FILE_COMPRESSION), working on the
+    namespace of the request.
+    """
+    namespace = current_namespace()
+    if current_app.config.get('FILE_STORAGE_BACKEND', 'flat') == 'dedup':
+        quota = current_app.config.get(
+            'FILE_STORAGE_SHARED_QUOTA' if namespace is None else 'FILE_STORAGE_QUOTA')
+        return DedupFileManager(DIRECTORY, current_app.config.get('FILE_COMPRESSION'),
+                                namespace, quota)
+    return FileManager(DIRECTORY, namespace)
+
+
+def current_uploader():
+    if current_user.is_authenticated and current_user.get_id():
+        return current_user.get_id()
+    return None
+
+
+def current_namespace():
+    """
+    Return the namespace the file storage routes work on: the current
+    user's own files, or the shared files if the request asks for
+    space=shared or nobody is logged in.
+    """
+    if request.args.get('space') == 'shared':
+        return None
+    return current_uploader()
+
+
+def current_space():
+    """
+    Return the 'space' query arg to pass on in file storage links: None
+    for the current user's own files, 'shared' for the shared files.
+    """
+    return 'shared' if current_namespace() is None and current_uploader() else None
+
+
+@bp.app_template_filter('filesize')
+def filesize_filter(size):
+    return format_file_size(size) if size is not None else ''
+
+
+@bp.app_template_filter('timestamp')
+def timestamp_filter(mtime):
+    return datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M') if mtime is not None else ''
+
+
 @bp.route('/file_storage/', methods=['GET', 'POST'])
 @protect
 def file_storage():
-    file_manager = FileManager(DIRECTORY)
-    files = file_manager.get_downloadable_files()
-    return render_template('file_storage.html', files=files)
+    """
+    Route to list the stored files a page at a time.
+
+    Query Args:
+        q (str): Only list files whose name contains this.
+        sort (str): One of name, size, mtime or uploader.
+        order (str): 'desc' to reverse the order.
+        page (int): The page to show, starting at 1.
+        space (str): 'shared' for the shared files instead of the
+            current user's own files.
+
+    """
+    per_page = current_app.config.get('FILE_STORAGE_PAGE_SIZE', 50)
+    search = request.args.get('q', '').strip()
+    sort = request.args.get('sort', 'name')
+    descending = request.args.get('order') == 'desc'
+    page = max(request.args.get('page', 1, type=int), 1)
+    file_manager = get_file_manager()
+    files, total = file_manager.list_files(
+        search, sort, descending, (page - 1) * per_page, per_page)
+    pages = max((total + per_page - 1) // per_page, 1)
+    return render_template('file_storage.html', files=files, total=total,
+                           page=page, pages=pages, search=search, sort=sort,
+                           descending=descending, stats=file_manager.stats(),
+                           space=current_space(), usage=file_manager.usage(),
+                           quota=file_manager.quota)
 
 
 @bp.route('/delete_file/<path:file_name>/')
 @protect
 def delete_file(file_name):
-    file_manager = FileManager(DIRECTORY)
+    file_manager = get_file_manager()
     success = file_manager.delete_file(file_name)
     if success:
         flash(f"Successfully deleted file {file_name}")
     else:
         flash(f"Unknown issue... failed to delete file {file_name}")
-    return redirect(url_for('wiki.file_storage'))
+    return redirect(url_for('wiki.file_storage', space=current_space()))
 
 
 @bp.route('/download_file/<path:file_name>/')
 @protect
 def download_file(file_name):
-    file_manager = FileManager(DIRECTORY)
+    file_manager = get_file_manager()
     print(file_name)
     return file_manager.download_file(file_name)
 
 
+@bp.route('/download_files/')
+@protect
+def download_files():
+    """
+    Route to download several stored files as one ZIP archive.
+
+    Query Args:
+        file (str): A file to add, given once per file.
+
+    Returns:
+        flask.Response: The archive, streamed while it is being built.
+
+    """
+    file_names = request.args.getlist('file')
+    if not file_names:
+        flash("Select the files to download first.")
+        return redirect(url_for('wiki.file_storage', space=current_space()))
+    file_manager = get_file_manager()
+    return Response(file_manager.stream_archive(file_names), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=files.zip'})
+
+
 @bp.route('/upload_file/', methods=['GET', 'POST'])
 @protect
 def upload_file():
     if request.method == 'POST':
+        max_size = current_app.config.get('MAX_UPLOAD_SIZE')
+        # refuse before the form data is parsed and spooled
+        if max_size is not None and request.content_length is not None \
+                and request.content_length > max_size:
+            flash(f"Upload failed... the file is larger than {format_file_size(max_size)}!")
+            return redirect(url_for('wiki.file_storage', space=current_space()))
         file = request.files['file']
-        file_manager = FileManager(DIRECTORY)
-        success = file_manager.upload_file(file)
+        file_manager = get_file_manager()
+        try:
+            success = file_manager.upload_file(file, max_size, current_uploader())
+        except UploadTooLarge:
+            flash(f"Upload failed... the file is larger than {format_file_size(max_size)}!")
+            return redirect(url_for('wiki.file_storage', space=current_space()))
+        except UploadError as e:
+            flash(f"Upload failed... {e}")
+            return redirect(url_for('wiki.file_storage', space=current_space()))
         if success:
             flash(f"Successfully uploaded file {file.filename}")
         elif file.filename == "":
             flash("Please select a file to upload first!!!")
         else:
             flash(f"Upload failed... file {file.filename} already exists!")
-    return redirect(url_for('wiki.file_storage'))
+    return redirect(url_for('wiki.file_storage', space=current_space()))
+
+
+@bp.route('/upload_file/<path:file_name>', methods=['PUT'])
+@protect
+def upload_file_stream(file_name):
+    """
+    Route to upload a file as the raw request body.
+
+    The body is streamed to disk in chunks without being parsed as form
+    data, so large files are received in constant memory.
+
+    Args:
+        file_name (str): The name to store the file under.
+
+    Returns:
+        tuple: The stored name, size and sha256 as JSON and the status.
+
+    """
+    max_size = current_app.config.get('MAX_UPLOAD_SIZE')
+    if max_size is not None and request.content_length is not None \
+            and request.content_length > max_size:
+        return jsonify({'error': str(UploadTooLarge(max_size))}), 413
+    file_manager = get_file_manager()
+    try:
+        if request.content_length is not None:
+            file_manager.check_quota(request.content_length)
+        name, checksum, size = file_manager.save_stream(
+            file_name, request.stream, max_size, current_uploader())
+    except FileExists as e:
+        return jsonify({'error': str(e)}), 409
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except QuotaExceeded as e:
+        return jsonify({'error': str(e)}), 507
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'name': name, 'size': size, 'sha256': checksum}), 201
+
+
+TUS_VERSION = '1.0.0'
+
+
+def get_resumable_uploads():
+    return ResumableUploads(
+        get_file_manager(),
+        current_app.config.get('MAX_UPLOAD_SIZE'),
+        current_app.config.get('UPLOAD_SESSION_EXPIRY', 24 * 3600)
+    )
+
+
+def parse_upload_metadata(header):
+    """
+    Parse a tus Upload-Metadata header.
+
+    Args:
+        header (str): Comma separated keys, each followed by a space and
+            its base64 encoded value.
+
+    Returns:
+        dict: The decoded values.
+
+    """
+    metadata = {}
+    for pair in (header or '').split(','):
+        key, _, value = pair.strip().partition(' ')
+        if key:
+            try:
+                metadata[key] = base64.b64decode(value).decode('utf-8')
+            except ValueError:
+                metadata[key] = ''
+    return metadata
+
+
+@bp.route('/uploads/', methods=['POST', 'OPTIONS'])
+@protect
+def create_upload():
+    """
+    Route to start a resumable upload, see wiki.web.resumable.
+
+    Headers:
+        Upload-Length (int): The size of the file.
+        Upload-Metadata (str): The file name as 'filename <base64>'.
+
+    Returns:
+        tuple: An empty response with the Location of the upload.
+
+    """
+    headers = {'Tus-Resumable': TUS_VERSION}
+    if request.method == 'OPTIONS':
+        headers.update({'Tus-Version': TUS_VERSION, 'Tus-Extension': 'creation,termination'})
+        max_size = current_app.config.get('MAX_UPLOAD_SIZE')
+        if max_size is not None:
+            headers['Tus-Max-Size'] = str(max_size)
+        return '', 204, headers
+    length = request.headers.get('Upload-Length', type=int)
+    if length is None:
+        return jsonify({'error': 'Upload-Length is required.'}), 400, headers
+    file_name = parse_upload_metadata(request.headers.get('Upload-Metadata')).get('filename', '')
+    try:
+        upload_id = get_resumable_uploads().create(file_name, length, current_uploader())
+    except FileExists as e:
+        return jsonify({'error': str(e)}), 409, headers
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413, headers
+    except QuotaExceeded as e:
+        return jsonify({'error': str(e)}), 507, headers
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400, headers
+    headers['Location'] = url_for('wiki.resumable_upload', upload_id=upload_id,
+                                  space=current_space())
+    return '', 201, headers
+
+
+@bp.route('/uploads/<upload_id>', methods=['HEAD', 'PATCH', 'PUT', 'DELETE'])
+@protect
+def resumable_upload(upload_id):
+    """
+    Route to query, continue or abandon a resumable upload.
+
+    HEAD answers with the current Upload-Offset. PATCH and PUT append
+    the request body at Upload-Offset; the chunk that completes the
+    upload stores the file. DELETE abandons the upload.
+
+    Args:
+        upload_id (str): The id of the upload.
+
+    """
+    headers = {'Tus-Resumable': TUS_VERSION, 'Cache-Control': 'no-store'}
+    uploads = get_resumable_uploads()
+    if request.method == 'DELETE':
+        return '', 204 if uploads.terminate(upload_id) else 404, headers
+    info = uploads.info(upload_id)
+    if info is None:
+        return '', 404, headers
+    if request.method == 'HEAD':
+        headers.update({'Upload-Offset': str(info['offset']),
+                        'Upload-Length': str(info['length'])})
+        return '', 200, headers
+    if request.method == 'PATCH' and request.mimetype != 'application/offset+octet-stream':
+        return '', 415, headers
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Upload-Offset is required.'}), 400, headers
+    try:
+        result = uploads.append(upload_id, offset, request.stream)
+    except OffsetMismatch as e:
+        headers['Upload-Offset'] = str(e.offset)
+        return jsonify({'error': str(e)}), 409, headers
+    except FileExists as e:
+        return jsonify({'error': str(e)}), 409, headers
+    except QuotaExceeded as e:
+        return jsonify({'error': str(e)}), 507, headers
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400, headers
+    if result is None:
+        return '', 404, headers
+    offset, stored = result
+    headers['Upload-Offset'] = str(offset)
+    if stored is not None:
+        headers['Content-Location'] = url_for('wiki.download_file', file_name=stored[0],
+                                              space=current_space())
+    return '', 204, headers
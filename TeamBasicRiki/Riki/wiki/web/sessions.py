@@ -0,0 +1,89 @@
+"""
+    Sessions
+    ~~~~~~~~
+
+    Keeps track of which users are logged in, apart from the accounts.
+
+    Logging in or out used to set the ``authenticated`` flag of the
+    user's account, which rewrote the whole user store. The
+    :class:`SessionStore` keeps that state on its own instead: in memory
+    by default, which is enough for a single process, or in a small
+    SQLite database when ``SESSION_STORE_PATH`` is set, so all worker
+    processes agree on it and it survives restarts. Either way, logging
+    in writes one row at most and never touches the account store.
+"""
+import sqlite3
+import threading
+import time
+
+from flask import current_app
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    name TEXT PRIMARY KEY,
+    since REAL NOT NULL
+);
+"""
+
+
+class SessionStore(object):
+    """
+        :param str path: the database file to persist sessions in, None
+            to keep them in memory only
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._local = threading.local()
+        if path is not None:
+            db = self._db()
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+
+    def _db(self):
+        # sqlite connections must not be shared between threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return db
+
+    def login(self, name):
+        since = time.time()
+        if self.path is None:
+            with self._lock:
+                self._sessions[name] = since
+        else:
+            self._db().execute(
+                'INSERT INTO sessions (name, since) VALUES (?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET since = excluded.since', (name, since))
+
+    def logout(self, name):
+        if self.path is None:
+            with self._lock:
+                self._sessions.pop(name, None)
+        else:
+            self._db().execute('DELETE FROM sessions WHERE name = ?', (name,))
+
+    def logged_in_since(self, name):
+        """
+            :returns: when `name` logged in, None if the user is not
+                logged in
+        """
+        if self.path is None:
+            return self._sessions.get(name)
+        row = self._db().execute(
+            'SELECT since FROM sessions WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def is_authenticated(self, name):
+        return self.logged_in_since(name) is not None
+
+
+def get_session_store():
+    return current_app.extensions['session_store']
+
+
+def init_app(app):
+    app.extensions['session_store'] = SessionStore(app.config.get('SESSION_STORE_PATH'))
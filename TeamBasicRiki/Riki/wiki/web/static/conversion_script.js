@@ -1,3 +1,73 @@
+function showConversionResult(result, selectedFileType, currentUrl) {
+    var conversionResultElement = document.getElementById("conversionResult");
+    conversionResultElement.innerHTML = 'Conversion Information:<br>';
+    conversionResultElement.innerHTML += 'File Type: ' + result.fileType + '<br>';
+    conversionResultElement.innerHTML += 'File Size: ' + result.fileSize + '<br>';
+
+    if (result.conversionStatus !== undefined) {
+        conversionResultElement.innerHTML += 'Conversion Status: ' + result.conversionStatus + '<br>';
+    }
+    if (result.error) {
+        conversionResultElement.innerHTML += 'Error: ' + result.error + '<br>';
+    }
+    if (result.conversionStatus !== 'Success') {
+        return;
+    }
+
+    var modalFooter = document.getElementById("modalFooter");
+    if (modalFooter) {
+        // Clear existing content
+        modalFooter.innerHTML = '';
+
+        // Add the cancel button back to the modal footer
+        modalFooter.innerHTML += '<a href="#" class="btn" data-dismiss="modal" aria-hidden="true">Cancel</a>';
+
+        // Check if the download button already exists
+        var downloadBtn = document.getElementById("downloadBtn");
+        if (!downloadBtn) {
+            modalFooter.innerHTML += '<button id="downloadBtn" class="btn btn-primary">Download</button>';
+        }
+
+        document.getElementById("downloadBtn").addEventListener("click", function () {
+            var downloadUrl = `/download${currentUrl}?fileType=${selectedFileType}`;
+            if (result.jobId) {
+                downloadUrl += `&job=${encodeURIComponent(result.jobId)}`;
+            }
+            window.location.href = downloadUrl;
+        });
+    } else {
+        console.error('Modal footer element not found.');
+    }
+}
+
+// Returns the job status of a response, also for errors without one
+function readConversionResult(response, selectedFileType) {
+    return response.json()
+        .catch(() => ({}))
+        .then(data => data.result || {
+            fileType: selectedFileType,
+            fileSize: null,
+            conversionStatus: 'Failed',
+            error: data.error || ('The server answered with status ' + response.status + '.'),
+        });
+}
+
+function pollConversion(jobId, selectedFileType, currentUrl) {
+    fetch('/convert/status/' + encodeURIComponent(jobId) + '/')
+        .then(response => readConversionResult(response, selectedFileType))
+        .then(result => {
+            showConversionResult(result, selectedFileType, currentUrl);
+            if (result.conversionStatus === 'Queued' || result.conversionStatus === 'Running') {
+                setTimeout(function () {
+                    pollConversion(jobId, selectedFileType, currentUrl);
+                }, 1000);
+            }
+        })
+        .catch(error => {
+            console.error('Error:', error);
+        });
+}
+
 document.getElementById("convertBtn").addEventListener("click", function () {
     var selectedFileType = document.getElementById("fileType").value;
 
@@ -16,38 +86,13 @@ document.getElementById("convertBtn").addEventListener("click", function () {
         },
         body: JSON.stringify({ fileType: selectedFileType }),
     })
-        .then(response => response.json())
-        .then(data => {
-            console.log(data);
-
-            var conversionResultElement = document.getElementById("conversionResult");
-            conversionResultElement.innerHTML = 'Conversion Information:<br>';
-            conversionResultElement.innerHTML += 'File Type: ' + data.result.fileType + '<br>';
-            conversionResultElement.innerHTML += 'File Size: ' + data.result.fileSize + '<br>';
-
-            if (data.result.conversionStatus !== undefined) {
-                conversionResultElement.innerHTML += 'Conversion Status: ' + data.result.conversionStatus + '<br>';
-            }
+        .then(response => readConversionResult(response, selectedFileType))
+        .then(result => {
+            console.log(result);
 
-            var modalFooter = document.getElementById("modalFooter");
-            if (modalFooter) {
-                // Clear existing content
-                modalFooter.innerHTML = '';
-
-                // Add the cancel button back to the modal footer
-                modalFooter.innerHTML += '<a href="#" class="btn" data-dismiss="modal" aria-hidden="true">Cancel</a>';
-
-                // Check if the download button already exists
-                var downloadBtn = document.getElementById("downloadBtn");
-                if (!downloadBtn) {
-                    modalFooter.innerHTML += '<button id="downloadBtn" class="btn btn-primary">Download</button>';
-                }
-
-                document.getElementById("downloadBtn").addEventListener("click", function () {
-                    window.location.href = `/download${currentUrl}?fileType=${selectedFileType}`;
-                });
-            } else {
-                console.error('Modal footer element not found.');
+            showConversionResult(result, selectedFileType, currentUrl);
+            if (result.conversionStatus === 'Queued' || result.conversionStatus === 'Running') {
+                pollConversion(result.jobId, selectedFileType, currentUrl);
             }
         })
         .catch(error => {
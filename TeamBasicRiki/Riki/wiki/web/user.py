@@ -6,13 +6,15 @@ This module defines classes and helpers for user management in a Flask applicati
 
 Classes:
 - `UserManager`: A simple user manager that saves user data as JSON.
+- `SQLiteUserManager`: A user manager for many users that saves user data in SQLite.
 - `UserRegistrationController`: Handles user registration and form field validation.
 - `User`: Represents a user with methods for retrieving and updating user data.
 
 Helpers:
+- `make_user_manager`: Creates the user manager for the configured backend.
 - `get_default_authentication_method`: Gets the default authentication method from the Flask app configuration.
-- `make_salted_hash`: Generates a salted hash for a given password.
-- `check_hashed_password`: Checks if a password matches a hashed password.
+- `make_salted_hash`: Generates a salted SHA-512 hash, only kept for old accounts.
+- `check_hashed_password`: Checks if a password matches a salted SHA-512 hash.
 - `protect`: Decorator to protect routes based on the authentication status.
 
 Usage:
@@ -29,42 +31,230 @@ Note:
     This is a basic implementation, and you may want to enhance it based on your application's requirements.
 """
 import os
+import copy
 import json
 import binascii
 import hashlib
+import sqlite3
+import tempfile
+import threading
 import uuid
+from contextlib import contextmanager
 from functools import wraps
 
-from flask import current_app, flash
+from flask import current_app, flash, has_app_context
 from flask_login import current_user
 
+from wiki.web.passwords import HasherBusy, get_password_hasher
+from wiki.web.sessions import get_session_store
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+
+#: the parsed user files of this process by path, each with the
+#: (inode, mtime, size) of the file it was parsed from
+_user_tables = {}
+_user_tables_lock = threading.Lock()
+#: the changes waiting to be written, by path
+_group_commits = {}
+
+
+class _Change(object):
+    def __init__(self, function):
+        self.function = function
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class _GroupCommit(object):
+    """Queues the changes to one user file. The thread that gets to write
+    applies every change queued so far, so a burst of registrations or
+    profile changes costs one write instead of one per change."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.pending = []
+
+    def submit(self, manager, function):
+        change = _Change(function)
+        with self.lock:
+            self.pending.append(change)
+        with self.write_lock:
+            if not change.done:
+                with self.lock:
+                    batch, self.pending = self.pending, []
+                try:
+                    manager._commit(batch)
+                except BaseException as e:
+                    for other in batch:
+                        if not other.done:
+                            other.error, other.done = e, True
+        if change.error is not None:
+            raise change.error
+        return change.result
+
 
 class UserManager(object):
-    """A very simple user Manager, that saves it's data as json."""
+    """A very simple user Manager, that saves it's data as json.
+
+    The parsed file is kept in memory for the lifetime of the process and
+    shared by all managers of the same file, so looking up a user does
+    not read the file again unless its modification time, size or inode
+    changed since, or it was written by this process.
+
+    Changes hold an exclusive lock on `users.json.lock` while they read,
+    modify and write the file, so concurrent workers do not lose each
+    other's updates. The file is written to a temporary file that then
+    replaces it, so readers never see a half written file. Changes made
+    by several threads while a write is in progress are written together.
+    """
 
     def __init__(self, path):
         self.file = os.path.join(path, 'users.json')
+        self._key = os.path.abspath(self.file)
 
-    def read(self):
+    def _table(self):
+        """Return the cached user table, parsing the file if it changed.
+        The table is shared and must not be modified."""
         try:
-            with open(self.file) as f:
-                data = json.loads(f.read())
-            return data
-        except (IOError, json.JSONDecodeError) as e:
+            stat = os.stat(self.file)
+        except OSError as e:
             print(f"Error reading file: {e}")
             return {}
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = _user_tables.get(self._key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with _user_tables_lock:
+            cached = _user_tables.get(self._key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            try:
+                with open(self.file) as f:
+                    data = json.loads(f.read())
+            except (IOError, json.JSONDecodeError) as e:
+                print(f"Error reading file: {e}")
+                return {}
+            _user_tables[self._key] = (version, data)
+            return data
+
+    def close(self):
+        """Nothing to release, the file is only open while it is used."""
+
+    def read(self):
+        # a copy, callers change it before writing it back
+        return copy.deepcopy(self._table())
 
     def write(self, data):
+        def replace(users):
+            users.clear()
+            users.update(copy.deepcopy(data))
+        self._submit(replace)
+
+    def _submit(self, function):
+        """Apply `function` to the user table and save the result. Return
+        what `function` returns."""
+        with _user_tables_lock:
+            group_commit = _group_commits.setdefault(self._key, _GroupCommit())
+        return group_commit.submit(self, function)
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
         try:
-            with open(self.file, 'w') as f:
-                f.write(json.dumps(data, indent=2))
+            f = open(self.file + '.lock', 'a')
         except IOError as e:
-            print(f"Error writing to file: {e}")
+            # reported like any other error writing the file
+            print(f"Error locking file: {e}")
+            yield
+            return
+        with f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _commit(self, changes):
+        with self._file_lock():
+            # another process may have written since the last read
+            users = self.read()
+            for change in changes:
+                try:
+                    change.result = change.function(users)
+                except Exception as e:
+                    change.error = e
+            try:
+                self._save(users)
+            except IOError as e:
+                print(f"Error writing to file: {e}")
+                _user_tables.pop(self._key, None)
+        for change in changes:
+            change.done = True
+
+    def _save(self, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self._key), prefix='.users-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(data, indent=2))
+                f.flush()
+                os.fsync(f.fileno())
+                # the version of what we wrote, not of a later write
+                stat = os.fstat(f.fileno())
+            try:
+                os.chmod(tmp_path, os.stat(self.file).st_mode & 0o777)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, self.file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with _user_tables_lock:
+            _user_tables[self._key] = (
+                (stat.st_ino, stat.st_mtime_ns, stat.st_size), copy.deepcopy(data))
 
     def add_user(self, name, password, email, active=True, roles=[], authentication_method=None):
-        users = self.read()
-        if users.get(name):
+        new_user = self._new_user_data(password, email, active, roles, authentication_method)
+
+        def add(users):
+            if users.get(name):
+                return False
+            users[name] = new_user
+            return True
+        if not self._submit(add):
             return False
+        print(f"Adding user: {new_user}")
+        return User(self, name, copy.deepcopy(new_user))
+
+    def add_users(self, users, replace=False):
+        """Add many users with a single write. `users` maps names to user
+        data as made by `_new_user_data`. Existing users are kept unless
+        `replace` is set. Return the number of users written."""
+        users = copy.deepcopy(users)
+
+        def add(table):
+            added = users if replace else \
+                {name: userdata for name, userdata in users.items() if name not in table}
+            table.update(added)
+            return len(added)
+        return self._submit(add)
+
+    def iter_users(self):
+        """Yield the name and data of every user. The data is shared and
+        must not be modified."""
+        for name, userdata in self._table().items():
+            yield name, userdata
+
+    def _new_user_data(self, password, email, active, roles, authentication_method,
+                       password_hash=None):
         if authentication_method is None:
             authentication_method = get_default_authentication_method()
         new_user_id = str(uuid.uuid4())
@@ -78,35 +268,176 @@ class UserManager(object):
             'is_anonymous': False
         }
         if authentication_method == 'hash':
-            new_user['hash'] = make_salted_hash(password)
+            new_user['hash'] = password_hash or get_password_hasher().hash(password)
         elif authentication_method == 'cleartext':
             new_user['password'] = password
         else:
             raise NotImplementedError(authentication_method)
-        users[name] = new_user
-        print(f"Adding user: {new_user}")
-        self.write(users)
-        userdata = users.get(name)
-        return User(self, name, userdata)
+        return new_user
 
     def get_user(self, name):
-        users = self.read()
-        userdata = users.get(name)
+        userdata = self._table().get(name)
         if not userdata:
             return None
-        return User(self, name, userdata)
+        return User(self, name, copy.deepcopy(userdata))
+
+    def get_user_by_id(self, user_id):
+        return self._find_user('id', user_id)
+
+    def get_user_by_email(self, email):
+        return self._find_user('email', email)
+
+    def _find_user(self, option, value):
+        for name, userdata in self._table().items():
+            if userdata.get(option) == value:
+                return User(self, name, copy.deepcopy(userdata))
+        return None
 
     def delete_user(self, name):
-        users = self.read()
-        if not users.pop(name, False):
+        return self._submit(lambda users: bool(users.pop(name, False)))
+
+    def update(self, name, userdata):
+        userdata = copy.deepcopy(userdata)
+        self._submit(lambda users: users.__setitem__(name, userdata))
+
+
+class SQLiteUserManager(UserManager):
+    """A user manager that saves it's data in a SQLite database.
+
+    Every user is a row of `users.sqlite3`, holding the user data as
+    JSON plus indexed copies of the name, id and email, so logging in,
+    registering or changing a user only touches that user's row. The
+    database runs in WAL mode, so requests reading users are not blocked
+    by a write.
+
+    If the database is empty and a `users.json` exists next to it, the
+    users are imported once and the file is renamed to
+    `users.json.migrated`.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        name TEXT PRIMARY KEY,
+        id TEXT,
+        email TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS users_id ON users (id);
+    CREATE INDEX IF NOT EXISTS users_email ON users (email);
+    """
+
+    #: databases that were set up by this process
+    _initialized = set()
+
+    def __init__(self, path):
+        super(SQLiteUserManager, self).__init__(path)
+        self.json_file = self.file
+        self.file = os.path.join(path, 'users.sqlite3')
+        self.db = sqlite3.connect(self.file, timeout=30, isolation_level=None)
+        if self.file not in self._initialized:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.executescript(self.SCHEMA)
+            self._migrate()
+            self._initialized.add(self.file)
+
+    def _migrate(self):
+        if not os.path.exists(self.json_file):
+            return
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            if self.db.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0:
+                users = UserManager(os.path.dirname(self.json_file)).read()
+                self.db.executemany(
+                    'INSERT INTO users (name, id, email, data) VALUES (?, ?, ?, ?)',
+                    [self._row(name, userdata) for name, userdata in users.items()])
+                os.replace(self.json_file, self.json_file + '.migrated')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def _row(name, userdata):
+        user_id = userdata.get('id')
+        return (name, None if user_id is None else str(user_id), userdata.get('email'),
+                json.dumps(userdata))
+
+    def read(self):
+        return {name: json.loads(data)
+                for name, data in self.db.execute('SELECT name, data FROM users')}
+
+    def write(self, data):
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.execute('DELETE FROM users')
+            self.db.executemany(
+                'INSERT INTO users (name, id, email, data) VALUES (?, ?, ?, ?)',
+                [self._row(name, userdata) for name, userdata in data.items()])
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def add_user(self, name, password, email, active=True, roles=[], authentication_method=None):
+        new_user = self._new_user_data(password, email, active, roles, authentication_method)
+        try:
+            self.db.execute('INSERT INTO users (name, id, email, data) VALUES (?, ?, ?, ?)',
+                            self._row(name, new_user))
+        except sqlite3.IntegrityError:
             return False
-        self.write(users)
-        return True
+        return User(self, name, new_user)
+
+    def add_users(self, users, replace=False):
+        conflict = 'DO UPDATE SET id = excluded.id, email = excluded.email, ' \
+            'data = excluded.data' if replace else 'DO NOTHING'
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = self.db.executemany(
+                'INSERT INTO users (name, id, email, data) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name) ' + conflict,
+                (self._row(name, userdata) for name, userdata in users.items()))
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+        return cursor.rowcount
+
+    def iter_users(self):
+        for name, data in self.db.execute('SELECT name, data FROM users ORDER BY name'):
+            yield name, json.loads(data)
+
+    def get_user(self, name):
+        return self._find_user('name', name)
+
+    def get_user_by_id(self, user_id):
+        return self._find_user('id', None if user_id is None else str(user_id))
+
+    def _find_user(self, column, value):
+        row = self.db.execute(
+            'SELECT name, data FROM users WHERE %s = ?' % column, (value,)).fetchone()
+        if row is None:
+            return None
+        return User(self, row[0], json.loads(row[1]))
+
+    def delete_user(self, name):
+        return self.db.execute('DELETE FROM users WHERE name = ?', (name,)).rowcount > 0
 
     def update(self, name, userdata):
-        data = self.read()
-        data[name] = userdata
-        self.write(data)
+        self.db.execute(
+            'INSERT INTO users (name, id, email, data) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET id = excluded.id, email = excluded.email, '
+            'data = excluded.data', self._row(name, userdata))
+
+
+def make_user_manager(path, backend='json'):
+    """Return the user manager for `backend`, 'json' for a `users.json`
+    in `path`, fine for a few users, or 'sqlite' for a database."""
+    if backend == 'sqlite':
+        return SQLiteUserManager(path)
+    return UserManager(path)
 
 
 
@@ -135,7 +466,11 @@ class UserRegistrationController:
             flash('Passwords do not match. Please enter matching passwords.', 'danger')
             return False
 
-        user_added = self.user_manager.add_user(username, password, email=email)
+        try:
+            user_added = self.user_manager.add_user(username, password, email=email)
+        except HasherBusy:
+            flash('Too many requests right now. Please try again in a moment.', 'danger')
+            return False
         if user_added:
             #print(f"User {username} added successfully!")
             flash('User added successfully!', 'success')
@@ -164,7 +499,8 @@ class User(object):
         self.manager.update(self.name, self.data)
 
     def is_authenticated(self):
-        return self.data.get('authenticated')
+        # kept by the session store, logging in does not change the account
+        return get_session_store().is_authenticated(self.name)
 
     def is_active(self):
         return self.data.get('active')
@@ -177,22 +513,35 @@ class User(object):
 
     def check_password(self, password):
         """Return True, return False, or raise NotImplementedError if the
-        authentication_method is missing or unknown."""
+        authentication_method is missing or unknown.
+
+        A correct password stored in cleartext or with outdated hash
+        parameters is hashed again with the current ones. Raises
+        HasherBusy when too many passwords are being checked at once."""
         authentication_method = self.data.get('authentication_method', None)
         if authentication_method is None:
             authentication_method = get_default_authentication_method()
         # See comment in UserManager.add_user about authentication_method.
+        hasher = get_password_hasher()
         if authentication_method == 'hash':
-            result = check_hashed_password(password, self.get('hash'))
+            result = hasher.verify(password, self.get('hash'))
+            rehash = result and hasher.needs_rehash(self.get('hash'))
         elif authentication_method == 'cleartext':
             result = (self.get('password') == password)
+            rehash = (result and has_app_context()
+                      and get_default_authentication_method() == 'hash')
         else:
             raise NotImplementedError(authentication_method)
+        if rehash:
+            self.data.pop('password', None)
+            self.data['authentication_method'] = 'hash'
+            self.data['hash'] = hasher.hash(password)
+            self.save()
         return result
 
 
 def get_default_authentication_method():
-    return current_app.config.get('DEFAULT_AUTHENTICATION_METHOD', 'cleartext')
+    return current_app.config.get('DEFAULT_AUTHENTICATION_METHOD', 'hash')
 
 
 def make_salted_hash(password, salt=None):
@@ -200,9 +549,9 @@ def make_salted_hash(password, salt=None):
         salt = os.urandom(64)
     d = hashlib.sha512()
     d.update(salt[:32])
-    d.update(password)
+    d.update(password.encode('utf-8'))
     d.update(salt[32:])
-    return binascii.hexlify(salt) + d.hexdigest()
+    return binascii.hexlify(salt).decode('ascii') + d.hexdigest()
 
 
 def check_hashed_password(password, salted_hash):
@@ -0,0 +1,65 @@
+"""
+    Zip Streaming
+    ~~~~~~~~~~~~~
+
+    Builds ZIP archives as a stream of chunks. The archive is written
+    into a write-only buffer that is drained after every chunk, so only
+    the chunk currently being compressed is ever held in memory and the
+    first bytes reach the client as soon as the first entry starts.
+"""
+import time
+import zipfile
+
+
+class _ChunkBuffer(object):
+    # deliberately has no tell() or seek(), zipfile then writes data
+    # descriptors instead of seeking back to patch the local headers
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+def stream_zip(entries):
+    """
+        Generates a ZIP archive chunk by chunk.
+
+        :param entries: an iterable of ``(name, chunks, compress_type,
+            size)`` tuples. `chunks` is an iterable of bytes making up
+            the entry, `compress_type` one of the :mod:`zipfile`
+            constants and `size` the uncompressed size if it is known
+            up front, otherwise None.
+
+        :returns: a generator of bytes
+    """
+    buffer = _ChunkBuffer()
+    archive = zipfile.ZipFile(buffer, 'w')
+    try:
+        for name, chunks, compress_type, size in entries:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = compress_type
+            if size is not None:
+                info.file_size = size
+            # without a known size zipfile cannot tell in advance whether
+            # the entry needs the zip64 extension
+            with archive.open(info, 'w', force_zip64=size is None) as dest:
+                for chunk in chunks:
+                    dest.write(chunk)
+                    for data in buffer.drain():
+                        yield data
+            for data in buffer.drain():
+                yield data
+    finally:
+        archive.close()
+    for data in buffer.drain():
+        yield data